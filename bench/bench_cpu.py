@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the per-call cost of the original j3_cpu /proc/stat parser
+with the persistent-fd j3lib.procfs.ProcStatReader.
+
+Usage:
+    python bench/bench_cpu.py [cpus ...]
+
+Runs against a synthetic /proc/stat for each specified CPU count
+(default: 4 64 192), plus the real /proc/stat of this machine.
+"""
+
+from __future__ import print_function
+from timeit import repeat
+
+import os
+import re
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fixtures import proc_stat
+from j3lib.procfs import ProcStatReader
+
+def legacy_get_stats(path):
+    # original j3_cpu.Py3status._get_stats
+    stats = []
+    with open(path) as f:
+        for line in f.readlines():
+            if re.search(r'^cpu\d', line):
+                cols = line.split()
+                stats.append({
+                    'total': sum(map(int, cols[1:])),
+                    'idle': int(cols[4]),
+                })
+    return stats
+
+def bench(label, path, number=200):
+    reader = ProcStatReader(path)
+    assert len(reader.read()) == len(legacy_get_stats(path))
+    legacy = min(repeat(lambda: legacy_get_stats(path), number=number, repeat=5))
+    fast = min(repeat(reader.read, number=number, repeat=5))
+    reader.close()
+    print('{:>16} {:>12.1f} {:>12.1f} {:>8.1f}x'.format(
+        label, legacy / number * 1e6, fast / number * 1e6, legacy / fast))
+
+def main(argv):
+    counts = [int(arg) for arg in argv] or [4, 64, 192]
+    print('{:>16} {:>12} {:>12} {:>9}'.format(
+        '/proc/stat', 'legacy us', 'reader us', 'speedup'))
+    for cpus in counts:
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(proc_stat(cpus))
+            bench('{} cpus'.format(cpus), path)
+        finally:
+            os.remove(path)
+    if os.path.exists('/proc/stat'):
+        bench('this machine', '/proc/stat')
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark each j3_* entry point against synthetic /proc and /sys trees.
+
+Usage:
+    python bench/bench_modules.py [--calls N] [--cpus N ...] [--disks N ...]
+        [--interfaces N ...] [--processes N ...] [entry ...]
+
+For each entry point (default: all), and each scale of the dimension
+it depends on, generates a fixture tree (see fixtures.py), advances its
+counters between calls, and reports per-call latency percentiles and
+the mean peak memory of a call: the most bytes traced by tracemalloc at
+any point during the call, beyond those traced before it (so memory freed
+and allocated again within a call is only counted once).
+"""
+
+from __future__ import print_function
+from time import sleep
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from fixtures import FixtureTree
+from j3lib import fs
+from j3lib.py3stub import Py3Stub
+
+CONFIG = {
+    'color_good': '#00FF00',
+    'color_degraded': '#FFFF00',
+    'color_bad': '#FF0000',
+}
+
+def _setup_cpu(mode):
+    def setup(module, tree):
+        module.mode = mode
+    return setup
+
+def _setup_netio(module, tree):
+    module.interfaces = '*'
+
+def _setup_top(sort):
+    def setup(module, tree):
+        module.sort = sort
+        module.format = '{cmdline} {cpu:.0f}% {rss:.0f}M'
+    return setup
+
+def _setup_weather(module, tree):
+    module.cache_file = ''
+    module.test_data = tree.path('/weather.json')
+    # run the initial (background) fetch so calls just render
+    module.j3_weather([], CONFIG)
+    while module.refreshing:
+        sleep(0.01)
+
+# entry point, module, method, scale dimension, setup
+ENTRIES = [
+    ('j3_cpu', 'j3_cpu', 'j3_cpu', 'cpus', _setup_cpu('max')),
+    ('j3_cpu:all', 'j3_cpu', 'j3_cpu', 'cpus', _setup_cpu('all')),
+    ('j3_cpu:core', 'j3_cpu', 'j3_cpu', 'cpus', _setup_cpu('core')),
+    ('j3_ram', 'j3_ram', 'j3_ram', None, None),
+    ('j3_swap', 'j3_ram', 'j3_swap', None, None),
+    ('j3_netio', 'j3_netio', 'j3_netio', 'interfaces', _setup_netio),
+    ('j3_diskio', 'j3_diskio', 'j3_diskio', 'disks', None),
+    ('j3_battery', 'j3_battery', 'j3_battery', None, None),
+    ('j3_pressure', 'j3_pressure', 'j3_pressure', None, None),
+    ('j3_top', 'j3_top', 'j3_top', 'processes', None),
+    ('j3_top:rss', 'j3_top', 'j3_top', 'processes', _setup_top('rss')),
+    ('j3_weather', 'j3_weather', 'j3_weather', None, _setup_weather),
+]
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def bench(entry, scales, calls):
+    label, module_name, method_name, dimension, setup = entry
+    module = __import__(module_name)
+    results = []
+
+    for scale in (scales[dimension] if dimension else [None]):
+        root = tempfile.mkdtemp(prefix='j3bench-')
+        try:
+            sizes = dict(cpus=1, disks=1, interfaces=2, processes=8)
+            if dimension:
+                sizes[dimension] = scale
+            tree = FixtureTree(root, **sizes)
+            fs.set_root(root)
+
+            instance = module.Py3status()
+            instance.py3 = Py3Stub()
+            # collect new data on every call
+            instance.cache_timeout = 0
+            if setup:
+                setup(instance, tree)
+            method = getattr(instance, method_name)
+            method([], CONFIG) # warm up
+
+            times = []
+            for _ in range(calls):
+                tree.tick()
+                start = timeit.default_timer()
+                method([], CONFIG)
+                times.append(timeit.default_timer() - start)
+            times.sort()
+
+            peak = 0
+            tracemalloc.start()
+            for _ in range(min(calls, 50)):
+                tree.tick()
+                if hasattr(tracemalloc, 'reset_peak'):
+                    tracemalloc.reset_peak()
+                else: # python < 3.9
+                    tracemalloc.stop()
+                    tracemalloc.start()
+                before = tracemalloc.get_traced_memory()[0]
+                method([], CONFIG)
+                peak += tracemalloc.get_traced_memory()[1] - before
+            tracemalloc.stop()
+
+            results.append((label, scale, times, peak / min(calls, 50)))
+        finally:
+            fs.set_root('')
+            shutil.rmtree(root)
+    return results
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--cpus', type=int, nargs='+', default=[1, 64, 1024])
+    parser.add_argument('--disks', type=int, nargs='+', default=[1, 64, 512])
+    parser.add_argument('--interfaces', type=int, nargs='+', default=[1, 200, 2000])
+    parser.add_argument('--processes', type=int, nargs='+', default=[100, 2000, 20000])
+    parser.add_argument('entries', nargs='*', help='entry points to run (default: all)')
+    args = parser.parse_args(argv)
+
+    scales = dict(cpus=args.cpus, disks=args.disks,
+        interfaces=args.interfaces, processes=args.processes)
+    entries = [e for e in ENTRIES if not args.entries or e[0] in args.entries]
+
+    print('{:<12} {:>6} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+        'entry', 'scale', 'p50 us', 'p90 us', 'p99 us', 'max us', 'peak B'))
+    for entry in entries:
+        for label, scale, times, peak in bench(entry, scales, args.calls):
+            print('{:<12} {:>6} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>12.0f}'.format(
+                label, scale or '-',
+                percentile(times, 50) * 1e6,
+                percentile(times, 90) * 1e6,
+                percentile(times, 99) * 1e6,
+                times[-1] * 1e6,
+                peak,
+            ))
+            sys.stdout.flush()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark the startup cost of each j3_* entry point: the time to import
+its module, and the time of its first call, in a fresh interpreter.
+
+Usage:
+    python bench/bench_startup.py [--runs N] [entry ...]
+
+For each entry point (default: all), runs N fresh python processes against
+a small synthetic /proc and /sys tree (see fixtures.py), and reports the
+median and max of each time. For j3_weather, the first call renders weather
+from a (stale) cache file and starts a background fetch from a local fake
+api server (see fake_owm.py); the time until that fetch completes is also
+reported, as it includes importing the http library.
+"""
+
+from __future__ import print_function
+from threading import Thread
+from time import sleep, time
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_here, '..'))
+sys.path.insert(0, _here)
+
+from fixtures import WEATHER, FixtureTree
+
+CONFIG = {
+    'color_good': '#00FF00',
+    'color_degraded': '#FFFF00',
+    'color_bad': '#FF0000',
+}
+
+def child(module_name, method_name, api_url):
+    # runs in a fresh process: only the fixtures are imported before timing
+    root = tempfile.mkdtemp(prefix='j3bench-')
+    try:
+        FixtureTree(root, cpus=4, disks=2, interfaces=2, processes=100)
+        os.environ['J3STATUS_ROOT'] = root
+        clock = timeit.default_timer
+
+        start = clock()
+        module = __import__(module_name)
+        imported = clock() - start
+
+        from j3lib.py3stub import Py3Stub
+        instance = module.Py3status()
+        instance.py3 = Py3Stub()
+        cached_time = 0
+        if module_name == 'j3_weather':
+            instance.api_url = api_url
+            instance.apikey = 'bench'
+            instance.cache_file = os.path.join(root, 'weather-{location}-{units}.json')
+            cached_time = time() - instance.cache_timeout - 1
+            with open(instance._get_cache_file(), 'w') as f:
+                json.dump({ 'time': cached_time, 'weather': dict(WEATHER, id=1) }, f)
+        method = getattr(instance, method_name)
+
+        start = clock()
+        method([], CONFIG)
+        first = clock() - start
+
+        fetched = None
+        if module_name == 'j3_weather':
+            while instance.weather_time == cached_time and clock() - start < 10:
+                sleep(0.001)
+            fetched = clock() - start
+            # let the refresh worker finish saving the cache file
+            # before its directory is removed
+            while instance.refreshing and clock() - start < 20:
+                sleep(0.001)
+        print(json.dumps({ 'import': imported, 'first': first, 'fetch': fetched }))
+    finally:
+        shutil.rmtree(root)
+
+def bench(entry, runs, api_url):
+    label, module_name, method_name = entry[:3]
+    results = []
+    for _ in range(runs):
+        output = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__),
+            '--child', module_name, method_name, api_url,
+        ])
+        results.append(json.loads(output.decode('utf-8').strip().split('\n')[-1]))
+    return results
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    parser.add_argument('entries', nargs='*', help='entry points to run (default: all)')
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(*args.child)
+        return
+
+    from bench_modules import ENTRIES
+    from fake_owm import FakeServer
+    server = FakeServer(verbose=False)
+    server_thread = Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+
+    entries = [e for e in ENTRIES if not args.entries or e[0] in args.entries]
+    print('{:<12} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'entry', 'import ms', 'max', 'first ms', 'max', 'fetch ms', 'max'))
+    for entry in entries:
+        results = bench(entry, args.runs, server.url)
+        columns = []
+        for key in ('import', 'first', 'fetch'):
+            values = sorted(r[key] for r in results if r[key] is not None)
+            if values:
+                columns.append('{:>10.1f} {:>10.1f}'.format(
+                    values[len(values) // 2] * 1e3, values[-1] * 1e3))
+            else:
+                columns.append('{:>10} {:>10}'.format('-', '-'))
+        print('{:<12} {}'.format(entry[0], ' '.join(columns)))
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
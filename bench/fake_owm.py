@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Fake openweathermap.org api server, for checking j3_weather requests
+without an api key or network access.
+
+Usage:
+    python bench/fake_owm.py [--port N] [--delay SECONDS]
+    python bench/fake_owm.py --check
+
+Serves the /weather (by 'q' or 'id') and /group (by 'id') endpoints with
+made-up weather for any city, and logs each request; point the api_url
+parameter of j3_weather at it (ie 'http://localhost:8000').
+
+Each response has ETag and Last-Modified validators, and a request whose
+If-None-Match (or else If-Modified-Since) header matches them gets a 304.
+With --check, serves on a free port just long enough to check that
+j3lib.owm.Client revalidates a repeated request, and keeps the cached body
+when it gets a 304.
+"""
+
+from __future__ import print_function
+from email.utils import formatdate, mktime_tz, parsedate_tz
+from threading import Thread
+from time import sleep, time
+
+import argparse
+import json
+import os
+import sys
+import zlib
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError: # python2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_here, '..'))
+sys.path.insert(0, _here)
+
+from fixtures import WEATHER
+
+# map of made-up city id to name of each city requested by name
+NAMES = {}
+
+def city_weather(city_id=None, name=None):
+    """
+    Returns made-up current weather of the city with the specified id
+    (or name, for which an id is made up).
+    """
+    if city_id is None:
+        city_id = str(zlib.crc32(name.encode('utf-8')) % 10000000)
+        NAMES[city_id] = name
+    name = NAMES.get(city_id) or 'City {}'.format(city_id)
+    weather = dict(WEATHER, id=int(city_id), name=name)
+    weather['main'] = dict(WEATHER['main'], temp=40 + int(city_id) % 30)
+    return weather
+
+class Handler(BaseHTTPRequestHandler):
+    def not_modified(self, etag):
+        """
+        Returns True if the validators of the request match
+        (If-None-Match takes precedence over If-Modified-Since).
+        """
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return etag in tags or '*' in tags
+        since = parsedate_tz(self.headers.get('If-Modified-Since') or '')
+        return since is not None and mktime_tz(since) >= self.server.modified
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        self.server.requests.append(self.path)
+        if self.server.delay:
+            sleep(self.server.delay)
+
+        if url.path.endswith('/group') and 'id' in params:
+            ids = params['id'][0].split(',')
+            body = { 'cnt': len(ids), 'list': [city_weather(city_id) for city_id in ids] }
+        elif url.path.endswith('/weather') and 'id' in params:
+            body = city_weather(params['id'][0])
+        elif url.path.endswith('/weather') and 'q' in params:
+            body = city_weather(name=params['q'][0].split(',')[0])
+        else:
+            self.send_error(404)
+            return
+
+        data = json.dumps(body, sort_keys=True).encode('utf-8')
+        etag = '"{:08x}"'.format(zlib.crc32(data) & 0xffffffff)
+        status = 304 if self.not_modified(etag) else 200
+        self.server.statuses.append(status)
+        self.send_response(status)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(self.server.modified, usegmt=True))
+        if status == 304:
+            self.end_headers()
+            return
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded fake api server; requests lists the path of each request,
+    and statuses the status code of each response.
+    """
+    daemon_threads = True
+
+    def __init__(self, port=0, delay=0, verbose=True):
+        HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.delay = delay
+        self.verbose = verbose
+        self.requests = []
+        self.statuses = []
+        # the made-up weather never changes (in whole seconds, as sent)
+        self.modified = int(time())
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+def check(library):
+    """
+    Checks that a repeated request of a Client using the specified library
+    is answered with a 304, and still returns the body of the first response.
+    """
+    from j3lib.owm import Client
+    server = FakeServer(verbose=False)
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        client = Client(library)
+        url = server.url + '/weather'
+        params = { 'q': 'Seattle' }
+        first = client.get(url, params, 'check', timeout=5)
+        second = client.get(url, params, 'check', timeout=5)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert server.statuses == [200, 304], server.statuses
+    assert second == first, second
+    print('{}: ok ({} then {})'.format(library, *server.statuses))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--delay', type=float, default=0,
+        help='seconds to wait before each response')
+    parser.add_argument('--check', action='store_true',
+        help='check that a revalidated response keeps the cached body, and exit')
+    args = parser.parse_args()
+    if args.check:
+        for library in ('urllib', 'requests'):
+            check(library)
+        return
+    server = FakeServer(args.port, args.delay)
+    print('serving on {}'.format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
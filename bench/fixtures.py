@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic /proc and /sys trees for benchmarking the j3 modules.
+
+Use with j3lib.fs.set_root (or the J3STATUS_ROOT environment variable)
+to point the modules at a generated tree instead of the real kernel files.
+"""
+
+import json
+import os
+
+def proc_stat(cpus, tick=0, intr_columns=None):
+    lines = []
+    def cpu_line(label, scale):
+        # user nice system idle iowait irq softirq steal guest guest_nice
+        base = [3, 1, 2, 10, 1, 1, 1, 1, 0, 0]
+        return '{} {}\n'.format(label, ' '.join(
+            str((100000 + tick * b) * scale) for b in base))
+    lines.append(cpu_line('cpu ', cpus))
+    lines.extend(cpu_line('cpu{}'.format(i), 1) for i in range(cpus))
+    # the intr line has one column per interrupt source
+    if intr_columns is None:
+        intr_columns = cpus * 16 + 512
+    lines.append('intr {} {}\n'.format(tick * 1000, ' '.join(['12345'] * intr_columns)))
+    lines.append('ctxt {}\nbtime 1600000000\nprocesses {}\n'.format(tick * 5000, tick))
+    lines.append('procs_running 2\nprocs_blocked 0\n')
+    lines.append('softirq {}\n'.format(' '.join(['12345'] * 11)))
+    return ''.join(lines)
+
+def proc_meminfo(tick=0):
+    kb = {
+        'MemTotal': 16000000,
+        'MemFree': 4000000 - tick % 1000,
+        'MemAvailable': 9000000 - tick % 1000,
+        'Buffers': 500000,
+        'Cached': 4000000,
+        'SwapCached': 0,
+        'Active': 6000000,
+        'Inactive': 3000000,
+        'SwapTotal': 8000000,
+        'SwapFree': 7000000 - tick % 1000,
+        'Dirty': 1000,
+        'Writeback': 0,
+        'AnonPages': 5000000,
+        'Mapped': 800000,
+        'Shmem': 400000,
+        'Slab': 600000,
+        'PageTables': 80000,
+        'CommitLimit': 16000000,
+        'Committed_AS': 20000000,
+        'VmallocTotal': 34359738367,
+        'HugePages_Total': 0,
+    }
+    return ''.join('{}: {:>15} kB\n'.format(k, v) for k, v in kb.items())
+
+def proc_pressure(resource, tick=0):
+    avg = (tick * 7 % 50) / 10
+    lines = ['some avg10={:.2f} avg60={:.2f} avg300={:.2f} total={}\n'.format(
+        avg, avg / 2, avg / 4, tick * 1000)]
+    if resource != 'cpu':
+        lines.append('full avg10={:.2f} avg60={:.2f} avg300={:.2f} total={}\n'.format(
+            avg / 2, avg / 4, avg / 8, tick * 500))
+    return ''.join(lines)
+
+def proc_pid_stat(pid, tick=0):
+    # busy processes (the first 64) use more cpu the lower their pid
+    busy = max(0, 64 - pid) * tick
+    return ('{pid} (proc {pid}) S 1 {pid} {pid} 0 -1 4194560 100 0 0 0 '
+        '{utime} {stime} 0 0 20 0 1 0 {start} 10000000 {rss} '
+        '18446744073709551615 1 1 0 0 0 0 0 0 0 0 0 0 17 0 0 0 0 0 0\n').format(
+        pid=pid, utime=1000 + busy, stime=100 + busy // 4, start=pid * 10, rss=pid % 997 * 10)
+
+def interface_names(count):
+    names = ['lo', 'eth0']
+    names.extend('veth{:x}'.format(0x1000 + i) for i in range(max(0, count - 2)))
+    return names[:count]
+
+def proc_net_dev(interfaces, tick=0):
+    lines = [
+        'Inter-|   Receive                                                |  Transmit\n',
+        ' face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed\n',
+    ]
+    for index, name in enumerate(interface_names(interfaces)):
+        rx = 1000000 + tick * (index + 1) * 1500
+        tx = 2000000 + tick * (index + 1) * 700
+        # an error every 10 ticks, and a dropped packet every 5
+        lines.append('{:>6}: {} {} {} {} 0 0 0 0 {} {} 0 {} 0 0 0 0\n'.format(
+            name, rx, rx // 1500, tick // 10, tick // 5, tx, tx // 700, tick // 5))
+    return ''.join(lines)
+
+def disk_names(count):
+    # each disk is followed by one partition
+    names = []
+    for index in range(count):
+        disk = 'nvme{}n1'.format(index)
+        names.append((disk, False))
+        names.append((disk + 'p1', True))
+    return names
+
+def disk_columns(index, tick=0):
+    ios = 1000 + tick * (index + 1)
+    return [
+        ios, 10, ios * 8, ios * 2, # reads, merged, sectors, ms
+        ios, 10, ios * 16, ios * 3, # writes, merged, sectors, ms
+        index % 4, ios, ios * 5, # in flight, io_ticks, weighted
+    ]
+
+def proc_diskstats(disks, tick=0):
+    lines = []
+    for index, (name, partition) in enumerate(disk_names(disks)):
+        cols = disk_columns(index, tick)
+        lines.append('{:>4} {:>7} {} {}\n'.format(
+            259, index, name, ' '.join(str(c) for c in cols)))
+    return ''.join(lines)
+
+WEATHER = {
+    'name': 'Seattle',
+    'dt': 1700000000,
+    'weather': [{ 'main': 'Clear' }],
+    'main': { 'temp': 50.2, 'humidity': 62, 'pressure': 1013 },
+    'wind': { 'speed': 5, 'deg': 350 },
+    'sys': { 'sunrise': 1699975000, 'sunset': 1700010000 },
+}
+
+class FixtureTree(object):
+    """
+    Generates a synthetic tree with the specified number of cpus, disks,
+    and network interfaces under root. Static sysfs files are written once;
+    call tick() to advance the counters in the procfs files.
+    """
+
+    def __init__(self, root, cpus=4, disks=2, interfaces=2, processes=8):
+        self.root = root
+        self.cpus = cpus
+        self.disks = disks
+        self.interfaces = interfaces
+        self.processes = processes
+        self.ticks = 0
+        self._write_static()
+        self.tick()
+
+    def path(self, name):
+        return os.path.join(self.root, name.lstrip('/'))
+
+    def write(self, name, content):
+        path = self.path(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # rewrite in place, so files held open see the new content
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def _write_static(self):
+        # two sockets (or one), each with one numa node, with 2 SMT siblings per core
+        sockets = 2 if self.cpus > 1 else 1
+        per_socket = max(1, self.cpus // sockets)
+        for cpu in range(self.cpus):
+            socket = min(sockets - 1, cpu // per_socket)
+            topology = '/sys/devices/system/cpu/cpu{}/topology/'.format(cpu)
+            self.write(topology + 'physical_package_id', '{}\n'.format(socket))
+            self.write(topology + 'core_id', '{}\n'.format((cpu % per_socket) // 2))
+        for node in range(sockets):
+            first = node * per_socket
+            last = self.cpus - 1 if node == sockets - 1 else first + per_socket - 1
+            self.write('/sys/devices/system/node/node{}/cpulist'.format(node),
+                '{}-{}\n'.format(first, last))
+
+        for index, (name, partition) in enumerate(disk_names(self.disks)):
+            stat = ' '.join('{:>8}'.format(c) for c in disk_columns(index))
+            if partition:
+                self.write('/sys/class/block/{}/partition'.format(name), '1\n')
+            else:
+                self.write('/sys/block/{}/stat'.format(name), stat + '\n')
+                self.write('/sys/class/block/{}/dev'.format(name), '259:{}\n'.format(index))
+
+        for name in interface_names(self.interfaces):
+            statistics = '/sys/class/net/{}/statistics/'.format(name)
+            self.write(statistics + 'rx_bytes', '1000000\n')
+            self.write(statistics + 'tx_bytes', '2000000\n')
+            for counter in ('packets', 'dropped', 'errors'):
+                self.write(statistics + 'rx_' + counter, '0\n')
+                self.write(statistics + 'tx_' + counter, '0\n')
+            self.write('/sys/class/net/{}/speed'.format(name), '1000\n')
+            self.write('/sys/class/net/{}/carrier'.format(name), '1\n')
+
+        battery = '/sys/class/power_supply/BAT0/'
+        self.write(battery + 'type', 'Battery\n')
+        self.write(battery + 'capacity', '66\n')
+        self.write(battery + 'status', 'Discharging\n')
+        self.write(battery + 'energy_now', '33000000\n')
+        self.write(battery + 'energy_full', '50000000\n')
+        self.write(battery + 'power_now', '8000000\n')
+        self.write(battery + 'uevent', ''.join([
+            'POWER_SUPPLY_NAME=BAT0\n',
+            'POWER_SUPPLY_TYPE=Battery\n',
+            'POWER_SUPPLY_STATUS=Discharging\n',
+            'POWER_SUPPLY_PRESENT=1\n',
+            'POWER_SUPPLY_POWER_NOW=8000000\n',
+            'POWER_SUPPLY_ENERGY_FULL=50000000\n',
+            'POWER_SUPPLY_ENERGY_NOW=33000000\n',
+            'POWER_SUPPLY_CAPACITY=66\n',
+        ]))
+        adapter = '/sys/class/power_supply/ADP0/'
+        self.write(adapter + 'type', 'Mains\n')
+        self.write(adapter + 'online', '0\n')
+        self.write(adapter + 'uevent', ''.join([
+            'POWER_SUPPLY_NAME=ADP0\n',
+            'POWER_SUPPLY_TYPE=Mains\n',
+            'POWER_SUPPLY_ONLINE=0\n',
+        ]))
+
+        for pid in range(1, self.processes + 1):
+            self.write('/proc/{}/stat'.format(pid), proc_pid_stat(pid))
+            self.write('/proc/{}/cmdline'.format(pid), 'proc\0--pid\0{}\0'.format(pid))
+
+        # the last allocated pid (only changes when processes start)
+        self.write('/proc/loadavg', '0.50 0.40 0.30 2/{0} {0}\n'.format(self.processes))
+        self.write('/weather.json', json.dumps(WEATHER))
+
+    def tick(self):
+        """
+        Advances the counters in the procfs files by one tick.
+        """
+        self.ticks += 1
+        self.write('/proc/stat', proc_stat(self.cpus, self.ticks))
+        self.write('/proc/meminfo', proc_meminfo(self.ticks))
+        self.write('/proc/net/dev', proc_net_dev(self.interfaces, self.ticks))
+        self.write('/proc/diskstats', proc_diskstats(self.disks, self.ticks))
+        # just the busy processes change
+        for pid in range(1, min(self.processes, 64) + 1):
+            self.write('/proc/{}/stat'.format(pid), proc_pid_stat(pid, self.ticks))
+        for resource in ('cpu', 'memory', 'io'):
+            self.write('/proc/pressure/' + resource, proc_pressure(resource, self.ticks))
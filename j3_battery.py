@@ -3,71 +3,324 @@
 Display the battery level.
 
 Configuration parameters:
-    - ac_info : path to adapter info (default: '/sys/class/power_supply/ADP0')
-    - battery_info : path to battery info (default: '/sys/class/power_supply/BAT0')
+    - ac_info : space-separated paths of adapters to check (default: '')
+        - '' to check all power supplies with an 'online' state that aren't batteries
+          (ie '/sys/class/power_supply/AC' or '/sys/class/power_supply/ADP0')
+    - battery_info : space-separated paths of batteries to check (default: '')
+        - '' to check all system batteries (ie '/sys/class/power_supply/BAT0')
+        - batteries and adapters are discovered again after a power supply is
+          added or removed (in events mode), or otherwise every minute
+        - multiple batteries are combined by energy (so a full 20Wh battery
+          and an empty 80Wh battery show 20%)
     - cache_timeout : seconds between battery checks (default: 5)
+    - events : true to check when the kernel reports a power supply change, instead of polling (default: False)
+        - falls back to polling every cache_timeout seconds if kernel uevents are unavailable
+    - events_timeout : seconds between battery checks in events mode, in case of a missed event (default: 600)
     - capacity_degraded : percent below which colored as degraded (default: 50)
     - capacity_bad : percent below which colored as bad (default: 15)
+    - estimate_window : seconds over which to average power draw for time estimates (default: 120)
     - format : display format (default: '{capacity}% {icon}')
+        - try '{capacity}% {icon} {remaining}' to show the time until empty or full
+        - format tokens :
+            - '{capacity}' : percent charged
+            - '{icon}' : block glyph of capacity, or charging indicator
+            - '{power}' : power draw (or charge rate) in watts
+            - '{remaining}' : time_to_empty when discharging, time_to_full when charging
+            - '{time_to_empty}' : estimated time (h:mm) until empty, if discharging
+            - '{time_to_full}' : estimated time (h:mm) until full, if charging
+            - '{debug}' : timing stats of this module (see j3lib.instrument)
+    - format_no_battery : display format when no battery is present (default: '')
+        - try 'AC {icon}' to show something on a desktop
 """
 
 from __future__ import division  # python2 compatibility
 from time import time
 
-import codecs
 import math
+import os
+import sys
+
+# make the shared j3lib package importable when loaded by py3status
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.insert(0, _here)
+
+from j3lib import fs, instrument
+from j3lib.interval import set_on_battery
+from j3lib.uevent import get_listener
 
 BLOCKS = [' ','_','▁','▂','▃','▄','▅','▆','▇','█']
 
+# seconds after which to discover power supplies again, in case
+# one was added or removed without a uevent (or when not listening)
+DISCOVER_TIMEOUT = 60
+
+POWER_SUPPLY = '/sys/class/power_supply'
+
+def _read_uevent(path):
+    # returns dict of the power supply properties (without the
+    # POWER_SUPPLY_ prefix) from one read of its uevent file
+    info = {}
+    for line in fs.read_bytes(path + '/uevent').decode('utf-8', 'replace').split('\n'):
+        key, _, value = line.partition('=')
+        if key.startswith('POWER_SUPPLY_'):
+            info[key[13:]] = value
+    if 'TYPE' not in info:
+        # uevent includes type only since linux 4.x
+        info['TYPE'] = fs.read_text(path + '/type').strip()
+    return info
+
+def _discover():
+    # returns list of (battery paths, adapter paths) of all power supplies
+    batteries = []
+    adapters = []
+    try:
+        names = sorted(fs.listdir(POWER_SUPPLY))
+    except OSError:
+        names = []
+    for name in names:
+        path = POWER_SUPPLY + '/' + name
+        try:
+            info = _read_uevent(path)
+        except (IOError, OSError):
+            continue # ignore power supply removed while listing
+        if info['TYPE'] == 'Battery':
+            # skip the batteries of peripherals (ie a wireless mouse)
+            if info.get('SCOPE') != 'Device':
+                batteries.append(path)
+        elif 'ONLINE' in info:
+            adapters.append(path)
+    return batteries, adapters
+
+def _get_energy(info):
+    # returns (energy now, energy full, power) in µWh and µW
+    if 'ENERGY_NOW' in info:
+        return (
+            int(info['ENERGY_NOW']),
+            int(info.get('ENERGY_FULL') or 0),
+            abs(int(info.get('POWER_NOW') or 0)),
+        )
+    # convert charge (µAh and µA) to energy with nominal voltage
+    if 'CHARGE_NOW' in info:
+        volts = int(info.get('VOLTAGE_MIN_DESIGN') or info.get('VOLTAGE_NOW') or 0) / 1e6
+        return (
+            int(info['CHARGE_NOW']) * volts,
+            int(info.get('CHARGE_FULL') or 0) * volts,
+            abs(int(info.get('CURRENT_NOW') or 0)) * volts,
+        )
+    # weight batteries reporting only capacity equally
+    return int(info.get('CAPACITY') or 0), 100, 0
+
+def _format_hours(hours):
+    if hours is None:
+        return ''
+    minutes = int(hours * 60 + 0.5)
+    return '{}:{:02d}'.format(minutes // 60, minutes % 60)
+
 class Py3status:
     # available configuration parameters
 
-    # path to ac info
-    ac_info = '/sys/class/power_supply/ADP0'
-    # path to battery info
-    battery_info = '/sys/class/power_supply/BAT0'
+    # paths to ac info ('' to find all adapters)
+    ac_info = ''
+    # paths to battery info ('' to find all batteries)
+    battery_info = ''
     # check for updates every 5 seconds
     cache_timeout = 5
     # display as degraded below 50% capacity
     capacity_degraded = 50
     # display as bad below 15% capacity
     capacity_bad = 15
+    # average power draw over the last 2 minutes
+    estimate_window = 120
+    # check when the kernel reports a change, instead of every cache_timeout
+    events = False
+    # in events mode, still check every 10 minutes
+    events_timeout = 600
     # format as 66% ⌁
     format = '{capacity}% {icon}'
 
-    def _read_info(self, path, name):
-        f = codecs.open(path + '/' + name, encoding='utf-8')
-        value = f.readline()
-        f.close()
-        return value
+    # show nothing when there's no battery
+    format_no_battery = ''
+
+    # internal state
+    # (fs generation, time, battery paths, adapter paths) last discovered
+    discovered = None
+    listener = None
+    last_values = None
+    # smoothed power draw (µW) while charging or discharging
+    power_average = None
+    power_charging = None
+    last_energy = None
+    last_time = None
+
+    def _get_devices(self, now):
+        if self.battery_info and self.ac_info:
+            return self.battery_info.split(), self.ac_info.split()
+        # discover again only after a power supply is added or removed
+        # (see _on_event), or after DISCOVER_TIMEOUT
+        discovered = self.discovered
+        if (discovered is None or discovered[0] != fs.generation()
+                or now - discovered[1] > DISCOVER_TIMEOUT):
+            discovered = self.discovered = (fs.generation(), now) + _discover()
+        return (
+            self.battery_info.split() or discovered[2],
+            self.ac_info.split() or discovered[3],
+        )
+
+    def _listen(self):
+        # returns true if listening for events
+        listener = get_listener()
+        if listener is not self.listener:
+            if self.listener:
+                self.listener.unsubscribe(self._on_event)
+            if listener:
+                listener.subscribe('power_supply', self._on_event)
+            self.listener = listener
+        return listener is not None
+
+    def _on_event(self, event):
+        if event.get('ACTION') in ('add', 'remove'):
+            self.discovered = None
+        # update display only if the ac or battery state shown has changed
+        # (ignoring frequent updates of other battery properties)
+        last = self.last_values
+        if last is not None and event.get('ACTION') == 'change':
+            shown = last.get(event.get('POWER_SUPPLY_NAME'))
+            if shown is None:
+                return # some other power supply (ie a wireless mouse)
+            key, value = shown
+            if event.get('POWER_SUPPLY_' + key) == value:
+                return
+        self.py3.update()
+
+    def _estimate(self, now, energy, power, charging):
+        """
+        Returns the smoothed power draw (or charge rate), averaged with
+        an exponentially weighted moving average over estimate_window,
+        using the reported power if available, otherwise the change in energy.
+        """
+        last_energy, last_time = self.last_energy, self.last_time
+        self.last_energy, self.last_time = energy, now
+
+        if charging is None:
+            self.power_average = None
+            return None
+        # start over when switching between charging and discharging
+        if charging != self.power_charging:
+            self.power_charging = charging
+            self.power_average = None
+            last_time = None
+
+        elapsed = now - last_time if last_time is not None else 0
+        if not power and elapsed > 0 and energy != last_energy:
+            power = abs(energy - last_energy) / elapsed * 3600
+        if not power:
+            return self.power_average
+
+        if self.power_average is None:
+            self.power_average = power
+        else:
+            weight = 1 - math.exp(-elapsed / (self.estimate_window or 1))
+            self.power_average += weight * (power - self.power_average)
+        return self.power_average
 
     def j3_battery(self, i3s_output_list, i3s_config):
-        capacity = int(self._read_info(self.battery_info, 'capacity'))
-        ac_online = int(self._read_info(self.ac_info, 'online'))
+        timer = instrument.start('j3_battery')
+        now = time()
+        batteries, adapters = self._get_devices(now)
+
+        last_values = {}
+        energy_now = energy_full = power = 0
+        present = 0
+        status = set()
+        for path in batteries:
+            try:
+                info = _read_uevent(path)
+            except (IOError, OSError):
+                continue # ignore battery removed
+            if info.get('PRESENT', '1') == '0':
+                continue # ignore empty battery bay
+            present += 1
+            battery_now, battery_full, battery_power = _get_energy(info)
+            energy_now += battery_now
+            energy_full += battery_full
+            power += battery_power
+            status.add(info.get('STATUS'))
+            last_values[info.get('NAME', os.path.basename(path))] = ('CAPACITY', info.get('CAPACITY'))
+
+        ac_online = None
+        for path in adapters:
+            try:
+                info = _read_uevent(path)
+            except (IOError, OSError):
+                continue # ignore adapter removed
+            online = info.get('ONLINE', '0')
+            ac_online = ac_online or online == '1'
+            last_values[info.get('NAME', os.path.basename(path))] = ('ONLINE', online)
+        if ac_online is None:
+            # no adapter found, so guess from battery status
+            ac_online = 'Discharging' not in status
+        self.last_values = last_values
+        timer.mark('collect')
+        # let other modules slow down on battery (see j3lib.interval)
+        set_on_battery(not ac_online)
+
+        capacity = int(round(100 * energy_now / energy_full)) if energy_full else 0
+        capacity = min(100, capacity)
+
+        charging = None
+        if 'Charging' in status:
+            charging = True
+        elif 'Discharging' in status:
+            charging = False
+        average = self._estimate(now, energy_now, power, charging)
+        time_to_empty = time_to_full = None
+        if average and charging is False:
+            time_to_empty = energy_now / average
+        elif average and charging:
+            time_to_full = max(0, energy_full - energy_now) / average
 
         icon = '⌁' # ⚡
-        if ac_online < 1:
+        if not ac_online:
             icon = BLOCKS[int(math.ceil(capacity/100*(len(BLOCKS)-1)))]
-        text = self.py3.safe_format(self.format, {
-            'capacity': capacity,
-            'icon': icon,
-        })
 
         color = i3s_config['color_good']
-        if capacity < self.capacity_degraded:
-            color = i3s_config['color_degraded']
+        if not present:
+            color = None # not a low battery, just none
         elif capacity < self.capacity_bad:
             color = i3s_config['color_bad']
+        elif capacity < self.capacity_degraded:
+            color = i3s_config['color_degraded']
+        timer.mark('compute')
+
+        text = self.py3.safe_format(self.format if present else self.format_no_battery, {
+            'capacity': capacity,
+            'icon': icon,
+            'power': '{:.1f}'.format((average or 0) / 1e6),
+            'remaining': _format_hours(time_to_empty if time_to_full is None else time_to_full),
+            'time_to_empty': _format_hours(time_to_empty),
+            'time_to_full': _format_hours(time_to_full),
+            'debug': timer.summary(),
+        })
+
+        timeout = self.cache_timeout
+        if self.events and self._listen():
+            timeout = self.events_timeout
 
-        return {
+        response = {
             'full_text': text,
             'color': color,
-            'cached_until': time() + self.cache_timeout,
+            'cached_until': now + timeout,
         }
+        timer.mark('format')
+        timer.stop()
+        return response
 
 if __name__ == "__main__":
     from time import sleep
+    from j3lib.py3stub import Py3Stub
     x = Py3status()
+    x.py3 = Py3Stub()
     config = {
         'color_good': '#00FF00',
         'color_degraded': '#FFFF00',
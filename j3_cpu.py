@@ -4,106 +4,318 @@ Display the CPU usage.
 
 Configuration parameters:
     - cache_timeout : seconds between rate checks (default: 1)
+    - cgroup : path of the cgroup v2 to check in 'cgroup' source (default: '')
+        - '' to check the cgroup of py3status itself
+        - or a path like '/user.slice/user-1000.slice'
     - colorize : true to colorize output (default: True)
-        - set color thresholds via rate_good/degraded/bad
+        - set color thresholds via rate_good/degraded/bad,
+          and per-state thresholds via user/system/iowait/irq/steal_degraded/bad
     - format : display format (default: 'CPU {icon}')
+        - try 'CPU {spark}' to show a sparkline of recent usage
+        - format tokens :
+            - '{icon}' : block glyph(s) of current usage
+            - '{spark}' : sparkline of usage over the last history_size checks
+            - '{avg}' : average percent usage over the last history_size checks
+            - '{peak}' : peak percent usage over the last history_size checks
+            - '{user}' : percent of time running user code (including nice and guest)
+            - '{system}' : percent of time running kernel code
+            - '{iowait}' : percent of time idle while waiting on I/O
+            - '{irq}' : percent of time servicing interrupts (hard and soft)
+            - '{softirq}' : percent of time servicing soft interrupts only
+            - '{steal}' : percent of time stolen by the hypervisor (for other VMs)
+            - '{guest}' : percent of time running guest VMs
+            - '{limit}' : number of CPUs (or CPU quota of the cgroup) usage is relative to
+            - '{throttled}' : percent of cgroup quota periods throttled (0 in 'procfs' source)
+            - '{debug}' : timing stats of this module (see j3lib.instrument)
+        - state percents (user to guest) are of the CPU with max usage
+          in 'max' mode, otherwise of all CPUs
+        - in 'cgroup' source, only user and system state percents are available
+    - history_size : number of checks to keep for spark/avg/peak (default: 10)
+    - buckets : number of groups to display in 'bucket' mode (default: 8)
     - mode : display mode (default: 'max')
         - 'max' to display just the CPU with max usage
         - 'avg' to display the average usage of all CPUs
         - 'all' to display each individual CPU
+        - 'socket' to display the average usage of each socket
+        - 'node' to display the average usage of each NUMA node
+        - 'core' to display the average usage of each core (SMT siblings)
+        - 'bucket' to display the average usage of `buckets` groups of CPUs
     - rate_good : threshold above which display is colorized as good (default: 10)
     - rate_degraded : threshold above which display is colorized as degraded (default: 40)
     - rate_bad : threshold above which display is colorized as bad (default: 90)
+    - source : where to read cpu usage (default: 'procfs')
+        - 'procfs' for the usage of the whole machine (from /proc/stat)
+        - 'cgroup' for the usage of the cgroup relative to its cpu.max quota
+          (ie inside a container), ignoring mode; falls back to 'procfs'
+          if the cgroup isn't available
+    - throttled_degraded : throttled percent above which colorized as degraded (default: 0)
+    - throttled_bad : throttled percent above which colorized as bad (default: 10)
+    - user_degraded : user percent above which colorized as degraded (default: 100)
+    - user_bad : user percent above which colorized as bad (default: 100)
+    - system_degraded : system percent above which colorized as degraded (default: 100)
+    - system_bad : system percent above which colorized as bad (default: 100)
+    - iowait_degraded : iowait percent above which colorized as degraded (default: 20)
+    - iowait_bad : iowait percent above which colorized as bad (default: 50)
+    - irq_degraded : irq percent above which colorized as degraded (default: 20)
+    - irq_bad : irq percent above which colorized as bad (default: 50)
+    - steal_degraded : steal percent above which colorized as degraded (default: 10)
+    - steal_bad : steal percent above which colorized as bad (default: 30)
 """
 
 from __future__ import division  # python2 compatibility
+from operator import add, sub
 from time import time
 
 import math
-import re
+import os
+import sys
+
+# make the shared j3lib package importable when loaded by py3status
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.insert(0, _here)
+
+from j3lib import instrument
+from j3lib.cgroup import get_cgroup, read_cpu
+from j3lib.history import RingBuffer
+from j3lib.procfs import BUSY_STATES, CPU_STATES, PROC_STAT, STATE_COUNT, CpuTimes
+from j3lib.sampler import SAMPLER
+from j3lib.topology import get_topology, group_getters, reload_topology
 
 BLOCKS = [' ','_','▁','▂','▃','▄','▅','▆','▇','█']
 
+GROUP_MODES = ['socket', 'node', 'core', 'bucket']
+
+# state percents shown and checked against thresholds
+# (with the /proc/stat columns summed into each)
+STATE_TOKENS = (
+    ('user', ('user', 'nice')),
+    ('system', ('system',)),
+    ('iowait', ('iowait',)),
+    ('irq', ('irq', 'softirq')),
+    ('softirq', ('softirq',)),
+    ('steal', ('steal',)),
+    ('guest', ('guest', 'guest_nice')),
+)
+STATE_INDEXES = [
+    (token, [CPU_STATES.index(state) for state in states])
+    for token, states in STATE_TOKENS
+]
+THRESHOLD_STATES = ('user', 'system', 'iowait', 'irq', 'steal')
+
+IDLE = CPU_STATES.index('idle')
+IOWAIT = CPU_STATES.index('iowait')
+
+def _percent(total, idle):
+    return 100 * (total - idle) / (total or 1)
+
+def _state_percents(deltas, total):
+    # returns dict of each state token to its percent of the total,
+    # given the change in each /proc/stat column (in CPU_STATES order)
+    total = total or 1
+    return dict(
+        (token, 100 * sum([deltas[i] for i in indexes]) / total)
+        for token, indexes in STATE_INDEXES
+    )
+
+def _block(percent):
+    return BLOCKS[int(math.ceil(percent/100*(len(BLOCKS)-1)))]
+
 class Py3status:
     # available configuration parameters
+    buckets = 8
     cache_timeout = 1
+    cgroup = ''
     colorize = True
     format = 'CPU {icon}'
+    #format = 'CPU {spark}'
+    history_size = 10
     mode = 'max'
     rate_good = 10
     rate_degraded = 40
     rate_bad = 90
+    source = 'procfs'
+    throttled_degraded = 0
+    throttled_bad = 10
+    user_degraded = 100
+    user_bad = 100
+    system_degraded = 100
+    system_bad = 100
+    iowait_degraded = 20
+    iowait_bad = 50
+    irq_degraded = 20
+    irq_bad = 50
+    steal_degraded = 10
+    steal_bad = 30
 
     # internal state
+    history = None
     last_stats = None
+    last_cgroup = None
+    groups = None
+    groups_key = None
 
     def _get_stats(self):
-        stats = []
-        with open('/proc/stat') as f:
-            for line in f.readlines():
-                if re.search(r'^cpu\d', line):
-                    cols = line.split()
-                    stats.append({
-                        'total': sum(map(int, cols[1:])),
-                        'idle': int(cols[4]),
-                    })
-        return stats
+        # collected once per tick for all instances (see j3lib.sampler)
+        return SAMPLER.sample('/proc/stat', PROC_STAT.read, self.cache_timeout / 2)[1]
 
-    def j3_cpu(self, i3s_output_list, i3s_config):
-        stats = self._get_stats()
-        last_stats = self.last_stats or stats
-        self.last_stats = stats
-
-        all_percent = []
-        max_percent = 0
-        sum_total = 0
-        sum_idle = 0
-
-        # calculate cpu used since last check
-        for index, cpu in enumerate(stats):
-            last_cpu = last_stats[index]
-            total = cpu['total'] - last_cpu['total']
-            idle = cpu['idle'] - last_cpu['idle']
-            sum_total += total
-            sum_idle += idle
-
-            percent = 100 - 100 * idle / (total or 1)
-            all_percent.append(percent)
-            if max_percent < percent:
-                max_percent = percent
+    def _get_groups(self, ids):
+        # group cpus only when the online cpus or grouping changes
+        key = (self.mode, self.buckets, ids.tobytes())
+        if self.groups_key != key:
+            topology = get_topology()
+            if self.mode != 'bucket' and any(i not in topology.sockets for i in ids):
+                topology = reload_topology()
+            self.groups = group_getters(topology.groups(ids, self.mode, self.buckets))
+            self.groups_key = key
+        return self.groups
+
+    def _get_cgroup_stats(self):
+        # returns (cgroup directory, timestamp, cpu.stat counters),
+        # or None if not available (to fall back to /proc/stat)
+        try:
+            path, root = get_cgroup(self.cgroup)
+            return (path,) + SAMPLER.sample(path + '/cpu.stat',
+                lambda: read_cpu(path, root), self.cache_timeout / 2)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _cgroup_usage(self, stats):
+        """
+        Returns the (percent usage, state percents, percent throttled)
+        of the cgroup since the last check, relative to its cpu limit.
+        """
+        last = self.last_cgroup
+        if last is None or last[0] != stats[0]:
+            last = stats # start over with a different cgroup
+        self.last_cgroup = stats
+        _, timestamp, info = stats
+        _, last_timestamp, last_info = last
+
+        # usec of cpu time available to the cgroup since last check
+        available = (timestamp - last_timestamp) / 1000 * info['limit']
+        def percent(key):
+            delta = info.get(key, 0) - last_info.get(key, 0)
+            return min(100, 100 * delta / available) if available > 0 else 0
+        states = dict((token, 0) for token, _ in STATE_TOKENS)
+        states['user'] = percent('user_usec')
+        states['system'] = percent('system_usec')
+
+        periods = info.get('nr_periods', 0) - last_info.get('nr_periods', 0)
+        throttled = info.get('nr_throttled', 0) - last_info.get('nr_throttled', 0)
+        return percent('usage_usec'), states, 100 * throttled / (periods or 1)
+
+    def _procfs_usage(self, stats):
+        """
+        Returns the (percent usage, block glyphs, state percents)
+        of the CPUs since the last check, according to the mode.
+        """
+        # keep our own copy of the last counters,
+        # since the arrays in stats are reused by the reader
+        last_stats = self.last_stats
+        if last_stats is None or last_stats.ids != stats.ids:
+            last_stats = self.last_stats = CpuTimes(len(stats))
+            last_stats.ids[:] = stats.ids
+            last_stats.states[:] = stats.states
+
+        # calculate cpu time in each state since last check,
+        # for all states of all cpus at once
+        deltas = list(map(sub, stats.states, last_stats.states))
+        last_stats.states[:] = stats.states
+        columns = [deltas[k::STATE_COUNT] for k in range(STATE_COUNT)]
+        totals = list(map(sum, zip(*columns[:BUSY_STATES])))
+        # time waiting on i/o is idle time (the cpu could run other work)
+        idles = list(map(add, columns[IDLE], columns[IOWAIT]))
+
+        sum_total = sum(totals)
+        sum_idle = sum(idles)
+        avg_percent = _percent(sum_total, sum_idle)
 
         if self.mode == 'max':
+            all_percent = list(map(_percent, totals, idles))
+            max_percent = max(all_percent) if all_percent else 0
             color_rate = max_percent
-            icon = BLOCKS[int(math.ceil(max_percent/100*(len(BLOCKS)-1)))]
-        elif self.mode == 'avg':
-            avg_percent = 100 - 100 * sum_idle / (sum_total or 1)
-            color_rate = avg_percent
-            icon = BLOCKS[int(math.ceil(avg_percent/100*(len(BLOCKS)-1)))]
+            icon = _block(max_percent)
+            cpu = all_percent.index(max_percent) if all_percent else 0
+            states = _state_percents(
+                deltas[cpu * STATE_COUNT:(cpu + 1) * STATE_COUNT] or [0] * STATE_COUNT,
+                totals[cpu] if totals else 0)
         else:
-            avg_percent = 100 - 100 * sum_idle / (sum_total or 1)
-            color_rate = avg_percent
-            icon = ''
-            for percent in all_percent:
-                icon += BLOCKS[int(math.ceil(percent/100*(len(BLOCKS)-1)))]
+            states = _state_percents(list(map(sum, columns)), sum_total)
+            if self.mode == 'avg':
+                color_rate = avg_percent
+                icon = _block(avg_percent)
+            elif self.mode in GROUP_MODES:
+                # sum the deltas of each group's cpus
+                color_rate = avg_percent
+                icon = ''.join([
+                    _block(_percent(sum(group(totals)), sum(group(idles))))
+                    for group in self._get_groups(stats.ids)
+                ])
+            else:
+                all_percent = list(map(_percent, totals, idles))
+                color_rate = avg_percent
+                icon = ''.join([_block(percent) for percent in all_percent])
+        return color_rate, icon, states
+
+    def j3_cpu(self, i3s_output_list, i3s_config):
+        timer = instrument.start('j3_cpu')
+        stats = self._get_cgroup_stats() if self.source == 'cgroup' else None
+        if stats is not None:
+            timer.mark('collect')
+            limit = stats[2]['limit']
+            color_rate, states, throttled = self._cgroup_usage(stats)
+            icon = _block(color_rate)
+        else:
+            stats = self._get_stats()
+            timer.mark('collect')
+            limit = len(stats)
+            color_rate, icon, states = self._procfs_usage(stats)
+            throttled = 0
+
+        # keep recent usage (of the same cpu measure used for color)
+        if not self.history or self.history.capacity != self.history_size:
+            self.history = RingBuffer(self.history_size)
+        self.history.append(color_rate)
+
+        timer.mark('compute')
 
         color = None
         if self.colorize:
-            if color_rate > self.rate_bad:
+            if color_rate > self.rate_bad or throttled > self.throttled_bad or any(
+                    states[state] > getattr(self, state + '_bad')
+                    for state in THRESHOLD_STATES):
                 color = i3s_config['color_bad']
-            elif color_rate > self.rate_degraded:
+            elif color_rate > self.rate_degraded or throttled > self.throttled_degraded or any(
+                    states[state] > getattr(self, state + '_degraded')
+                    for state in THRESHOLD_STATES):
                 color = i3s_config['color_degraded']
             elif color_rate > self.rate_good:
                 color = i3s_config['color_good']
 
-        return {
+        response = {
             'cached_until': time() + self.cache_timeout,
             'color': color,
-            'full_text': self.format.format(icon=icon),
+            'full_text': self.format.format(
+                icon=icon,
+                spark=self.history.sparkline(100, BLOCKS),
+                avg=self.history.mean(),
+                peak=self.history.peak(),
+                limit=limit,
+                throttled=throttled,
+                debug=timer.summary(),
+                **states
+            ),
         }
+        timer.mark('format')
+        timer.stop()
+        return response
 
 if __name__ == "__main__":
     from time import sleep
+    from j3lib.py3stub import Py3Stub
     x = Py3status()
+    x.py3 = Py3Stub()
     config = {
         'color_good': '#00FF00',
         'color_degraded': '#FFFF00',
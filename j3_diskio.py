@@ -3,7 +3,14 @@
 Display the current disk transfer rate.
 
 Configuration parameters:
+    - adaptive : true to check less often while idle (default: False)
+        - doubles the seconds between checks after each idle check, up to cache_timeout_max,
+          and goes back to cache_timeout as soon as a check sees any transfer
+    - battery_factor : multiplier for cache_timeout (and cache_timeout_max) on battery, adaptive or not (default: 1)
+        - try 2 to check half as often when j3_battery finds the AC adapter offline
     - cache_timeout : seconds between rate checks (default: 1)
+        - may be less than a second (ie 0.25)
+    - cache_timeout_max : max seconds between rate checks while idle in adaptive mode (default: 30)
     - colorize : true to colorize output (default: True)
         - set color thresholds via rate_good/degraded/bad
     - indicator_read : indicator for read rate (default: ⇑)
@@ -12,6 +19,7 @@ Configuration parameters:
     - format : display format (default: '{max} {device}{direction}')
         - try '{total} {device}' to show combined read and write totals
         - try '{read}⇑ {write}⇓ {device}' to show separate read and write totals
+        - try '{max} {device} {util:.0f}% {await:.1f}ms' to show saturation too
         - format tokens :
             - '{direction}' : icon indicating most-active direction (read or write)
             - '{device}' : device label (ie 'sda')
@@ -19,16 +27,38 @@ Configuration parameters:
             - '{total}' : combined rate of both read and write totals
             - '{read}' : read (trasmitted) rate
             - '{write}' : write (received) rate
-    - format_all_idle : display format when all devices are idle (default: 'idle net')
+            - '{spark}' : sparkline of total rate over the last history_size checks
+            - '{avg}' : average total rate over the last history_size checks
+            - '{peak}' : peak total rate over the last history_size checks
+            - '{debug}' : timing stats of this module (see j3lib.instrument)
+            - '{iops}' : combined read and write operations per second
+            - '{read_iops}' : read operations per second
+            - '{write_iops}' : write operations per second
+            - '{util}' : percent of time device was busy (like iostat %util)
+            - '{await}' : average milliseconds per operation, including queueing
+            - '{queue}' : average number of queued operations (like iostat aqu-sz)
+    - format_all_idle : display format when all devices are idle (default: 'idle disk')
     - format_idle : display format for an individual idle device (default: '')
         - try 'idle {device}' to display for each device something when idle
-    - devices: list of devices to check (default: 'eth0 wlan0')
+    - devices: list of devices to check (default: '* !loop* !ram* !zram* !sr* !fd*')
+        - may include glob patterns, and exclude patterns prefixed with '!'
+        - try 'sd* nvme*' to check just SATA/SCSI and NVMe disks
     - device_labels: list of labels to use to display device names (default: '')
         - try 'a b' to display 'a' instead of 'sda' and 'b' instead of 'sdb'
+        - labels are paired with the selected devices in order: by the first
+          pattern in devices each matches, then as listed by the kernel
+          (so list devices explicitly, like 'sda sdb', to label them reliably)
+    - include_partitions : true to also check partitions (default: False)
+    - include_dm : true to also check device-mapper devices, like LVM volumes (default: False)
+    - include_md : true to also check md (software RAID) devices (default: False)
+    - history_size : number of checks to keep for spark/avg/peak (default: 10)
     - mode : display mode (default: 'max')
         - 'max' to display just the most-active device
         - 'all' to display all devices
     - separation : separator to use when displaying multiple devices (default: '|')
+    - source : where to read device counters (default: 'procfs')
+        - 'procfs' to read all devices from /proc/diskstats in one read
+        - 'sysfs' to read each device from /sys/block/<device>/stat
     - rate_format : formatting of rate number (default: '{value:4.0f}{units}'
         - used by '{max}', '{total}', '{read}', and {'write'} totals in format parameter
         - uses units defined by rate_b/kb/mb/gb/tb parameters
@@ -40,15 +70,75 @@ Configuration parameters:
     - rate_good : threshold above which display is colorized as good (default: 1048576)
     - rate_degraded : threshold above which display is colorized as degraded (default: 10485760)
     - rate_bad : threshold above which display is colorized as bad (default: 104857600)
+    - util_degraded : %util above which display is colorized as degraded (default: 60)
+    - util_bad : %util above which display is colorized as bad (default: 90)
 """
 
 from __future__ import division  # python2 compatibility
 from time import time
 
+import os
+import sys
+
+# make the shared j3lib package importable when loaded by py3status
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.insert(0, _here)
+
+from j3lib import fs, instrument
+from j3lib.history import BLOCKS, RingBuffer
+from j3lib.interval import AdaptiveInterval, on_battery_scaled
+from j3lib.patterns import NameFilter
+from j3lib.procfs import read_diskstats
+from j3lib.rate import RateEngine, UnitFormatter
+from j3lib.sampler import SAMPLER
+
+# counters of each device, in order
+FIELDS = (
+    'read', 'write', 'total', 'reads', 'writes', 'ios',
+    'ticks', 'io_ticks', 'queue_ticks',
+)
+WIDTH = len(FIELDS)
+
+def _list_devices():
+    try:
+        return tuple(sorted(fs.listdir('/sys/block')))
+    except OSError:
+        return ()
+
+def _read_columns(device):
+    try:
+        return fs.read_bytes('/sys/block/{}/stat'.format(device)).split()
+    except IOError:
+        return None # ignore unavailable device
+
+def _get_kind(device):
+    if device.startswith('dm-'):
+        return 'dm'
+    if device.startswith('md'):
+        return 'md'
+    if fs.exists('/sys/class/block/{}/partition'.format(device)):
+        return 'partition'
+    return 'disk'
+
+def _convert(cols):
+    # returns counters (see FIELDS) from the columns of a diskstats line
+    read = int(cols[2]) * 512
+    write = int(cols[6]) * 512
+    reads = int(cols[0])
+    writes = int(cols[4])
+    return (
+        read, write, read + write, reads, writes, reads + writes,
+        int(cols[3]) + int(cols[7]), int(cols[9]), int(cols[10]),
+    )
+
 class Py3status:
     # available configuration parameters
 
+    adaptive = False
+    battery_factor = 1
     cache_timeout = 1
+    cache_timeout_max = 30
     colorize = True
     indicator_read = '⇑'   # ⬆ ⇑ ⇧ ▲ △
     indicator_write = '⇓' # ⬇ ⇓ ⇩ ▼ ▽
@@ -59,11 +149,17 @@ class Py3status:
     format_all_idle = 'idle disk'
     format_idle = ''
     #format_idle = 'idle {device}'
-    devices = 'sda'
+    devices = '* !loop* !ram* !zram* !sr* !fd*'
+    #devices = 'sd* nvme*'
     device_labels = ''
     #device_labels = 'a b'
+    include_partitions = False
+    include_dm = False
+    include_md = False
+    history_size = 10
     mode = 'max'
     separation = '|'
+    source = 'procfs'
     rate_format = '{value:4.0f}{units}'
     #rate_format = '{value:.0f}{units}'
     rate_b  = ' B/s'
@@ -74,125 +170,213 @@ class Py3status:
     rate_good = 2 << 19 # 1 MB/s
     rate_degraded = (2 << 19) * 10 # 10 MB/s
     rate_bad = (2 << 19) * 100 # 100 MB/s
+    util_degraded = 60
+    util_bad = 90
 
     # internal state
-    last_time = None
-    last_stats = None
+    engine = None
+    formatter = None
+    interval = None
+    histories = None
+    name_filter = None
+    device_kinds = None
+
+    def _get_devices(self, names):
+        if not self.name_filter or self.name_filter.patterns != self.devices:
+            self.name_filter = NameFilter(self.devices)
+            self.device_kinds = {}
+
+        # check the kind of each device only the first time it's seen
+        kinds = self.device_kinds
+        include = {
+            'disk': True,
+            'partition': self.include_partitions,
+            'dm': self.include_dm,
+            'md': self.include_md,
+        }
+        devices = []
+        for device in self.name_filter.select(names):
+            kind = kinds.get(device)
+            if kind is None:
+                kind = kinds[device] = _get_kind(device)
+            if include[kind]:
+                devices.append(device)
+        return devices
+
+    def _get_stats(self):
+        # returns list of selected devices, flat list of their counters
+        # (see FIELDS), and time of their snapshot (or list of times),
+        # collected once per tick for all instances (see j3lib.sampler)
+        max_age = self._get_engine().interval(self.cache_timeout) / 2
+        values = []
+
+        if self.source == 'sysfs':
+            names = SAMPLER.sample('/sys/block', _list_devices, max_age)[1]
+            devices = []
+            times = []
+            for device in self._get_devices(names):
+                timestamp, cols = SAMPLER.sample(
+                    '/sys/block/{}/stat'.format(device),
+                    lambda: _read_columns(device),
+                    max_age,
+                )
+                if cols:
+                    devices.append(device)
+                    values.extend(_convert(cols))
+                    times.append(timestamp)
+            return devices, values, times
 
-    def _get_stats(self, devices):
-        stats = {}
+        timestamp, (names, columns) = SAMPLER.sample('/proc/diskstats', read_diskstats, max_age)
+        devices = self._get_devices(names)
         for device in devices:
-            sd = stats[device] = { 'read': 0, 'write': 0 }
-            try:
-                fname = '/sys/block/{}/stat'.format(device)
-                with open(fname) as f:
-                    line = f.readline()
-                    cols = line.split()
-                    sd['read'] = int(cols[2]) * 512
-                    sd['write'] = int(cols[6]) * 512
-            except IOError:
-                pass # ignore unavailable device
-            sd['total'] = sd['read'] + sd['write']
-        return stats
-
-    def _format_bytes(self, b):
-        fmt = self.rate_format
-
-        x = b >> 10
-        if not x: return fmt.format(value=b, units=self.rate_b)
-        x = x >> 10
-        if not x: return fmt.format(value=b/(2<<10-1), units=self.rate_kb)
-        x = x >> 10
-        if not x: return fmt.format(value=b/(2<<20-1), units=self.rate_mb)
-        x = x >> 10
-        if not x: return fmt.format(value=b/(2<<30-1), units=self.rate_gb)
-
-        return fmt.format(value=b/(2<<40-1), units=self.rate_tb)
+            values.extend(_convert(columns[device]))
+        return devices, values, timestamp
+
+    def _get_history(self, device):
+        if self.histories is None:
+            self.histories = {}
+        history = self.histories.get(device)
+        if history is None or history.capacity != self.history_size:
+            history = self.histories[device] = RingBuffer(self.history_size)
+        return history
+
+    def _get_engine(self):
+        if self.engine is None:
+            self.engine = RateEngine(FIELDS)
+        return self.engine
+
+    def _get_interval(self, active):
+        # check again soon for the first rates of new devices
+        if self.engine.fresh:
+            return self.engine.interval(self.cache_timeout)
+        if not self.adaptive:
+            return on_battery_scaled(self.cache_timeout, self.battery_factor)
+        if self.interval is None:
+            self.interval = AdaptiveInterval()
+        return self.interval.next(
+            active, self.cache_timeout, self.cache_timeout_max, self.battery_factor)
+
+    def _get_formatter(self):
+        labels = (self.rate_b, self.rate_kb, self.rate_mb, self.rate_gb, self.rate_tb)
+        formatter = self.formatter
+        if not formatter or formatter.fmt != self.rate_format or formatter.labels != labels:
+            formatter = self.formatter = UnitFormatter(self.rate_format, labels)
+        return formatter
 
     def j3_diskio(self, i3s_output_list, i3s_config):
-        devices = self.devices.split()
+        timer = instrument.start('j3_diskio')
+        now = time()
+        devices, values, times = self._get_stats()
+        timer.mark('collect')
+
+        # pair labels with the selected devices (not the patterns)
         device_labels = dict(zip(devices, self.device_labels.split()))
 
-        # calculate the difference in seconds between last check and now
-        now = time()
-        last_time = self.last_time or now
-        self.last_time = now
-        diff_time = now - last_time
-        if diff_time < 1: diff_time = 1
-
-        stats = self._get_stats(devices)
-        last_stats = self.last_stats or stats
-        self.last_stats = stats
-        overall_max_total = 0
+        # calculate per-second rates since last check
+        rates = self.engine.update(devices, values, times)
+        # devices without a rate until the next check
+        fresh = self.engine.fresh
+        totals = rates[2::WIDTH]
+        # whether any counter changed since last check
+        active = any(rates)
+        for i, total in enumerate(totals):
+            if i not in fresh:
+                self._get_history(devices[i]).append(int(total))
 
-        # calculate bytes read/write/total since last check
-        diffs = {}
-        for device in devices:
-            di = diffs[device] = {}
-            si = stats[device]
-            li = last_stats[device]
-            for way in ['read', 'write', 'total']:
-                di[way] = int((si[way] - li[way]) / diff_time)
+        # like iostat, derive saturation from the time spent doing I/O
+        # (io_ticks in ms per second, so 1000 is 100% utilized)
+        utils = [min(100, ticks / 10) for ticks in rates[7::WIDTH]]
+        overall_max_util = max(utils) if utils else 0
+
+        # forget history of devices that have gone away
+        if self.histories and len(self.histories) > len(devices):
+            self.histories = dict((d, self.histories[d]) for d in devices if d in self.histories)
 
         # show only most-active device in 'max' mode
-        if self.mode == 'max':
-            device = max(diffs, key=lambda i: diffs[i]['total'])
-            diffs = { device: diffs[device] }
+        shown = range(len(devices))
+        if fresh:
+            shown = [i for i in shown if i not in fresh]
+        if self.mode == 'max' and shown:
+            shown = [max(shown, key=totals.__getitem__)]
+        overall_max_total = 0
+        timer.mark('compute')
 
         # build list of text for each device
+        formatter = self._get_formatter()
         text = []
-        for device in diffs:
-            di = diffs[device]
+        for i in shown:
+            device = devices[i]
+            row = rates[i * WIDTH:(i + 1) * WIDTH]
+            read, write, total, reads, writes, ios = [int(rate) for rate in row[:6]]
             # format stats for active device
-            if di['total']:
+            if total:
                 # determine most-active overall total number of bytes
-                if overall_max_total < di['total']:
-                    overall_max_total = di['total']
+                if overall_max_total < total:
+                    overall_max_total = total
+
+                history = self.histories[device]
 
                 # determine most-active direction for 'max' formatting
-                max_direction = 'write' if di['write'] > di['read'] else 'read'
-                max_value = di[max_direction]
-                max_icon = self.indicator_combined
-                if max_direction == 'read': max_icon = self.indicator_read
-                if max_direction == 'write': max_icon = self.indicator_write
+                max_value = write if write > read else read
+                max_icon = self.indicator_write if write > read else self.indicator_read
 
                 text.append(self.py3.safe_format(self.format, {
                     'device': device_labels.get(device) or device,
-                    'max': self._format_bytes(max_value),
+                    'max': formatter.format(max_value),
                     'direction': max_icon,
-                    'read': self._format_bytes(di['read']),
-                    'write': self._format_bytes(di['write']),
-                    'total': self._format_bytes(di['total']),
-                )))
+                    'read': formatter.format(read),
+                    'write': formatter.format(write),
+                    'total': formatter.format(total),
+                    'spark': history.sparkline(blocks=BLOCKS),
+                    'avg': formatter.format(history.mean()),
+                    'peak': formatter.format(history.peak()),
+                    'iops': ios,
+                    'read_iops': reads,
+                    'write_iops': writes,
+                    'util': utils[i],
+                    # ms per request, from ms spent on requests per second
+                    'await': row[6] / row[5] if row[5] else 0,
+                    # average requests in flight, from ms spent waiting per second
+                    'queue': row[8] / 1000,
+                    'debug': timer.summary(),
+                }))
             # show idle text for inactive device
             elif self.format_idle:
                 text.append(self.py3.safe_format(self.format_idle, {
                     'device': device_labels.get(device) or device,
-                )))
+                }))
 
-        # colorize output based on rate of most-active device
+        # colorize output based on rate of most-active device,
+        # or on %util of most-saturated device if worse
         color = None
         if self.colorize:
-            if overall_max_total > self.rate_bad:
+            if overall_max_total > self.rate_bad or overall_max_util > self.util_bad:
                 color = i3s_config['color_bad']
-            elif overall_max_total > self.rate_degraded:
+            elif overall_max_total > self.rate_degraded or overall_max_util > self.util_degraded:
                 color = i3s_config['color_degraded']
             elif overall_max_total > self.rate_good:
                 color = i3s_config['color_good']
 
-        return {
-            'cached_until': now + self.cache_timeout,
+        response = {
+            'cached_until': now + self._get_interval(active),
             'color': color,
             # show idle text if no active devices
-            'full_text': self.py3.composite_join(self.separation, text) or self.format_all_idle,
+            # (or nothing, until the first rates are available)
+            'full_text': self.py3.composite_join(self.separation, text) or (
+                '' if fresh and not shown else self.format_all_idle),
         }
+        timer.mark('format')
+        timer.stop()
+        return response
 
 if __name__ == "__main__":
     """
     Test this module by calling it directly.
     """
     from time import sleep
+    from j3lib.py3stub import Py3Stub
     x = Py3status()
+    x.py3 = Py3Stub()
     config = {
         'color_good': '#00FF00',
         'color_degraded': '#FFFF00',
@@ -3,9 +3,16 @@
 Display the current network transfer rate.
 
 Configuration parameters:
+    - adaptive : true to check less often while idle (default: False)
+        - doubles the seconds between checks after each idle check, up to cache_timeout_max,
+          and goes back to cache_timeout as soon as a check sees any transfer
+    - battery_factor : multiplier for cache_timeout (and cache_timeout_max) on battery, adaptive or not (default: 1)
+        - try 2 to check half as often when j3_battery finds the AC adapter offline
     - cache_timeout : seconds between rate checks (default: 1)
+        - may be less than a second (ie 0.25)
+    - cache_timeout_max : max seconds between rate checks while idle in adaptive mode (default: 30)
     - colorize : true to colorize output (default: True)
-        - set color thresholds via rate_good/degraded/bad
+        - set color thresholds via rate_good/degraded/bad, and link_degraded/bad
     - direction_up : indicator for upload rate (default: ⇑)
     - direction_down : indicator for download rate (default: ⇓)
     - direction_both : indicator for combined rate (default: ⇕)
@@ -19,16 +26,39 @@ Configuration parameters:
             - '{total}' : combined rate of both up and down totals
             - '{up}' : up (trasmitted) rate
             - '{down}' : down (received) rate
+            - '{link}' : percent of link speed used (by the busier direction), rounded to a whole percent
+            - '{speed}' : link speed in Mb/s (0 if unknown, ie wireless or virtual)
+            - '{packets}' : packets per second (up and down), rounded to a whole number
+            - '{packets_up}' : packets per second transmitted, rounded to a whole number
+            - '{packets_down}' : packets per second received, rounded to a whole number
+            - '{drops}' : packets dropped per second (up and down), rounded to one decimal
+            - '{errors}' : errors per second (up and down), rounded to one decimal
+            - '{spark}' : sparkline of total rate over the last history_size checks
+            - '{avg}' : average total rate over the last history_size checks
+            - '{peak}' : peak total rate over the last history_size checks
+            - '{debug}' : timing stats of this module (see j3lib.instrument)
     - format_all_idle : display format when all interfaces are idle (default: 'idle net')
     - format_idle : display format for an individual idle interface (default: '')
         - try 'idle {interface}' to display for each interface something when idle
     - interfaces: list of interfaces to check (default: 'eth0 wlan0')
+        - may include glob patterns, and exclude patterns prefixed with '!'
+        - try 'en* wl* !veth*' to check all ethernet and wireless interfaces
     - interface_labels: list of labels to use to display interface names (default: '')
         - try 'E W' to display 'E' instead of 'eth0' and 'W' instead of 'wlan0'
+        - labels are paired with the selected interfaces in order: by the first
+          pattern in interfaces each matches, then as listed by the kernel
+          (so list interfaces explicitly, like 'eth0 wlan0', to label them reliably)
+    - history_size : number of checks to keep for spark/avg/peak (default: 10)
+    - link_degraded : percent of link speed above which display is colorized as degraded (default: 50)
+    - link_bad : percent of link speed above which display is colorized as bad (default: 80)
     - mode : display mode (default: 'max')
         - 'max' to display just the most-active interface
         - 'all' to display all interfaces
     - separation : separator to use when displaying multiple interfaces (default: '|')
+    - source : where to read interface counters (default: 'procfs')
+        - 'procfs' to read all interfaces from /proc/net/dev in one read
+        - 'sysfs' to read each interface from /sys/class/net/<interface>/statistics
+          (just its rx_bytes and tx_bytes files, unless the format shows packets, drops, or errors)
     - rate_format : formatting of rate number (default: '{value:4.0f}{units}'
         - used by '{max}', '{total}', '{up}', and {'down'} totals in format parameter
         - uses units defined by rate_b/kb/mb/gb/tb parameters
@@ -43,12 +73,77 @@ Configuration parameters:
 """
 
 from __future__ import division  # python2 compatibility
+from itertools import chain
+from operator import add, itemgetter
 from time import time
 
+import os
+import sys
+
+# make the shared j3lib package importable when loaded by py3status
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.insert(0, _here)
+
+from j3lib import fs, instrument
+from j3lib.history import BLOCKS, RingBuffer
+from j3lib.interval import AdaptiveInterval, on_battery_scaled
+from j3lib.link import get_link_speeds
+from j3lib.patterns import NameFilter
+from j3lib.procfs import read_net_dev
+from j3lib.rate import RateEngine, UnitFormatter
+from j3lib.sampler import SAMPLER
+
+def _list_interfaces():
+    try:
+        return tuple(sorted(fs.listdir('/sys/class/net')))
+    except OSError:
+        return ()
+
+# counters of each interface, in order
+FIELDS = ('rx', 'tx', 'total', 'rx_packets', 'tx_packets', 'drops', 'errors')
+WIDTH = len(FIELDS)
+
+# /proc/net/dev columns of each interface's counters: rx and tx bytes,
+# rx and tx packets, rx and tx drops, and rx and tx errors
+PICK_COLUMNS = itemgetter(0, 8, 1, 9, 3, 11, 2, 10)
+
+# /proc/net/dev columns of just the rx and tx bytes
+PICK_BYTES = itemgetter(0, 8)
+
+# /sys/class/net/<interface>/statistics files read in 'sysfs' source
+# (the packet, drop, and error files only if shown)
+STATISTICS = (
+    'rx_bytes', 'tx_bytes', 'rx_packets', 'tx_packets',
+    'rx_dropped', 'tx_dropped', 'rx_errors', 'tx_errors',
+)
+
+# format tokens that need the packet, drop, and error counters
+COUNTER_TOKENS = ('{packets', '{drops', '{errors')
+
+def _read_stats(interface, counters=True):
+    # returns counters of interface (see FIELDS), with packets,
+    # drops, and errors left 0 unless counters is true
+    si = dict.fromkeys(STATISTICS, 0)
+    try:
+        for name in (STATISTICS if counters else STATISTICS[:2]):
+            fname = '/sys/class/net/{}/statistics/{}'.format(interface, name)
+            si[name] = int(fs.read_bytes(fname))
+    except IOError:
+        pass # ignore unavailable interface
+    return (
+        si['rx_bytes'], si['tx_bytes'], si['rx_bytes'] + si['tx_bytes'],
+        si['rx_packets'], si['tx_packets'],
+        si['rx_dropped'] + si['tx_dropped'], si['rx_errors'] + si['tx_errors'],
+    )
+
 class Py3status:
     # available configuration parameters
 
+    adaptive = False
+    battery_factor = 1
     cache_timeout = 1
+    cache_timeout_max = 30
     colorize = True
     direction_up = '⇑'   # ⬆ ⇑ ⇧ ▲ △
     direction_down = '⇓' # ⬇ ⇓ ⇩ ▼ ▽
@@ -62,8 +157,12 @@ class Py3status:
     interfaces = 'eth0 wlan0'
     interface_labels = ''
     #interface_labels = 'E W'
+    history_size = 10
+    link_degraded = 50
+    link_bad = 80
     mode = 'max'
     separation = '|'
+    source = 'procfs'
     rate_format = '{value:4.0f}{units}'
     #rate_format = '{value:.0f}{units}'
     rate_b  = ' B/s'
@@ -76,91 +175,177 @@ class Py3status:
     rate_bad = (2 << 19) * 100 # 100 MB/s
 
     # internal state
-    last_time = None
-    last_stats = None
-
-    def _get_stats(self, interfaces):
-        stats = {}
-        for interface in interfaces:
-            si = stats[interface] = { 'tx': 0, 'rx': 0 }
-            try:
-                for way in ['tx', 'rx']:
-                    fname = '/sys/class/net/{}/statistics/{}_bytes'.format(interface, way)
-                    with open(fname) as f:
-                        si[way] = int(f.readline())
-            except IOError:
-                pass # ignore unavailable interface
-            si['total'] = si['tx'] + si['rx']
-        return stats
-
-    def _format_bytes(self, b):
-        fmt = self.rate_format
-
-        x = b >> 10
-        if not x: return fmt.format(value=b, units=self.rate_b)
-        x = x >> 10
-        if not x: return fmt.format(value=b/(2<<10-1), units=self.rate_kb)
-        x = x >> 10
-        if not x: return fmt.format(value=b/(2<<20-1), units=self.rate_mb)
-        x = x >> 10
-        if not x: return fmt.format(value=b/(2<<30-1), units=self.rate_gb)
-
-        return fmt.format(value=b/(2<<40-1), units=self.rate_tb)
+    counters = None
+    engine = None
+    formatter = None
+    interval = None
+    histories = None
+    name_filter = None
+
+    def _get_interfaces(self, names):
+        if not self.name_filter or self.name_filter.patterns != self.interfaces:
+            self.name_filter = NameFilter(self.interfaces)
+        return self.name_filter.select(names)
+
+    def _uses_counters(self):
+        # whether the format shows packets, drops, or errors
+        # (worked out once per format)
+        if self.counters is None or self.counters[0] != self.format:
+            self.counters = (self.format, any(t in self.format for t in COUNTER_TOKENS))
+        return self.counters[1]
+
+    def _get_stats(self):
+        # returns list of selected interfaces, flat list of their counters
+        # (see FIELDS), and time of their snapshot (or list of times),
+        # collected once per tick for all instances (see j3lib.sampler)
+        max_age = self._get_engine().interval(self.cache_timeout) / 2
+        counters = self._uses_counters()
+        values = []
+
+        if self.source == 'sysfs':
+            names = SAMPLER.sample('/sys/class/net', _list_interfaces, max_age)[1]
+            interfaces = self._get_interfaces(names)
+            # sampled separately with and without the other counters
+            key = '/sys/class/net/{}/statistics' if counters else '/sys/class/net/{}/statistics/*_bytes'
+            times = []
+            for interface in interfaces:
+                timestamp, si = SAMPLER.sample(
+                    key.format(interface),
+                    lambda: _read_stats(interface, counters),
+                    max_age,
+                )
+                values.extend(si)
+                times.append(timestamp)
+            return interfaces, values, times
+
+        timestamp, (names, columns) = SAMPLER.sample('/proc/net/dev', read_net_dev, max_age)
+        interfaces = self._get_interfaces(names)
+        rows = [columns[interface] for interface in interfaces]
+        # convert the used columns of all selected interfaces in one pass
+        if not counters:
+            picked = list(map(int, chain.from_iterable(map(PICK_BYTES, rows))))
+            rx, tx = picked[0::2], picked[1::2]
+            zeros = [0] * len(rows)
+            values = list(chain.from_iterable(zip(
+                rx, tx, map(add, rx, tx), zeros, zeros, zeros, zeros)))
+            return interfaces, values, timestamp
+        picked = list(map(int, chain.from_iterable(map(PICK_COLUMNS, rows))))
+        rx, tx, rx_packets, tx_packets = [picked[k::8] for k in range(4)]
+        drops = map(add, picked[4::8], picked[5::8])
+        errors = map(add, picked[6::8], picked[7::8])
+        values = list(chain.from_iterable(zip(
+            rx, tx, map(add, rx, tx), rx_packets, tx_packets, drops, errors)))
+        return interfaces, values, timestamp
+
+    def _get_history(self, interface):
+        if self.histories is None:
+            self.histories = {}
+        history = self.histories.get(interface)
+        if history is None or history.capacity != self.history_size:
+            history = self.histories[interface] = RingBuffer(self.history_size)
+        return history
+
+    def _get_engine(self):
+        if self.engine is None:
+            self.engine = RateEngine(FIELDS)
+        return self.engine
+
+    def _get_interval(self, active):
+        # check again soon for the first rates of new interfaces
+        if self.engine.fresh:
+            return self.engine.interval(self.cache_timeout)
+        if not self.adaptive:
+            return on_battery_scaled(self.cache_timeout, self.battery_factor)
+        if self.interval is None:
+            self.interval = AdaptiveInterval()
+        return self.interval.next(
+            active, self.cache_timeout, self.cache_timeout_max, self.battery_factor)
+
+    def _get_formatter(self):
+        labels = (self.rate_b, self.rate_kb, self.rate_mb, self.rate_gb, self.rate_tb)
+        formatter = self.formatter
+        if not formatter or formatter.fmt != self.rate_format or formatter.labels != labels:
+            formatter = self.formatter = UnitFormatter(self.rate_format, labels)
+        return formatter
 
     def j3_netio(self, i3s_output_list, i3s_config):
-        interfaces = self.interfaces.split()
+        timer = instrument.start('j3_netio')
+        now = time()
+        interfaces, values, times = self._get_stats()
+        timer.mark('collect')
+
+        # pair labels with the selected interfaces (not the patterns)
         interface_labels = dict(zip(interfaces, self.interface_labels.split()))
 
-        # calculate the difference in seconds between last check and now
-        now = time()
-        last_time = self.last_time or now
-        self.last_time = now
-        diff_time = now - last_time
-        if diff_time < 1: diff_time = 1
-
-        stats = self._get_stats(interfaces)
-        last_stats = self.last_stats or stats
-        self.last_stats = stats
-        overall_max_total = 0
+        # calculate bytes (and packets) up/down/total per second since last check
+        rates = self.engine.update(interfaces, values, times)
+        # interfaces without a rate until the next check
+        fresh = self.engine.fresh
+        totals = rates[2::WIDTH]
+        # whether any counter changed since last check
+        active = any(rates)
+        for i, total in enumerate(totals):
+            if i not in fresh:
+                self._get_history(interfaces[i]).append(int(total))
 
-        # calculate bytes up/down/total since last check
-        diffs = {}
-        for interface in interfaces:
-            di = diffs[interface] = {}
-            si = stats[interface]
-            li = last_stats[interface]
-            for way in ['tx', 'rx', 'total']:
-                di[way] = int((si[way] - li[way]) / diff_time)
+        # forget history of interfaces that have gone away
+        if self.histories and len(self.histories) > len(interfaces):
+            self.histories = dict((d, self.histories[d]) for d in interfaces if d in self.histories)
 
         # show only most-active interface in 'max' mode
-        if self.mode == 'max':
-            interface = max(diffs, key=lambda i: diffs[i]['total'])
-            diffs = { interface: diffs[interface] }
+        shown = range(len(interfaces))
+        if fresh:
+            shown = [i for i in shown if i not in fresh]
+        if self.mode == 'max' and shown:
+            shown = [max(shown, key=totals.__getitem__)]
+        overall_max_total = 0
+        overall_max_link = 0
+        timer.mark('compute')
 
         # build list of text for each interface
+        formatter = self._get_formatter()
+        speeds = get_link_speeds()
         text = []
-        for interface in diffs:
-            di = diffs[interface]
+        for i in shown:
+            interface = interfaces[i]
+            row = rates[i * WIDTH:(i + 1) * WIDTH]
+            rx, tx, total = [int(rate) for rate in row[:3]]
             # format stats for active interface
-            if di['total']:
+            if total:
                 # determine most-active overall total number of bytes
-                if overall_max_total < di['total']:
-                    overall_max_total = di['total']
+                if overall_max_total < total:
+                    overall_max_total = total
+
+                # percent of link speed (in Mb/s) used by busier direction
+                speed = speeds.speed(interface)
+                link = 100 * max(rx, tx) * 8 / (speed * 1e6) if speed else 0
+                if overall_max_link < link:
+                    overall_max_link = link
+
+                history = self.histories[interface]
 
                 # determine most-active direction for 'max' formatting
-                max_direction = 'tx' if di['tx'] > di['rx'] else 'rx'
-                max_value = di[max_direction]
-                max_icon = self.direction_both
-                if max_direction == 'tx': max_icon = self.direction_up
-                if max_direction == 'rx': max_icon = self.direction_down
+                max_value = tx if tx > rx else rx
+                max_icon = self.direction_up if tx > rx else self.direction_down
 
                 text.append(self.py3.safe_format(self.format, {
                     'interface': interface_labels.get(interface) or interface,
-                    'max': self._format_bytes(max_value),
+                    'max': formatter.format(max_value),
                     'direction': max_icon,
-                    'up': self._format_bytes(di['tx']),
-                    'down': self._format_bytes(di['rx']),
-                    'total': self._format_bytes(di['total']),
+                    'up': formatter.format(tx),
+                    'down': formatter.format(rx),
+                    'total': formatter.format(total),
+                    'link': int(round(link)),
+                    'speed': speed,
+                    'packets': int(round(row[3] + row[4])),
+                    'packets_up': int(round(row[4])),
+                    'packets_down': int(round(row[3])),
+                    'drops': round(row[5], 1),
+                    'errors': round(row[6], 1),
+                    'spark': history.sparkline(blocks=BLOCKS),
+                    'avg': formatter.format(history.mean()),
+                    'peak': formatter.format(history.peak()),
+                    'debug': timer.summary(),
                 }))
             # show idle text for inactive interface
             elif self.format_idle:
@@ -171,26 +356,33 @@ class Py3status:
         # colorize output based on rate of most-active interface
         color = None
         if self.colorize:
-            if overall_max_total > self.rate_bad:
+            if overall_max_total > self.rate_bad or overall_max_link > self.link_bad:
                 color = i3s_config['color_bad']
-            elif overall_max_total > self.rate_degraded:
+            elif overall_max_total > self.rate_degraded or overall_max_link > self.link_degraded:
                 color = i3s_config['color_degraded']
             elif overall_max_total > self.rate_good:
                 color = i3s_config['color_good']
 
-        return {
-            'cached_until': now + self.cache_timeout,
+        response = {
+            'cached_until': now + self._get_interval(active),
             'color': color,
             # show idle text if no active interfaces
-            'full_text': self.py3.composite_join(self.separation, text) or self.format_all_idle,
+            # (or nothing, until the first rates are available)
+            'full_text': self.py3.composite_join(self.separation, text) or (
+                '' if fresh and not shown else self.format_all_idle),
         }
+        timer.mark('format')
+        timer.stop()
+        return response
 
 if __name__ == "__main__":
     """
     Test this module by calling it directly.
     """
     from time import sleep
+    from j3lib.py3stub import Py3Stub
     x = Py3status()
+    x.py3 = Py3Stub()
     config = {
         'color_good': '#00FF00',
         'color_degraded': '#FFFF00',
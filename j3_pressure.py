@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Display the pressure stall information (share of time tasks were stalled
+waiting on cpu, memory, or io).
+
+Configuration parameters:
+    - cache_timeout : seconds between checks while under pressure, or when polling (default: 5)
+    - cgroup : path of the cgroup v2 to check in 'cgroup' source (default: '')
+        - '' to check the cgroup of py3status itself
+        - or a path like '/user.slice/user-1000.slice'
+    - colorize : true to colorize output (default: True)
+        - set color thresholds via rate_good/degraded/bad
+    - events : true to check only when a kernel PSI trigger fires, instead of polling (default: True)
+        - keeps checking every cache_timeout seconds while pressure is above rate_good
+        - falls back to polling every cache_timeout seconds if triggers are unavailable
+    - events_timeout : seconds between checks in events mode, in case of a missed trigger (default: 600)
+    - format : display format (default: 'PSI {icon}')
+        - try 'PSI cpu {cpu:.0f}% mem {memory:.0f}% io {io:.0f}%'
+        - format tokens :
+            - '{icon}' : block glyph of each resource's pressure
+            - '{cpu}', '{memory}', '{io}' : percent of time some tasks were stalled
+              on the resource (over the last 10 seconds)
+            - '{cpu_full}', '{memory_full}', '{io_full}' : percent of time all
+              tasks were stalled on the resource (over the last 10 seconds)
+            - '{max}' : max percent of time some tasks were stalled on any resource
+            - '{debug}' : timing stats of this module (see j3lib.instrument)
+    - resources : space-separated resources to display (default: 'cpu memory io')
+    - rate_good : threshold above which display is colorized as good (default: 1)
+    - rate_degraded : threshold above which display is colorized as degraded (default: 10)
+    - rate_bad : threshold above which display is colorized as bad (default: 40)
+    - source : where to read pressure (default: 'procfs')
+        - 'procfs' for the pressure of the whole machine (from /proc/pressure)
+        - 'cgroup' for the pressure of the cgroup (from its *.pressure files);
+          falls back to 'procfs' if the cgroup isn't available
+    - trigger_stall : ms of stall within trigger_window that fires a trigger (default: 100)
+    - trigger_window : ms window of a trigger (default: 2000)
+        - must be a multiple of 2000 for triggers created without root
+"""
+
+from __future__ import division  # python2 compatibility
+from time import time
+
+import math
+import os
+import sys
+
+# make the shared j3lib package importable when loaded by py3status
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.insert(0, _here)
+
+from j3lib import fs, instrument
+from j3lib.cgroup import get_cgroup
+from j3lib.pressure import RESOURCES, get_watcher, pressure_path, read_pressure
+from j3lib.sampler import SAMPLER
+
+BLOCKS = [' ','_','▁','▂','▃','▄','▅','▆','▇','█']
+
+# seconds over which the displayed (avg10) pressure is averaged,
+# so after a trigger fires keep checking at least this long
+AVERAGE_SECONDS = 10
+
+def _block(percent):
+    return BLOCKS[int(math.ceil(min(100, percent)/100*(len(BLOCKS)-1)))]
+
+class Py3status:
+    # available configuration parameters
+    cache_timeout = 5
+    cgroup = ''
+    colorize = True
+    # check when a trigger fires, instead of every cache_timeout
+    events = True
+    # in events mode, still check every 10 minutes
+    events_timeout = 600
+    format = 'PSI {icon}'
+    #format = 'PSI cpu {cpu:.0f}% mem {memory:.0f}% io {io:.0f}%'
+    resources = 'cpu memory io'
+    rate_good = 1
+    rate_degraded = 10
+    rate_bad = 40
+    source = 'procfs'
+    trigger_stall = 100
+    trigger_window = 2000
+
+    # internal state
+    watcher = None
+    last_trigger = 0
+
+    def _get_paths(self):
+        # returns list of (resource, pressure file path) to check
+        cgroup_path = None
+        if self.source == 'cgroup':
+            try:
+                cgroup_path = get_cgroup(self.cgroup)[0]
+            except (IOError, OSError):
+                pass # fall back to the whole machine
+        return [
+            (resource, pressure_path(resource, cgroup_path))
+            for resource in self.resources.split()
+            if resource in RESOURCES
+        ]
+
+    def _get_stats(self, path):
+        # collected once per tick for all instances (see j3lib.sampler)
+        try:
+            return SAMPLER.sample(path,
+                lambda: read_pressure(path), self.cache_timeout / 2)[1]
+        except (IOError, OSError, ValueError):
+            return None # kernel without psi (or psi disabled)
+
+    def _watch(self, paths):
+        """
+        Registers triggers on the specified pressure files (if not
+        already registered); returns true if all are registered.
+        """
+        if fs.get_root():
+            return False # fixture files, not kernel files
+        watcher = get_watcher()
+        if watcher is not self.watcher:
+            if self.watcher:
+                self.watcher.unwatch(self._on_trigger)
+            self.watcher = watcher
+        if watcher is None:
+            return False
+        try:
+            for _, path in paths:
+                watcher.watch(path, self._on_trigger,
+                    int(self.trigger_stall * 1000), int(self.trigger_window * 1000))
+        except (IOError, OSError):
+            return False # not allowed, or invalid thresholds
+        return True
+
+    def _on_trigger(self):
+        self.last_trigger = time()
+        self.py3.update()
+
+    def j3_pressure(self, i3s_output_list, i3s_config):
+        timer = instrument.start('j3_pressure')
+        now = time()
+        paths = self._get_paths()
+        stats = [(resource, self._get_stats(path)) for resource, path in paths]
+        timer.mark('collect')
+
+        values = dict((resource, 0) for resource in RESOURCES)
+        values.update((resource + '_full', 0) for resource in RESOURCES)
+        icon = ''
+        for resource, pressure in stats:
+            if pressure is None:
+                continue
+            values[resource] = pressure.get('some', {}).get('avg10', 0)
+            values[resource + '_full'] = pressure.get('full', {}).get('avg10', 0)
+            icon += _block(values[resource])
+        rate = max([values[resource] for resource, _ in stats] or [0])
+        timer.mark('compute')
+
+        color = None
+        if self.colorize:
+            if rate > self.rate_bad:
+                color = i3s_config['color_bad']
+            elif rate > self.rate_degraded:
+                color = i3s_config['color_degraded']
+            elif rate > self.rate_good:
+                color = i3s_config['color_good']
+
+        text = ''
+        if icon:
+            text = self.py3.safe_format(self.format, dict(
+                values, icon=icon, max=rate, debug=timer.summary()))
+
+        # wait for the next trigger once pressure has calmed down
+        timeout = self.cache_timeout
+        watching = self.events and icon and self._watch(paths)
+        if watching and rate <= self.rate_good and now - self.last_trigger > AVERAGE_SECONDS:
+            timeout = self.events_timeout
+
+        response = {
+            'cached_until': now + timeout,
+            'color': color,
+            'full_text': text,
+        }
+        timer.mark('format')
+        timer.stop()
+        return response
+
+if __name__ == "__main__":
+    from time import sleep
+    from j3lib.py3stub import Py3Stub
+    x = Py3status()
+    x.py3 = Py3Stub()
+    config = {
+        'color_good': '#00FF00',
+        'color_degraded': '#FFFF00',
+        'color_bad': '#FF0000',
+    }
+    while True:
+        print(x.j3_pressure([], config))
+        sleep(1)
@@ -4,62 +4,122 @@ Display the RAM (and swap) usage.
 
 Configuration parameters:
     - cache_timeout : seconds between rate checks (default: 5)
+    - cgroup : path of the cgroup v2 to check in 'cgroup' source (default: '')
+        - '' to check the cgroup of py3status itself
+        - or a path like '/user.slice/user-1000.slice'
     - colorize : true to colorize output (default: True)
         - set color thresholds via rate_good/degraded/bad
     - ram_format : display format (default: 'RAM {:.1f} GB')
     - swap_format : display format (default: 'swap {:.1f} GB')
+        - format tokens :
+            - '{}' : used memory in GB
+            - '{percent}' : percent of total memory (or of the cgroup limit) used
+            - '{debug}' : timing stats of this module (see j3lib.instrument)
     - rate_good : threshold above which display is colorized as good (default: 0)
     - rate_degraded : threshold above which display is colorized as degraded (default: 50)
     - rate_bad : threshold above which display is colorized as bad (default: 90)
+    - source : where to read memory usage (default: 'procfs')
+        - 'procfs' for the usage of the whole machine (from /proc/meminfo)
+        - 'cgroup' for the usage of the cgroup (excluding reclaimable page cache)
+          relative to its memory.max and memory.swap.max limits (or to the
+          machine's memory if unlimited, and a swap total of 0 if the cgroup
+          may not swap); falls back to 'procfs' if the cgroup isn't available
 """
 
 from __future__ import division  # python2 compatibility
 from time import time
 
 import math
-import re
-import subprocess
+import os
+import sys
+
+# make the shared j3lib package importable when loaded by py3status
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.insert(0, _here)
+
+from j3lib import instrument
+from j3lib.cgroup import get_cgroup, read_memory
+from j3lib.procfs import read_meminfo
+from j3lib.sampler import SAMPLER
+
+def _read_stats():
+    info = read_meminfo()
+    total = info['MemTotal']
+
+    # use kernel estimate of memory available without swapping (linux 3.14+)
+    if 'MemAvailable' in info:
+        available = info['MemAvailable']
+    # or estimate it the old way, as free plus buffers/cache
+    else:
+        available = info['MemFree'] + info['Buffers'] + info['Cached']
+
+    return {
+        'ram': { 'total': total, 'used': total - available },
+        'swap': {
+            'total': info['SwapTotal'],
+            'used': info['SwapTotal'] - info['SwapFree'],
+        },
+    }
+
+def _read_cgroup_stats(path, root):
+    info = read_memory(path, root)
+    host = read_meminfo()
+
+    # like MemAvailable, count inactive page cache as reclaimable
+    used = max(0, info['current'] - info.get('inactive_file', 0))
+    # a limit of 0 (ie memory.swap.max = 0 for a cgroup that may not swap)
+    # is a total of 0, not unlimited
+    ram_max = info['max']
+    if ram_max is None:
+        ram_max = host['MemTotal'] * 1024
+    swap_max = info['swap_max']
+    if swap_max is None:
+        swap_max = host['SwapTotal'] * 1024
+    return {
+        'ram': {
+            'total': ram_max // 1024,
+            'used': used // 1024,
+        },
+        'swap': {
+            'total': swap_max // 1024,
+            'used': (info['swap_current'] or 0) // 1024,
+        },
+    }
 
 class Py3status:
     # available configuration parameters
     cache_timeout = 5
+    cgroup = ''
     colorize = True
     ram_format = 'RAM {:.1f} GB'
     swap_format = 'swap {:.1f} GB'
     rate_good = 0
     rate_degraded = 50
     rate_bad = 90
+    source = 'procfs'
 
     def _get_stats(self):
-        stats = {}
-        result = subprocess.check_output(['free', '-m'])
-        result = result.decode('utf-8').split()
-
-        mem_index = result.index('Mem:')
-        stats['ram'] = { 'total': int(result[mem_index + 1]) }
-
-        # use new 'available' column (free 3.3.10+)
-        if result.index('available') != -1:
-            available = int(result[mem_index + 6])
-            stats['ram']['used'] = stats['ram']['total'] - available
-        # use old '-/+ buffers/cache' row
-        else:
-            cache_index = result.index('buffers/cache:')
-            stats['ram']['used'] = int(result[cache_index + 1])
-
-        swap_index = result.index('Swap:')
-        stats['swap'] = {
-            'total': int(result[swap_index + 1]),
-            'used': int(result[swap_index + 2]),
-        }
-
-        return stats
+        # ram and swap (and all instances) share one collection per tick
+        if self.source == 'cgroup':
+            try:
+                path, root = get_cgroup(self.cgroup)
+                return SAMPLER.sample(path + '/memory.current',
+                    lambda: _read_cgroup_stats(path, root), self.cache_timeout / 2)[1]
+            except (IOError, OSError, ValueError):
+                pass # fall back to the whole machine
+        return SAMPLER.sample('/proc/meminfo', _read_stats, self.cache_timeout / 2)[1]
 
     def _get_status(self, i3s_config, mode):
+        timer = instrument.start('j3_' + mode)
         stats = self._get_stats()
+        timer.mark('collect')
 
-        used = stats[mode]['used'] / 1024
-        rate = 100 * stats[mode]['used'] / (stats[mode]['total'] or 1)
+        # convert kB to GB
+        used = stats[mode]['used'] / 1048576
+        total = stats[mode]['total']
+        rate = 100 * stats[mode]['used'] / total if total else 0
+        timer.mark('compute')
 
         color = None
         if self.colorize:
@@ -72,15 +132,18 @@ class Py3status:
 
         text = ''
         if mode == 'ram':
-            text = self.ram_format.format(used)
+            text = self.ram_format.format(used, percent=rate, debug=timer.summary())
         elif mode == 'swap':
-            text = self.swap_format.format(used)
+            text = self.swap_format.format(used, percent=rate, debug=timer.summary())
 
-        return {
+        response = {
             'cached_until': time() + self.cache_timeout,
             'color': color,
             'full_text': text,
         }
+        timer.mark('format')
+        timer.stop()
+        return response
 
     def j3_ram(self, i3s_output_list, i3s_config):
         if not self.ram_format:
@@ -94,7 +157,9 @@ class Py3status:
 
 if __name__ == "__main__":
     from time import sleep
+    from j3lib.py3stub import Py3Stub
     x = Py3status()
+    x.py3 = Py3Stub()
     config = {
         'color_good': '#00FF00',
         'color_degraded': '#FFFF00',
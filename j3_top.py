@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Display the top processes by CPU or memory usage.
+
+Configuration parameters:
+    - cache_timeout : seconds between checks (default: 2)
+    - colorize : true to colorize output (default: True)
+        - set color thresholds via rate_good/degraded/bad
+    - count : number of processes to display (default: 3)
+    - format : display format of each process (default: '{name} {cpu:.0f}%')
+        - try '{name} {rss:.0f}M' with sort 'rss' to show memory usage
+        - format tokens :
+            - '{pid}' : process id
+            - '{name}' : process name (ie 'firefox')
+            - '{cmdline}' : full command line (ie 'firefox -P work')
+            - '{cpu}' : percent of one CPU used since the last check of the process
+            - '{rss}' : resident memory in MB
+            - '{mem}' : resident memory as a percent of total RAM
+            - '{debug}' : timing stats of this module (see j3lib.instrument)
+    - rate_good : cpu (or mem) percent of the top process above which display is colorized as good (default: 10)
+    - rate_degraded : cpu (or mem) percent of the top process above which display is colorized as degraded (default: 50)
+    - rate_bad : cpu (or mem) percent of the top process above which display is colorized as bad (default: 90)
+    - scan_limit : max number of processes (besides the top ones) to check each time (default: 500)
+        - the top processes (and newly started ones) are checked every time,
+          and the others in turn, so an already running process that starts
+          using a lot of CPU may take up to (number of processes / scan_limit)
+          checks to show up (ie 40 checks with 20000 processes)
+    - separation : separator to use when displaying multiple processes (default: ' ')
+    - sort : what to rank processes by (default: 'cpu')
+        - 'cpu' for CPU usage
+        - 'rss' for resident memory
+"""
+
+from __future__ import division  # python2 compatibility
+from time import time
+
+import os
+import sys
+
+# make the shared j3lib package importable when loaded by py3status
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.insert(0, _here)
+
+from j3lib import instrument
+from j3lib.processes import get_process_table
+from j3lib.procfs import read_meminfo
+from j3lib.sampler import SAMPLER
+
+class Py3status:
+    # available configuration parameters
+    cache_timeout = 2
+    colorize = True
+    count = 3
+    format = '{name} {cpu:.0f}%'
+    #format = '{name} {rss:.0f}M'
+    rate_good = 10
+    rate_degraded = 50
+    rate_bad = 90
+    scan_limit = 500
+    separation = ' '
+    sort = 'cpu'
+
+    # internal state
+    mem_total = None
+
+    def _get_table(self):
+        # scanned once per tick for all instances (see j3lib.sampler);
+        # keep the next few processes hot too, so they're ranked fresh
+        table = get_process_table()
+        SAMPLER.sample('/proc/[pid]/stat',
+            lambda: table.scan(self.scan_limit, self.count * 2), self.cache_timeout / 2)
+        return table
+
+    def _get_mem_total(self):
+        # in bytes
+        if self.mem_total is None:
+            self.mem_total = read_meminfo(keys=('MemTotal',)).get('MemTotal', 0) * 1024
+        return self.mem_total
+
+    def j3_top(self, i3s_output_list, i3s_config):
+        timer = instrument.start('j3_top')
+        table = self._get_table()
+        timer.mark('collect')
+
+        key = 'rss' if self.sort == 'rss' else 'cpu'
+        top = table.top(self.count, key)
+        mem_total = self._get_mem_total() or 1
+        rate = 0
+        if top:
+            rate = top[0].cpu if key == 'cpu' else 100 * top[0].rss / mem_total
+        timer.mark('compute')
+
+        color = None
+        if self.colorize:
+            if rate > self.rate_bad:
+                color = i3s_config['color_bad']
+            elif rate > self.rate_degraded:
+                color = i3s_config['color_degraded']
+            elif rate > self.rate_good:
+                color = i3s_config['color_good']
+
+        debug = timer.summary()
+        # read command lines only if shown
+        with_cmdline = '{cmdline' in self.format
+        text = self.py3.composite_join(self.separation, [
+            self.py3.safe_format(self.format, {
+                'pid': entry.pid,
+                'name': entry.name,
+                'cmdline': table.cmdline(entry) if with_cmdline else '',
+                'cpu': entry.cpu,
+                'rss': entry.rss / 1048576,
+                'mem': 100 * entry.rss / mem_total,
+                'debug': debug,
+            })
+            for entry in top
+        ])
+
+        response = {
+            'cached_until': time() + self.cache_timeout,
+            'color': color,
+            'full_text': text,
+        }
+        timer.mark('format')
+        timer.stop()
+        return response
+
+if __name__ == "__main__":
+    from time import sleep
+    from j3lib.py3stub import Py3Stub
+    x = Py3status()
+    x.py3 = Py3Stub()
+    config = {
+        'color_good': '#00FF00',
+        'color_degraded': '#FFFF00',
+        'color_bad': '#FF0000',
+    }
+    while True:
+        print(x.j3_top([], config))
+        sleep(1)
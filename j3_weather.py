@@ -10,9 +10,25 @@ Once you signup, use the API key generated at signup to either:
    ~/.config/i3status/openweathermap-apikey
 3. same as 2), but at any file location configured via the `apikey_file` parameter
 
+Weather is fetched in the background, so the module always returns
+immediately with the last weather fetched (which is also saved to disk,
+so the last weather is shown right away when restarted).
+
+Once the city id of an instance's location is known (from its first
+fetch, its cache file, or a numeric location), the weather of every
+instance in the process with the same api key and units is fetched in one
+batched group request, and handed to each instance showing it.
+
 Configuration parameters:
+    - api_budget : max requests per minute for all instances using the same api key (default: 50)
+    - api_url : base url of openweathermap.org api (default: 'http://api.openweathermap.org/data/2.5')
     - apikey : openweathermap.org api key (default: empty)
     - apikey_file : path to file containing api key (default: ~/.config/i3status/openweathermap-apikey)
+        - read once, and again only when the file changes
+    - batch : true to fetch the weather of all instances in one request (default: True)
+        - only instances with the same api_url, api key, and units are batched together
+    - cache_file : path to file in which to save last weather fetched (default: ~/.cache/j3status/weather-{location}-{units}.json)
+        - set to '' to disable
     - cache_timeout : seconds between requests for weather updates (default: 1800)
     - direction_precision : wind direction precision (default: 2)
         - 1 : N E S W
@@ -28,12 +44,27 @@ Configuration parameters:
         - pressure : barometric pressure (eg '29.58')
         - direction : wind direction (eg 'NW')
         - wind : wind speed (eg '11')
+        - stale : stale_indicator if weather is stale, otherwise empty
+        - debug : timing stats of this module, including request latency (see j3lib.instrument)
+    - format_pending : display format until weather first fetched (default: '')
+    - http_library : library with which to send requests (default: 'requests')
+        - 'requests' to use the requests library (or 'urllib' if it isn't installed)
+        - 'urllib' to use just the python standard library
     - location : city,country of location for which to show weather (default: 'Seattle,US')
         - see http://openweathermap.org/city
+        - or a numeric city id (eg '5809844'), to batch right from the start
         - for US, a location like 'Springfield IL' will also work
     - request_timeout : seconds after which to abort request (default: 10)
+    - retry_timeout : seconds after which to retry a failed request (default: 60)
+        - doubled (with some random jitter) after each consecutive failure
+    - retry_timeout_max : max seconds after which to retry a failed request (default: 1800)
+    - stale_indicator : indicator for stale weather (default: '?')
+    - stale_timeout : seconds after which weather is stale (default: 7200)
+        - stale weather is colorized as degraded
     - timezone : timezone of location (default: 'America/Los_Angeles')
         - used to determine if it's currently day or night at the location
+        - '' for the local timezone
+        - looked up with zoneinfo (python 3.9+), or else dateutil
     - units : imperial or metric units (default: 'imperial')
         - imperial :
             - temperature : fahrenheit
@@ -46,11 +77,20 @@ Configuration parameters:
 """
 
 from datetime import datetime
-from dateutil import tz
-from os.path import expanduser
+from os.path import dirname, expanduser
+from threading import Lock, Thread
 from time import time
 import json
-import requests
+import os
+import sys
+
+# make the shared j3lib package importable when loaded by py3status
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.insert(0, _here)
+
+from j3lib import instrument
+from j3lib.owm import Backoff, get_client
 
 DIRECTIONS = {
     1: 'N E S W'.split(),
@@ -58,14 +98,42 @@ DIRECTIONS = {
     3: 'N NNE NE ENE E ESE SE SSE S SSW SW WSW W WNW NW NNW'.split(),
 }
 
+def _find_tzinfo(name):
+    """
+    Returns the tzinfo of the specified timezone (or the timezone itself,
+    if already a tzinfo), or None for the local timezone.
+    """
+    if not name:
+        return None
+    if not isinstance(name, str):
+        return name
+    try:
+        from zoneinfo import ZoneInfo # python 3.9+
+        return ZoneInfo(name)
+    except (ImportError, KeyError, ValueError):
+        pass # try dateutil (for older pythons, or its own aliases)
+    try:
+        from dateutil import tz
+        return tz.gettz(name)
+    except ImportError:
+        return None
+
 class Py3status:
     # available configuration parameters
 
+    # at most 50 requests per minute per api key (free plan allows 60)
+    api_budget = 50
+    # base url of api
+    api_url = 'http://api.openweathermap.org/data/2.5'
     # literal api key
     apikey = ''
     # or path to file containing api key
     apikey_file = '~/.config/i3status/openweathermap-apikey'
+    # fetch the weather of all instances with one request
+    batch = True
 
+    # save last weather fetched for next restart
+    cache_file = '~/.cache/j3status/weather-{location}-{units}.json'
     # check for updates every 1800 seconds (30 minutes)
     cache_timeout = 1800
     # at most 2 direction chars (ie NW)
@@ -73,6 +141,11 @@ class Py3status:
     # format as Seattle 50°F ☽ Clear 62%rh 30.25inHg N 5mph
     format = '{city} {temp}°F {icon} {sky} {humidity}%rh {pressure}inHg {direction} {wind}mph'
     #format = '{city} {temp}°C {icon} {sky} {humidity}%rh {pressure}hPa {direction} {wind}m/s'
+    # show nothing until weather first fetched
+    format_pending = ''
+    # send requests with the requests library
+    http_library = 'requests'
+    #http_library = 'urllib'
     # icons
     icon_sun = '☀'
     icon_moon = '☽'
@@ -88,39 +161,193 @@ class Py3status:
     location = 'Seattle,US'
     # abort request after 10 seconds
     request_timeout = 10
+    # retry failed request after 60 seconds, backing off to 1800 seconds
+    retry_timeout = 60
+    retry_timeout_max = 1800
+    # mark weather older than 7200 seconds (2 hours) as stale
+    stale_indicator = '?'
+    stale_timeout = 7200
     # use Pacific Time for calculating day/night
     timezone = 'America/Los_Angeles'
-    #timezone = tz.tzlocal()
+    #timezone = ''
     # use imperial units instead of metric
     units = 'imperial'
 
     test_data = ''#'/home/justin/able/weather.json'
 
+    # internal state
+    apikey_loaded = None
+    backoff = None
+    city_id = None
+    group = None
+    lock = None
+    tzinfo = None
+    weather = None
+    weather_time = 0
+    next_refresh = 0
+    refreshing = False
+
     def _load_apikey(self):
-        with open(expanduser(self.apikey_file)) as f:
-            return f.readline().rstrip()
+        # re-read only when the file changes (ie is replaced with a new key)
+        path = expanduser(self.apikey_file)
+        stat = os.stat(path)
+        stamp = (path, stat.st_mtime, stat.st_size)
+        if self.apikey_loaded is None or self.apikey_loaded[0] != stamp:
+            with open(path) as f:
+                self.apikey_loaded = (stamp, f.readline().rstrip())
+        return self.apikey_loaded[1]
+
+    def _get_client(self):
+        return get_client(self.http_library)
+
+    def _get_group(self):
+        # subscribes to the shared group of the city (once its id is known)
+        if not self.batch or not self.city_id:
+            return None
+        apikey = self.apikey or self._load_apikey()
+        group = self.group
+        if group is None or group.apikey != apikey:
+            if group is not None:
+                group.unsubscribe(self.city_id, self._on_weather)
+            group = self._get_client().group(self.api_url, apikey, self.units)
+            group.subscribe(self.city_id, self._on_weather)
+            self.group = group
+        return group
 
     def _get_weather(self):
+        # returns (time fetched, weather)
         if self.test_data != '':
             with open(self.test_data) as f:
-                return json.load(f)
+                return time(), json.load(f)
 
-        apikey = self.apikey or self._load_apikey()
-        url = (
-            'http://api.openweathermap.org/data/2.5/weather' +
-            '?q={location}&units={units}&APPID={apikey}'
-        ).format(location=self.location, units=self.units, apikey=apikey)
-        response = requests.get(url, timeout=self.request_timeout)
+        started = instrument.clock()
+        try:
+            group = self._get_group()
+            if group is not None:
+                return group.get(self.city_id, self.cache_timeout,
+                    self.request_timeout, self.api_budget, self._on_weather)
+
+            params = { 'units': self.units }
+            if self.city_id:
+                params['id'] = self.city_id
+            else:
+                params['q'] = self.location
+            weather = self._get_client().get(
+                '{}/weather'.format(self.api_url),
+                params,
+                self.apikey or self._load_apikey(),
+                self.request_timeout,
+                self.api_budget,
+            )
+            fetched = time()
+            # batch from now on, starting with this weather
+            self._set_city_id(weather)
+            if self._get_group() is not None:
+                self.group.store(self.city_id, fetched, weather)
+            return fetched, weather
+        finally:
+            instrument.observe('j3_weather', 'http', instrument.clock() - started)
 
-        if response.status_code != 200:
-            raise Exception('{status} error getting weather for {location}'.format(
-                status=response.status_code, location=self.location))
+    def _set_city_id(self, weather):
+        if not self.city_id and weather.get('id'):
+            self.city_id = str(weather['id'])
 
-        return response.json()
+    def _get_cache_file(self):
+        if not self.cache_file:
+            return ''
+        return expanduser(self.cache_file.format(
+            location=self.location.replace('/', '_'), units=self.units))
+
+    def _load_cache(self):
+        path = self._get_cache_file()
+        if not path:
+            return
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+            self.weather = cached['weather']
+            self.weather_time = cached['time']
+            self._set_city_id(self.weather)
+            self.next_refresh = self.weather_time + self.cache_timeout
+        except (IOError, OSError, ValueError, KeyError):
+            pass # ignore missing or corrupt cache
+
+    def _save_cache(self):
+        path = self._get_cache_file()
+        if not path:
+            return
+        try:
+            if not os.path.isdir(dirname(path)):
+                os.makedirs(dirname(path))
+            # write whole file before replacing old one
+            with open(path + '.tmp', 'w') as f:
+                json.dump({ 'time': self.weather_time, 'weather': self.weather }, f)
+            os.rename(path + '.tmp', path)
+        except (IOError, OSError):
+            pass # ignore unwritable cache
+
+    def _set_weather(self, fetched, weather):
+        with self.lock:
+            if fetched < self.weather_time:
+                return False # already have newer weather
+            self.backoff.success()
+            self.weather = weather
+            self.weather_time = fetched
+            self.next_refresh = fetched + self.cache_timeout
+        self._save_cache()
+        return True
+
+    def _on_weather(self, fetched, weather):
+        # weather of this city fetched by another instance's group request
+        if self._set_weather(fetched, weather):
+            self._update()
+
+    def _update(self):
+        # update display right away when running under py3status
+        if hasattr(self, 'py3') and hasattr(self.py3, 'update'):
+            self.py3.update()
+
+    def _refresh(self):
+        try:
+            fetched, weather = self._get_weather()
+            if not self._set_weather(fetched, weather):
+                # the group only had weather older than that shown
+                # (ie from the cache file), so wait until it's refreshed
+                with self.lock:
+                    self.next_refresh = max(self.next_refresh, fetched + self.cache_timeout)
+        except Exception as e:
+            # keep showing last weather fetched until retry,
+            # waiting at least as long as the server asked
+            with self.lock:
+                delay = self.backoff.failure(getattr(e, 'retry_after', None) or 0)
+                self.next_refresh = time() + delay
+        finally:
+            with self.lock:
+                self.refreshing = False
+                # never start another refresh right away (which would
+                # start one every tick), whatever the way out
+                now = time()
+                if self.next_refresh <= now:
+                    self.next_refresh = now + self.backoff.failure()
+            self._update()
+
+    def _start_refresh(self, now):
+        with self.lock:
+            if self.refreshing or now < self.next_refresh:
+                return
+            self.refreshing = True
+        worker = Thread(target=self._refresh)
+        worker.daemon = True
+        worker.start()
+
+    def _get_tzinfo(self):
+        # resolved once per timezone (None for local time)
+        if self.tzinfo is None or self.tzinfo[0] != self.timezone:
+            self.tzinfo = (self.timezone, _find_tzinfo(self.timezone))
+        return self.tzinfo[1]
 
     def _get_hour_of_day(self, timestamp):
-        dt = datetime.utcfromtimestamp(timestamp).replace(tzinfo=tz.tzutc())
-        return dt.astimezone(tz.gettz(self.timezone)).hour
+        return datetime.fromtimestamp(timestamp, self._get_tzinfo()).hour
 
     def _get_icon(self, weather):
         sky = weather['weather'][0]['main']
@@ -146,7 +373,7 @@ class Py3status:
         elif sky == 'Snow': return self.icon_snow
         elif sky == 'Thunderstorm': return self.icon_thunderstorm
 
-        return icon_unknown
+        return self.icon_unknown
 
     def _get_temp(self, weather):
         temp = float(weather['main']['temp'])
@@ -170,9 +397,45 @@ class Py3status:
         return directions[int((azimuth+(slice/2))/slice) % slices]
 
     def j3_weather(self, i3s_output_list, i3s_config):
-        weather = self._get_weather()
+        timer = instrument.start('j3_weather')
+        now = time()
+        if self.lock is None:
+            self.lock = Lock()
+            self.backoff = Backoff(self.retry_timeout, self.retry_timeout_max)
+            if self.location.isdigit():
+                self.city_id = self.location
+            self._load_cache()
+            try:
+                # join the group before the first refresh of any instance
+                self._get_group()
+            except (IOError, OSError):
+                pass # no api key yet; the refresh will fail and retry
+        self._start_refresh(now)
+
+        with self.lock:
+            weather = self.weather
+            weather_time = self.weather_time
+            refreshing = self.refreshing
+            next_refresh = self.next_refresh
+        timer.mark('collect')
+
+        # check back soon while waiting for a refresh
+        cached_until = now + 1 if refreshing else next_refresh
 
-        text = self.py3.safe_format(self.format, {
+        if weather is None:
+            timer.stop()
+            return {
+                'cached_until': cached_until,
+                'full_text': self.format_pending,
+            }
+
+        stale = now - weather_time > self.stale_timeout
+        if stale:
+            cached_until = min(cached_until, now + self.retry_timeout)
+        else:
+            cached_until = min(cached_until, weather_time + self.stale_timeout)
+
+        values = {
             'city': weather['name'],
             'icon': self._get_icon(weather),
             'sky': weather['weather'][0]['main'],
@@ -181,22 +444,36 @@ class Py3status:
             'pressure': self._get_pressure(weather),
             'wind': self._get_wind(weather),
             'direction': self._get_direction(weather),
-        })
+            'stale': self.stale_indicator if stale else '',
+            'debug': timer.summary(),
+        }
+        timer.mark('compute')
 
-        return {
-            'cached_until': time() + self.cache_timeout,
-            'full_text': text,
+        response = {
+            'cached_until': cached_until,
+            'full_text': self.py3.safe_format(self.format, values),
         }
+        if stale:
+            response['color'] = i3s_config['color_degraded']
+        timer.mark('format')
+        timer.stop()
+        return response
 
 if __name__ == "__main__":
     """
     Test this module by calling it directly.
     """
     from time import sleep
+    from j3lib.py3stub import Py3Stub
     x = Py3status()
+    x.py3 = Py3Stub()
     config = {
         'color_good': '#00FF00',
         'color_degraded': '#FFFF00',
         'color_bad': '#FF0000',
     }
+    # wait for first (background) fetch
+    x.j3_weather([], config)
+    while x.refreshing:
+        sleep(0.1)
     print(x.j3_weather([], config)['full_text'])
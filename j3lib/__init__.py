@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+Shared helpers for the j3status modules.
+
+py3status loads each configured module instance (ie `j3_netio#wan` and
+`j3_netio#lan`) from its source file separately, so module-level state in
+a j3_*.py file is never shared between instances. Anything that has to be
+shared process-wide lives in this package instead, which is imported the
+normal way (and so only once per process).
+
+Copy this directory alongside the j3_*.py modules you use.
+"""
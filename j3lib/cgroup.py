@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+CPU and memory usage of a cgroup v2 (ie a container, or a systemd slice),
+and the limits set on it (or on any of its parents).
+
+The readers raise IOError/OSError if the cgroup (or the controller)
+isn't available, so callers can fall back to the host-wide procfs files.
+"""
+
+from __future__ import division  # python2 compatibility
+from threading import Lock
+
+from j3lib import fs
+from j3lib.topology import CPU_ROOT, parse_cpulist
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+# v2 hierarchy is mounted at the root of CGROUP_ROOT (unified mode),
+# or under it (hybrid mode, alongside the v1 controllers)
+MOUNTS = (CGROUP_ROOT, CGROUP_ROOT + '/unified')
+
+CPU_STAT_KEYS = (
+    'usage_usec', 'user_usec', 'system_usec',
+    'nr_periods', 'nr_throttled', 'throttled_usec',
+)
+
+MEMORY_STAT_KEYS = ('anon', 'file', 'inactive_file', 'active_file')
+
+def current_cgroup(path='/proc/self/cgroup'):
+    """
+    Returns the path of the cgroup v2 of this process (ie '/user.slice'),
+    or None if not in a v2 hierarchy.
+    """
+    for line in fs.read_text(path).split('\n'):
+        if line.startswith('0::'):
+            return line[3:].strip()
+    return None
+
+def find_cgroup(cgroup=''):
+    """
+    Returns the directory of the specified cgroup v2 path
+    ('' for the cgroup of this process), and the directory of
+    the root of its hierarchy. Raises OSError if not found.
+    """
+    if not cgroup:
+        cgroup = current_cgroup()
+        if cgroup is None:
+            raise OSError('not in a cgroup v2 hierarchy')
+    for mount in MOUNTS:
+        if fs.exists(mount + '/cgroup.controllers'):
+            return (mount + '/' + cgroup.strip('/')).rstrip('/'), mount
+    raise OSError('no cgroup v2 hierarchy mounted')
+
+def _ancestors(path, root):
+    # yields the directory of the cgroup and of each parent below the root
+    while len(path) > len(root):
+        yield path
+        path = path.rpartition('/')[0]
+
+def _read_keyed(path, keys):
+    # returns dict of the specified keys to their values from a flat-keyed file
+    wanted = set(keys)
+    info = {}
+    for line in fs.read_bytes(path).split(b'\n'):
+        key, _, value = line.partition(b' ')
+        key = key.decode('ascii')
+        if key in wanted:
+            info[key] = int(value)
+    return info
+
+def _read_value(path):
+    # returns int value of a limit or counter file, or None if 'max' (or missing)
+    try:
+        value = fs.read_bytes(path).strip()
+    except (IOError, OSError):
+        return None
+    if not value or value == b'max':
+        return None
+    return int(value)
+
+def _online_cpus(path):
+    try:
+        return len(parse_cpulist(fs.read_text(path + '/cpuset.cpus.effective')))
+    except (IOError, OSError):
+        return len(parse_cpulist(fs.read_text(CPU_ROOT + '/online')))
+
+def read_cpu_limit(path, root):
+    """
+    Returns the number of CPUs the cgroup in the specified directory
+    may use: the tightest cpu.max quota of the cgroup and its parents
+    (ie 1.5 for '150000 100000'), or all its CPUs if there's no quota.
+    """
+    limit = None
+    for cgroup in _ancestors(path, root):
+        try:
+            quota, _, period = fs.read_bytes(cgroup + '/cpu.max').partition(b' ')
+        except (IOError, OSError):
+            continue # cpu controller not enabled at this level
+        if quota != b'max':
+            cpus = int(quota) / int(period or 100000)
+            limit = cpus if limit is None else min(limit, cpus)
+    if limit is None:
+        limit = _online_cpus(path)
+    return limit
+
+def read_cpu(path, root):
+    """
+    Returns a dict of the cpu.stat counters (in usec, or periods)
+    of the cgroup in the specified directory, plus its 'limit' in CPUs.
+    """
+    info = _read_keyed(path + '/cpu.stat', CPU_STAT_KEYS)
+    if 'usage_usec' not in info:
+        raise OSError('no usage in {}/cpu.stat'.format(path))
+    info['limit'] = read_cpu_limit(path, root)
+    return info
+
+def read_memory(path, root):
+    """
+    Returns a dict of the memory usage of the cgroup in the specified
+    directory, in bytes: 'current' (memory.current), 'max' (the tightest
+    memory.max of the cgroup and its parents, or None if unlimited),
+    'swap_current' and 'swap_max' (likewise for swap, None if unknown
+    or unlimited), and the MEMORY_STAT_KEYS of memory.stat.
+    """
+    info = _read_keyed(path + '/memory.stat', MEMORY_STAT_KEYS)
+    info['current'] = int(fs.read_bytes(path + '/memory.current'))
+    info['swap_current'] = _read_value(path + '/memory.swap.current')
+
+    for key in ('max', 'swap_max'):
+        limits = [
+            _read_value(cgroup + '/memory.' + key.replace('_', '.'))
+            for cgroup in _ancestors(path, root)
+        ]
+        limits = [limit for limit in limits if limit is not None]
+        info[key] = min(limits) if limits else None
+    return info
+
+_lock = Lock()
+# map of (fs generation, configured cgroup) to (directory, root)
+_found = {}
+
+def get_cgroup(cgroup=''):
+    """
+    Returns the (directory, root) of the specified cgroup v2 path
+    ('' for the cgroup of this process), looked up once per process.
+    Raises OSError if not found.
+    """
+    key = (fs.generation(), cgroup)
+    with _lock:
+        found = _found.get(key)
+        if found is None:
+            found = _found[key] = find_cgroup(cgroup)
+        return found
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Access to the kernel files (procfs and sysfs) read by the j3 modules.
+
+All reads go through this module, so the files can be read from
+a different root directory, like a synthetic tree of fixtures for
+benchmarks (set via set_root, or the J3STATUS_ROOT environment variable),
+or from a different source altogether, like a recorded trace
+(see j3lib.replay).
+"""
+
+import io
+import os
+
+class FileSource(object):
+    """
+    Reads files from the filesystem, under the specified root directory.
+    """
+
+    def __init__(self, root=''):
+        self.root = (root or '').rstrip('/')
+
+    def path(self, name):
+        if self.root and name.startswith('/'):
+            return self.root + name
+        return name
+
+    def open_raw(self, name):
+        return io.FileIO(self.path(name), 'r')
+
+    def read_bytes(self, name):
+        with io.FileIO(self.path(name), 'r') as f:
+            return f.read()
+
+    def listdir(self, name):
+        return os.listdir(self.path(name))
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+_source = FileSource(os.environ.get('J3STATUS_ROOT', ''))
+# incremented whenever the source changes, so open files can be reopened
+_generation = 0
+
+def get_root():
+    return getattr(_source, 'root', '')
+
+def set_root(root):
+    """
+    Reads all kernel files from under the specified root directory
+    ('' for the real /proc and /sys), discarding any cached snapshots.
+    """
+    set_source(FileSource(root))
+
+def get_source():
+    return _source
+
+def set_source(source):
+    """
+    Reads all kernel files through the specified source object
+    (which implements the FileSource methods), discarding any cached snapshots.
+    """
+    global _source, _generation
+    _source = source
+    _generation += 1
+
+    from j3lib.sampler import SAMPLER
+    SAMPLER.clear()
+
+def generation():
+    return _generation
+
+def path(name):
+    """
+    Returns the real path of the specified absolute path,
+    under the configured root directory.
+    """
+    return _source.path(name)
+
+def open_raw(name):
+    """
+    Returns an unbuffered binary file object for the specified path
+    (supporting at least seek, readinto, and close).
+    """
+    return _source.open_raw(name)
+
+def read_bytes(name):
+    """
+    Returns the full contents of the specified file as bytes.
+    """
+    return _source.read_bytes(name)
+
+def read_text(name):
+    """
+    Returns the full contents of the specified file as a string.
+    """
+    return read_bytes(name).decode('utf-8')
+
+def listdir(name):
+    return _source.listdir(name)
+
+def exists(name):
+    return _source.exists(name)
+
+# record everything read when running under py3status (see j3lib.replay)
+if os.environ.get('J3STATUS_RECORD'):
+    from j3lib.replay import start_recording
+    start_recording(os.environ['J3STATUS_RECORD'])
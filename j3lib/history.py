@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Fixed-memory history of recent samples.
+"""
+
+from __future__ import division  # python2 compatibility
+from array import array
+
+import math
+
+BLOCKS = [' ','_','▁','▂','▃','▄','▅','▆','▇','█']
+
+class RingBuffer(object):
+    """
+    Array-backed buffer of the last `capacity` samples of a metric.
+    Memory is allocated once up front, and appending a sample
+    (or calculating the mean or peak) allocates nothing.
+    """
+    __slots__ = ('values', 'count', 'next')
+
+    def __init__(self, capacity, typecode='d'):
+        self.values = array(typecode, [0]) * max(1, capacity)
+        self.count = 0
+        self.next = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def capacity(self):
+        return len(self.values)
+
+    def append(self, value):
+        self.values[self.next] = value
+        self.next += 1
+        if self.next == len(self.values):
+            self.next = 0
+        if self.count < len(self.values):
+            self.count += 1
+
+    def mean(self):
+        # unfilled slots are zero, so sum of all slots is sum of samples
+        return sum(self.values) / (self.count or 1)
+
+    def peak(self):
+        # samples are assumed non-negative (like rates or percentages)
+        return max(self.values)
+
+    def ordered(self):
+        """
+        Returns a list of the samples, oldest first.
+        """
+        if self.count < len(self.values):
+            return self.values[:self.count].tolist()
+        return self.values[self.next:].tolist() + self.values[:self.next].tolist()
+
+    def sparkline(self, ceiling=None, blocks=BLOCKS):
+        """
+        Returns a string of one block glyph per sample, oldest first,
+        scaled so the specified ceiling (or else the peak) is a full block.
+        """
+        ceiling = ceiling or self.peak() or 1
+        top = len(blocks) - 1
+        return ''.join([
+            blocks[min(top, int(math.ceil(value / ceiling * top)))]
+            for value in self.ordered()
+        ])
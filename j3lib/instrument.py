@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in instrumentation of the j3 module entry points.
+
+When enabled, each call of an entry point records its wall time
+(split into collect, compute, and format phases), the bytes read and
+files opened through j3lib.fs during the call, and (for j3_weather)
+the latency of each HTTP request, all in fixed-size histograms.
+A summary for each entry point is available as the '{debug}' format token,
+and all the histograms can be dumped periodically to a JSON file.
+
+Enable by setting the J3STATUS_STATS environment variable to the path
+of the JSON file to dump (and optionally J3STATUS_STATS_INTERVAL to the
+seconds between dumps, default 60), or by calling enable().
+When not enabled, the timers returned by start() do nothing.
+"""
+
+from __future__ import division  # python2 compatibility
+from array import array
+from threading import Lock, local
+from time import time
+
+import json
+import os
+
+from j3lib import fs
+
+try:
+    from time import perf_counter as clock
+except ImportError:
+    clock = time
+
+class Histogram(object):
+    """
+    Fixed-size histogram of non-negative integers, with four buckets
+    per power of two, so its percentiles are within 25% of the actual
+    values no matter how many values are recorded.
+    """
+
+    size = 128 # enough for values up to 2**33
+
+    def __init__(self):
+        self.counts = array('q', [0]) * self.size
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    @classmethod
+    def bucket(cls, value):
+        if value < 4:
+            return value
+        exponent = value.bit_length() - 3
+        return min(cls.size - 1, (exponent << 2) + (value >> exponent))
+
+    @staticmethod
+    def upper(bucket):
+        """
+        Returns the largest value counted in the specified bucket.
+        """
+        if bucket < 4:
+            return bucket
+        exponent = (bucket >> 2) - 1
+        return (((bucket & 3) + 5) << exponent) - 1
+
+    def add(self, value):
+        value = int(value)
+        if value < 0:
+            value = 0
+        self.counts[self.bucket(value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.max < value:
+            self.max = value
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0
+
+    def percentile(self, percent):
+        target = percent / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(self.max, self.upper(bucket))
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': round(self.mean(), 1),
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+class _Counts(local):
+    # bytes read and files opened by the current thread
+    # (py3status calls each module in its own thread)
+    bytes = 0
+    opens = 0
+
+_counts = _Counts()
+
+class _CountingFile(object):
+    def __init__(self, f):
+        self._file = f
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def readinto(self, buffer):
+        n = self._file.readinto(buffer)
+        _counts.bytes += n or 0
+        return n
+
+    def close(self):
+        self._file.close()
+
+class CountingSource(object):
+    """
+    File source that counts the bytes read and files opened
+    through another source.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.root = getattr(source, 'root', '')
+
+    def path(self, name):
+        return self.source.path(name)
+
+    def open_raw(self, name):
+        f = self.source.open_raw(name)
+        _counts.opens += 1
+        return _CountingFile(f)
+
+    def read_bytes(self, name):
+        _counts.opens += 1
+        data = self.source.read_bytes(name)
+        _counts.bytes += len(data)
+        return data
+
+    def listdir(self, name):
+        _counts.opens += 1
+        return self.source.listdir(name)
+
+    def exists(self, name):
+        return self.source.exists(name)
+
+_lock = Lock()
+_enabled = False
+# map of entry point name to map of measure name to Histogram
+_stats = {}
+_dump_file = ''
+_dump_interval = 60
+_next_dump = 0
+
+def _get_histogram(name, measure):
+    measures = _stats.get(name)
+    if measures is None:
+        measures = _stats[name] = {}
+    histogram = measures.get(measure)
+    if histogram is None:
+        histogram = measures[measure] = Histogram()
+    return histogram
+
+class Timer(object):
+    """
+    Times one call of an entry point. Call mark() at the end of each
+    phase, and stop() at the end of the call.
+    """
+    __slots__ = ('name', 'started', 'last', 'phases', 'bytes', 'opens')
+
+    def __init__(self, name):
+        self.name = name
+        self.phases = []
+        self.bytes = _counts.bytes
+        self.opens = _counts.opens
+        self.started = self.last = clock()
+
+    def mark(self, phase):
+        now = clock()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def stop(self):
+        elapsed = clock() - self.started
+        with _lock:
+            for phase, seconds in self.phases:
+                _get_histogram(self.name, phase).add(seconds * 1e6)
+            _get_histogram(self.name, 'total').add(elapsed * 1e6)
+            _get_histogram(self.name, 'bytes').add(_counts.bytes - self.bytes)
+            _get_histogram(self.name, 'opens').add(_counts.opens - self.opens)
+        _maybe_dump()
+
+    def summary(self):
+        return summary(self.name)
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def mark(self, phase):
+        pass
+
+    def stop(self):
+        pass
+
+    def summary(self):
+        return ''
+
+_NULL_TIMER = _NullTimer()
+
+def enabled():
+    return _enabled
+
+def enable(dump_file='', dump_interval=60):
+    """
+    Starts recording stats, dumping them to the specified JSON file
+    (if any) every dump_interval seconds. Reads are counted through the
+    current j3lib.fs source, so call again after changing the source.
+    """
+    global _enabled, _dump_file, _dump_interval, _next_dump
+    with _lock:
+        _dump_file = os.path.expanduser(dump_file or '')
+        _dump_interval = dump_interval
+        _next_dump = time() + dump_interval
+        _enabled = True
+    # (re)wrap the current source, in case it was changed since last enabled
+    if not isinstance(fs.get_source(), CountingSource):
+        fs.set_source(CountingSource(fs.get_source()))
+
+def start(name):
+    """
+    Returns a Timer for a call of the specified entry point
+    (or one that does nothing, if not enabled).
+    """
+    if not _enabled:
+        return _NULL_TIMER
+    return Timer(name)
+
+def observe(name, measure, seconds):
+    """
+    Records the specified duration (ie the latency of an HTTP request,
+    as the 'http' measure) for the specified entry point.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _get_histogram(name, measure).add(seconds * 1e6)
+
+def summary(name):
+    """
+    Returns a short summary of the stats for the specified entry point,
+    for display as the '{debug}' format token
+    (ie '0.3ms p99 1.2ms 4.0KB 2f', showing the median and 99th percentile
+    time per call, and the median bytes read and files opened per call).
+    """
+    if not _enabled:
+        return ''
+    with _lock:
+        measures = _stats.get(name)
+        if not measures:
+            return ''
+        total = measures['total']
+        text = '{:.1f}ms p99 {:.1f}ms {:.1f}KB {}f'.format(
+            total.percentile(50) / 1000,
+            total.percentile(99) / 1000,
+            measures['bytes'].percentile(50) / 1024,
+            measures['opens'].percentile(50),
+        )
+        http = measures.get('http')
+        if http and http.count:
+            text += ' http {:.0f}ms'.format(http.percentile(50) / 1000)
+        return text
+
+def snapshot():
+    """
+    Returns a dict of the stats of each entry point
+    (times in microseconds).
+    """
+    with _lock:
+        return dict(
+            (name, dict((m, h.to_dict()) for m, h in measures.items()))
+            for name, measures in _stats.items()
+        )
+
+def dump(path):
+    """
+    Writes the current stats to the specified JSON file.
+    """
+    data = { 'time': time(), 'units': 'us', 'entries': snapshot() }
+    try:
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # write whole file before replacing old one
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.rename(path + '.tmp', path)
+    except (IOError, OSError):
+        pass # ignore unwritable dump file
+
+def _maybe_dump():
+    global _next_dump
+    if not _dump_file:
+        return
+    now = time()
+    with _lock:
+        if now < _next_dump:
+            return
+        _next_dump = now + _dump_interval
+    dump(_dump_file)
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+if os.environ.get('J3STATUS_STATS'):
+    enable(os.environ['J3STATUS_STATS'], float(os.environ.get('J3STATUS_STATS_INTERVAL', 60)))
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive refresh intervals, and the power state they depend on.
+"""
+
+from threading import Lock
+
+_lock = Lock()
+_on_battery = False
+
+def on_battery():
+    """
+    Returns True if the last j3_battery check found the AC adapter offline
+    (False if on AC power, or if no j3_battery module is running).
+    """
+    return _on_battery
+
+def set_on_battery(value):
+    global _on_battery
+    with _lock:
+        _on_battery = bool(value)
+
+def on_battery_scaled(seconds, battery_factor=1):
+    """
+    Returns the specified interval multiplied by battery_factor
+    if running on battery (or else unchanged).
+    """
+    if _on_battery:
+        return seconds * battery_factor
+    return seconds
+
+class AdaptiveInterval(object):
+    """
+    Refresh interval that doubles after each idle check (up to a ceiling),
+    and snaps back to the base interval as soon as a check sees activity.
+    Both base and ceiling are multiplied by battery_factor
+    while running on battery.
+    """
+    __slots__ = ('current',)
+
+    growth = 2
+
+    def __init__(self):
+        self.current = None
+
+    def next(self, active, base, ceiling, battery_factor=1):
+        """
+        Returns the seconds until the next check,
+        given whether the last check saw any activity.
+        """
+        base = on_battery_scaled(base, battery_factor)
+        ceiling = on_battery_scaled(ceiling, battery_factor)
+        if active or self.current is None:
+            self.current = base
+        else:
+            self.current = max(base, min(ceiling, self.current * self.growth))
+        return self.current
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Link speeds of network interfaces, read from sysfs once and cached
+until the link changes (ie the carrier goes down or comes back up,
+possibly at a different speed).
+
+Link changes come from a rtnetlink socket subscribed to link messages,
+read by a background thread for the whole process; if that's unavailable
+(not linux, or not allowed), cached speeds expire after SPEED_TIMEOUT
+seconds instead.
+"""
+
+from threading import Lock, Thread
+
+import socket
+import struct
+
+from j3lib import fs
+from j3lib.sampler import monotonic_ns
+
+NETLINK_ROUTE = 0
+# multicast group of link messages
+RTMGRP_LINK = 1
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+IFLA_IFNAME = 3
+
+NLMSGHDR = struct.Struct('=IHHII')
+IFINFOMSG = struct.Struct('=BxHiII')
+RTATTR = struct.Struct('=HH')
+
+# seconds to cache speeds without rtnetlink
+SPEED_TIMEOUT = 60
+
+def _align(length):
+    return (length + 3) & ~3
+
+def parse_link_names(data):
+    """
+    Returns a list of the names of the interfaces in the link messages
+    (RTM_NEWLINK or RTM_DELLINK) of a raw rtnetlink datagram.
+    """
+    names = []
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, kind = NLMSGHDR.unpack_from(data, offset)[:2]
+        if length < NLMSGHDR.size:
+            break
+        if kind in (RTM_NEWLINK, RTM_DELLINK):
+            end = min(len(data), offset + length)
+            attr = offset + NLMSGHDR.size + IFINFOMSG.size
+            while attr + RTATTR.size <= end:
+                attr_length, attr_kind = RTATTR.unpack_from(data, attr)
+                if attr_length < RTATTR.size:
+                    break
+                if attr_kind == IFLA_IFNAME:
+                    name = data[attr + RTATTR.size:attr + attr_length].split(b'\0')[0]
+                    names.append(name.decode('utf-8', 'replace'))
+                    break
+                attr += _align(attr_length)
+        offset += _align(length)
+    return names
+
+class RtnetlinkSource(object):
+    """
+    Receives link change messages from a rtnetlink socket.
+    """
+
+    buffer_size = 65536
+
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        self.socket.bind((0, RTMGRP_LINK))
+
+    def receive(self):
+        """
+        Blocks until the next message; returns the names of the changed interfaces.
+        """
+        return parse_link_names(self.socket.recv(self.buffer_size))
+
+    def close(self):
+        self.socket.close()
+
+def read_speed(interface):
+    """
+    Returns the link speed of the specified interface in Mb/s,
+    or 0 if unknown (ie down, virtual, or wireless).
+    """
+    try:
+        return max(0, int(fs.read_bytes('/sys/class/net/{}/speed'.format(interface))))
+    except (IOError, OSError, ValueError):
+        return 0
+
+class LinkSpeeds(object):
+    """
+    Cache of the link speed of each interface, cleared for an interface
+    whenever the source reports a change to its link (or after timeout
+    seconds, without a source).
+    """
+
+    def __init__(self, source=None, timeout=SPEED_TIMEOUT):
+        self.source = source
+        self.timeout = timeout
+        self._lock = Lock()
+        # map of interface name to (speed, time read in ns)
+        self._speeds = {}
+        self._generation = fs.generation()
+        if source is not None:
+            self._thread = Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def speed(self, interface):
+        """
+        Returns the cached link speed of the specified interface
+        in Mb/s (0 if unknown), reading it if not cached.
+        """
+        now = monotonic_ns()
+        with self._lock:
+            if self._generation != fs.generation():
+                # file source (or root directory) changed
+                self._speeds.clear()
+                self._generation = fs.generation()
+            cached = self._speeds.get(interface)
+        if cached is not None and (self.source or now - cached[1] < self.timeout * 1e9):
+            return cached[0]
+        speed = read_speed(interface)
+        with self._lock:
+            self._speeds[interface] = (speed, now)
+        return speed
+
+    def invalidate(self, interfaces):
+        with self._lock:
+            for interface in interfaces:
+                self._speeds.pop(interface, None)
+
+    def _run(self):
+        while True:
+            try:
+                interfaces = self.source.receive()
+            except (IOError, OSError):
+                # fall back to expiring speeds
+                with self._lock:
+                    self.source = None
+                    self._speeds.clear()
+                return
+            self.invalidate(interfaces)
+
+_lock = Lock()
+_speeds = None
+
+def get_link_speeds():
+    """
+    Returns the process-wide LinkSpeeds, listening for link changes
+    if rtnetlink is available.
+    """
+    global _speeds
+    with _lock:
+        if _speeds is None:
+            try:
+                source = RtnetlinkSource()
+            except (AttributeError, IOError, OSError):
+                # no AF_NETLINK (not linux) or not permitted
+                source = None
+            _speeds = LinkSpeeds(source)
+        return _speeds
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+Shared openweathermap.org client.
+
+One client (and so one pool of keep-alive connections, one set of
+conditional-request validators, and one request budget per api key)
+is shared by every j3_weather instance in the process.
+
+Instances that know the city id of their location also share a
+WeatherGroup (per api url, key, and units), which fetches the weather of
+all their cities in one request to the group api, caches it by city id,
+and hands each city's weather to every instance showing it.
+
+Requests are sent with the requests library, or with just the standard
+library (http.client) if requests isn't installed or the 'urllib' library
+is chosen; either way, the library is imported only on the first request,
+so importing this module (and j3_weather) stays cheap.
+"""
+
+from __future__ import division  # python2 compatibility
+from threading import Event, Lock
+from time import sleep, time
+
+import json
+import random
+
+# max number of city ids per group request
+GROUP_SIZE = 20
+# seconds to wait for other instances to subscribe before a group request
+GROUP_DELAY = 0.25
+
+class WeatherError(Exception):
+    """
+    Raised when a weather request fails; retry_after is the number of
+    seconds the server asked us to wait before retrying (if any).
+    """
+    def __init__(self, message, retry_after=None):
+        Exception.__init__(self, message)
+        self.retry_after = retry_after
+
+class RequestBudget(object):
+    """
+    Token bucket allowing at most `limit` requests per `period` seconds.
+    """
+
+    def __init__(self, limit, period=60):
+        self.limit = limit
+        self.period = period
+        self.tokens = limit
+        self.last = time()
+        self._lock = Lock()
+
+    def take(self):
+        """
+        Takes a token for one request; returns 0 if available,
+        otherwise the number of seconds until one will be.
+        """
+        with self._lock:
+            now = time()
+            rate = self.limit / self.period
+            self.tokens = min(self.limit, self.tokens + (now - self.last) * rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / rate
+
+class Backoff(object):
+    """
+    Exponential backoff with jitter: each consecutive failure doubles the
+    delay (from `base` up to `cap` seconds), randomized over the upper half
+    of that range so clients sharing a key don't all retry in lockstep.
+    """
+
+    def __init__(self, base=60, cap=1800):
+        self.base = base
+        self.cap = cap
+        self.failures = 0
+
+    def success(self):
+        self.failures = 0
+
+    def failure(self, minimum=0):
+        """
+        Records a failure; returns the number of seconds to wait before retrying.
+        """
+        delay = min(self.cap, self.base * (2 ** self.failures))
+        self.failures += 1
+        return max(minimum, delay / 2 + random.uniform(0, delay / 2))
+
+class StdlibResponse(object):
+    """
+    The parts of a requests.Response used by Client.
+    """
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+class StdlibSession(object):
+    """
+    Stand-in for requests.Session using just the standard library,
+    keeping idle keep-alive connections for reuse by host.
+    """
+
+    def __init__(self):
+        # imported here, since http.client (with ssl) is slow to import
+        try:
+            import http.client as httplib
+            from urllib.parse import urlencode, urlsplit
+        except ImportError: # python2
+            import httplib
+            from urllib import urlencode
+            from urlparse import urlsplit
+        self.errors = (IOError, OSError, httplib.HTTPException)
+        self._connection_types = {
+            'http': httplib.HTTPConnection,
+            'https': httplib.HTTPSConnection,
+        }
+        self._urlencode = urlencode
+        self._urlsplit = urlsplit
+        self._lock = Lock()
+        # map of (scheme, host) to list of idle connections
+        self._idle = {}
+
+    def _connect(self, key, timeout):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        factory = self._connection_types.get(key[0], self._connection_types['http'])
+        return factory(key[1], timeout=timeout), False
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        parts = self._urlsplit(url)
+        path = parts.path or '/'
+        if params:
+            path += '?' + self._urlencode(params)
+        key = (parts.scheme, parts.netloc)
+
+        while True:
+            connection, reused = self._connect(key, timeout)
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            try:
+                connection.request('GET', path, headers=headers or {})
+                response = connection.getresponse()
+                content = response.read()
+                break
+            except self.errors:
+                connection.close()
+                if not reused:
+                    raise
+                # idle connection closed by the server, so try a new one
+
+        if response.will_close:
+            connection.close()
+        else:
+            with self._lock:
+                self._idle.setdefault(key, []).append(connection)
+        return StdlibResponse(response.status, response.msg, content)
+
+def _open_session(library):
+    # returns (session, tuple of exceptions it raises for failed requests)
+    if library != 'urllib':
+        try:
+            import requests
+            return requests.Session(), (requests.RequestException,)
+        except ImportError:
+            pass # fall back to the standard library
+    session = StdlibSession()
+    return session, session.errors
+
+class Client(object):
+    def __init__(self, library='requests'):
+        self.library = library
+        # opened on first request (see _open_session)
+        self.session = None
+        self.session_errors = ()
+        self._lock = Lock()
+        # map of url to (etag, last modified, data) of last 200 response
+        self._validators = {}
+        # map of api key to RequestBudget
+        self._budgets = {}
+        # map of (api url, api key, units) to WeatherGroup
+        self._groups = {}
+
+    def budget(self, apikey, limit, period=60):
+        with self._lock:
+            budget = self._budgets.get(apikey)
+            if budget is None:
+                budget = self._budgets[apikey] = RequestBudget(limit, period)
+            return budget
+
+    def group(self, url, apikey, units):
+        """
+        Returns the WeatherGroup for the specified api url, key, and units.
+        """
+        with self._lock:
+            key = (url, apikey, units)
+            group = self._groups.get(key)
+            if group is None:
+                group = self._groups[key] = WeatherGroup(self, url, apikey, units)
+            return group
+
+    def get(self, url, params, apikey, timeout, budget=60):
+        """
+        Returns the parsed json response for the specified request,
+        reusing pooled connections and sending the validators of the last
+        response for the same request, so unchanged data costs only a 304.
+        Raises a WeatherError if the request fails or the api key is out
+        of budget.
+        """
+        wait = self.budget(apikey, budget).take()
+        if wait:
+            raise WeatherError('request budget exceeded', retry_after=wait)
+
+        params = dict(params, APPID=apikey)
+        key = (url, tuple(sorted(params.items())))
+        with self._lock:
+            validators = self._validators.get(key)
+
+        headers = {}
+        if validators:
+            etag, modified, data = validators
+            if etag:
+                headers['If-None-Match'] = etag
+            if modified:
+                headers['If-Modified-Since'] = modified
+
+        with self._lock:
+            if self.session is None:
+                self.session, self.session_errors = _open_session(self.library)
+
+        try:
+            response = self.session.get(url, params=params, headers=headers, timeout=timeout)
+        except self.session_errors as e:
+            raise WeatherError(str(e))
+
+        if response.status_code == 304 and validators:
+            return validators[2]
+
+        if response.status_code != 200:
+            raise WeatherError(
+                '{} error getting weather'.format(response.status_code),
+                retry_after=_parse_retry_after(response.headers.get('Retry-After')),
+            )
+
+        data = response.json()
+        etag = response.headers.get('ETag')
+        modified = response.headers.get('Last-Modified')
+        with self._lock:
+            if etag or modified:
+                self._validators[key] = (etag, modified, data)
+            else:
+                self._validators.pop(key, None)
+        return data
+
+class WeatherGroup(object):
+    """
+    Current weather of a set of cities (by city id) with the same api url,
+    key, and units, fetched for all the subscribed cities at once via the
+    group api (GROUP_SIZE cities per request), and cached by city id.
+    """
+
+    def __init__(self, client, url, apikey, units):
+        self.client = client
+        self.url = url
+        self.apikey = apikey
+        self.units = units
+        self._lock = Lock()
+        # map of city id to (time fetched, weather)
+        self._weather = {}
+        # map of city id to list of callbacks
+        self._subscribers = {}
+        # set when the request in flight completes (None if none in flight)
+        self._pending = None
+        # city ids of the request in flight
+        self._requested = ()
+        self._error = None
+
+    def subscribe(self, city_id, callback):
+        """
+        Adds the city to the next group request, and subscribes the
+        callback to its weather, called with (time fetched, weather)
+        whenever the weather of the city is fetched.
+        """
+        with self._lock:
+            callbacks = self._subscribers.setdefault(city_id, [])
+            if callback not in callbacks:
+                callbacks.append(callback)
+
+    def unsubscribe(self, city_id, callback):
+        with self._lock:
+            callbacks = self._subscribers.get(city_id, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self._subscribers.pop(city_id, None)
+
+    def store(self, city_id, fetched, weather):
+        """
+        Caches weather of the city fetched by some other request.
+        """
+        with self._lock:
+            cached = self._weather.get(city_id)
+            if cached is None or cached[0] < fetched:
+                self._weather[city_id] = (fetched, weather)
+
+    def get(self, city_id, max_age, timeout, budget=60, caller=None):
+        """
+        Returns the (time fetched, weather) of the specified city, cached
+        if fetched within max_age seconds; otherwise fetches the weather of
+        all subscribed cities (or waits for the request already in flight),
+        calling back the subscribers of each city (except the caller).
+        Raises a WeatherError if the request fails.
+        """
+        while True:
+            with self._lock:
+                cached = self._weather.get(city_id)
+                if cached is not None and time() - cached[0] < max_age:
+                    return cached
+                pending = self._pending
+                if pending is None:
+                    pending = self._pending = Event()
+                    break
+                requested = self._requested
+            # another instance is already fetching
+            pending.wait(timeout * 2)
+            if city_id not in requested:
+                continue # subscribed too late for that request
+            with self._lock:
+                cached = self._weather.get(city_id)
+                if cached is not None and time() - cached[0] < max_age:
+                    return cached
+                error = self._error
+            raise error or WeatherError('no weather for city {}'.format(city_id))
+
+        # let instances starting up at the same time join this request
+        sleep(GROUP_DELAY)
+        with self._lock:
+            ids = sorted(set(self._subscribers).union([city_id]))
+            self._requested = frozenset(ids)
+
+        fetched = time()
+        results = {}
+        error = None
+        try:
+            for start in range(0, len(ids), GROUP_SIZE):
+                data = self.client.get(
+                    '{}/group'.format(self.url),
+                    { 'id': ','.join(ids[start:start + GROUP_SIZE]), 'units': self.units },
+                    self.apikey,
+                    timeout,
+                    budget,
+                )
+                for weather in data.get('list', ()):
+                    results[str(weather['id'])] = weather
+        except (WeatherError, ValueError, KeyError, TypeError) as e:
+            error = e if isinstance(e, WeatherError) else WeatherError(
+                'invalid group response: {}'.format(e))
+
+        with self._lock:
+            for key, weather in results.items():
+                self._weather[key] = (fetched, weather)
+            notify = [
+                (callback, key, weather)
+                for key, weather in results.items()
+                for callback in self._subscribers.get(key, ())
+                if callback != caller
+            ]
+            self._error = error
+            self._pending = None
+            self._requested = ()
+        pending.set()
+
+        for callback, key, weather in notify:
+            try:
+                callback(fetched, weather)
+            except Exception:
+                pass # don't let one subscriber stop the others
+
+        if city_id in results:
+            return fetched, results[city_id]
+        raise error or WeatherError('no weather for city {}'.format(city_id))
+
+def _parse_retry_after(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+_lock = Lock()
+# map of library to Client
+_clients = {}
+
+def get_client(library='requests'):
+    """
+    Returns the process-wide Client using the specified http library
+    ('requests', or 'urllib' for just the standard library).
+    """
+    with _lock:
+        client = _clients.get(library)
+        if client is None:
+            client = _clients[library] = Client(library)
+        return client
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Include/exclude glob patterns for selecting devices by name.
+"""
+
+from fnmatch import fnmatchcase
+
+class NameFilter(object):
+    """
+    Selects names (ie network interfaces or block devices) matching a
+    space-separated list of glob patterns, like 'en* wl* !veth*'.
+
+    Patterns starting with '!' exclude matching names; if there are no
+    other patterns, all names not excluded are selected. Each name is
+    matched against the patterns only the first time it's seen, so
+    selecting from a list of names that changes only a little from tick
+    to tick (as devices come and go) is cheap.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.includes = []
+        self.excludes = []
+        for pattern in patterns.split():
+            if pattern.startswith('!'):
+                self.excludes.append(pattern[1:])
+            else:
+                self.includes.append(pattern)
+        # map of name to sort key if selected, or None if not selected
+        self._resolved = {}
+
+    def _resolve(self, name):
+        for pattern in self.excludes:
+            if fnmatchcase(name, pattern):
+                return None
+        if not self.includes:
+            return 0
+        for index, pattern in enumerate(self.includes):
+            if fnmatchcase(name, pattern):
+                return index
+        return None
+
+    def select(self, names):
+        """
+        Returns a list of the selected names, in order of the first
+        pattern each matches (and otherwise in their original order).
+        """
+        resolved = self._resolved
+        selected = []
+        for position, name in enumerate(names):
+            try:
+                index = resolved[name]
+            except KeyError:
+                index = resolved[name] = self._resolve(name)
+            if index is not None:
+                selected.append((index, position, name))
+
+        # forget names that have gone away
+        if len(resolved) > 2 * len(names) + 16:
+            current = set(names)
+            for name in [n for n in resolved if n not in current]:
+                del resolved[name]
+
+        selected.sort()
+        return [name for index, position, name in selected]
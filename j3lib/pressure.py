@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Pressure Stall Information (PSI): the share of time tasks were stalled
+waiting on cpu, memory, or io, from /proc/pressure (or a cgroup v2).
+
+Besides reading the averages, a PressureWatcher can register kernel PSI
+triggers (ie 'some 100000 2000000': 100ms of stall within any 2s window)
+and block in poll() on them from one background thread for the whole
+process, calling the subscribed callbacks only when a trigger fires.
+If triggers are unavailable (not linux, an old kernel, or not allowed),
+watch() raises OSError, and modules should fall back to polling.
+"""
+
+from threading import Lock, Thread
+
+import errno
+import os
+import select
+
+from j3lib import fs
+
+PRESSURE_ROOT = '/proc/pressure'
+RESOURCES = ('cpu', 'memory', 'io')
+
+def pressure_path(resource, cgroup_path=None):
+    """
+    Returns the path of the pressure file of the specified resource,
+    system-wide, or of the cgroup in the specified directory.
+    """
+    if cgroup_path:
+        return '{}/{}.pressure'.format(cgroup_path, resource)
+    return '{}/{}'.format(PRESSURE_ROOT, resource)
+
+def read_pressure(path):
+    """
+    Returns a dict of each line of the specified pressure file ('some',
+    and 'full' if listed) to a dict of its averages as percents
+    ('avg10', 'avg60', 'avg300') and its 'total' stall time in usec.
+    """
+    pressure = {}
+    for line in fs.read_bytes(path).split(b'\n'):
+        cols = line.split()
+        if not cols:
+            continue
+        values = {}
+        for col in cols[1:]:
+            key, _, value = col.partition(b'=')
+            key = key.decode('ascii')
+            values[key] = int(value) if key == 'total' else float(value)
+        pressure[cols[0].decode('ascii')] = values
+    return pressure
+
+class PressureTrigger(object):
+    """
+    Kernel PSI trigger registered on a pressure file, which signals POLLPRI
+    when tasks stall for at least stall_us within a window_us window
+    (at most once per window). Stays registered until closed.
+    """
+
+    def __init__(self, path, kind, stall_us, window_us):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_NONBLOCK)
+        try:
+            os.write(self.fd, '{} {} {}\0'.format(kind, stall_us, window_us).encode('ascii'))
+        except (IOError, OSError):
+            os.close(self.fd)
+            raise
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class PressureWatcher(object):
+    """
+    Calls the callbacks subscribed to each trigger when it fires,
+    from a daemon thread that blocks in poll() between triggers.
+    Triggers are shared by all subscribers with the same settings.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        # map of trigger key to (trigger, list of callbacks)
+        self._triggers = {}
+        # map of fd to trigger key
+        self._fds = {}
+        self._poll = select.poll()
+        # pipe to wake the thread when the set of triggers changes
+        self._wake_read, self._wake_write = os.pipe()
+        self._poll.register(self._wake_read, select.POLLIN)
+        self._closed = False
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, key, fileobj, callback, events=select.POLLPRI):
+        """
+        Subscribes the callback to the specified (already open) trigger
+        object, registered under the specified key.
+        """
+        with self._lock:
+            subscribed = self._triggers.get(key)
+            if subscribed is None:
+                self._triggers[key] = (fileobj, [callback])
+                self._fds[fileobj.fileno()] = key
+                self._poll.register(fileobj.fileno(), events)
+        if subscribed is not None:
+            # added meanwhile by another subscriber, so share that one
+            fileobj.close()
+            with self._lock:
+                if callback not in subscribed[1]:
+                    subscribed[1].append(callback)
+            return
+        os.write(self._wake_write, b'\0')
+
+    def watch(self, path, callback, stall_us, window_us, kind='some'):
+        """
+        Subscribes the callback to a trigger on the specified pressure file
+        (real path, not through j3lib.fs), creating the trigger if needed.
+        Raises OSError if the kernel won't accept the trigger.
+        """
+        key = (path, kind, stall_us, window_us)
+        with self._lock:
+            subscribed = self._triggers.get(key)
+            if subscribed is not None:
+                if callback not in subscribed[1]:
+                    subscribed[1].append(callback)
+                return
+        self.add(key, PressureTrigger(path, kind, stall_us, window_us), callback)
+
+    def unwatch(self, callback):
+        with self._lock:
+            for _, callbacks in self._triggers.values():
+                if callback in callbacks:
+                    callbacks.remove(callback)
+
+    def _remove(self, fd):
+        # drops a trigger whose file is gone (ie its cgroup was removed)
+        with self._lock:
+            key = self._fds.pop(fd, None)
+            trigger, callbacks = self._triggers.pop(key, (None, []))
+            self._poll.unregister(fd)
+        if trigger is not None:
+            trigger.close()
+        return callbacks
+
+    def _run(self):
+        while not self._closed:
+            try:
+                ready = self._poll.poll()
+            except (IOError, OSError, select.error) as e:
+                if e.args and e.args[0] == errno.EINTR:
+                    continue
+                return
+            for fd, events in ready:
+                if fd == self._wake_read:
+                    os.read(self._wake_read, 4096)
+                    continue
+                if events & (select.POLLERR | select.POLLHUP | select.POLLNVAL):
+                    callbacks = self._remove(fd)
+                else:
+                    with self._lock:
+                        key = self._fds.get(fd)
+                        callbacks = list(self._triggers.get(key, (None, []))[1])
+                for callback in callbacks:
+                    try:
+                        callback()
+                    except Exception:
+                        pass # don't let one subscriber stop the others
+
+    def close(self):
+        self._closed = True
+        os.write(self._wake_write, b'\0')
+        with self._lock:
+            for trigger, _ in self._triggers.values():
+                trigger.close()
+            self._triggers.clear()
+            self._fds.clear()
+
+_lock = Lock()
+_watcher = None
+_unavailable = False
+
+def get_watcher():
+    """
+    Returns the process-wide PressureWatcher,
+    or None if poll() isn't available.
+    """
+    global _watcher, _unavailable
+    with _lock:
+        if _watcher is None and not _unavailable:
+            try:
+                _watcher = PressureWatcher()
+            except (AttributeError, IOError, OSError):
+                _unavailable = True
+        return _watcher
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental scanner of the per-process counters in /proc/[pid]/stat,
+for ranking the top processes by cpu or memory use.
+
+Reading every /proc/[pid]/stat costs a few usec per process (an open,
+read, and close each), too slow to do every tick on hosts with tens of
+thousands of processes. So each scan reads just the current top processes
+plus the next batch of the others, working through all of them in turn
+over several scans (re-listing /proc after each full pass). A process's cpu
+rate is calculated over the time since it was last read, however long ago.
+
+New processes are read on the next scan after they start: whenever the
+last allocated pid (in /proc/loadavg) has changed since the last listing,
+/proc is listed again to find them (a listing costs a fraction of reading
+every stat file, and is only needed once a process or thread is created).
+
+Process metadata (the name, and the command line if shown) is read once
+per process lifetime, and the entries of exited processes are evicted
+(when a read fails, or the process isn't listed on the next pass).
+"""
+
+from __future__ import division  # python2 compatibility
+from heapq import nlargest
+from operator import attrgetter
+from threading import Lock
+
+import os
+
+from j3lib import fs
+from j3lib.procfs import read_last_pid
+from j3lib.sampler import SAMPLER
+
+try:
+    CLK_TCK = os.sysconf('SC_CLK_TCK')
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    CLK_TCK = 100
+    PAGE_SIZE = 4096
+
+class Process(object):
+    """
+    Last counters read of one process: cpu (percent of one CPU since the
+    previous read, 0 until read twice) and rss (resident memory in bytes).
+    """
+    __slots__ = ('pid', 'start', 'name', 'cmdline', 'ticks', 'time', 'cpu', 'rss')
+
+    def __init__(self, pid, start, name):
+        self.pid = pid
+        self.start = start
+        self.name = name
+        self.cmdline = None
+        self.ticks = 0
+        self.time = 0
+        self.cpu = 0
+        self.rss = 0
+
+def parse_stat(data):
+    """
+    Returns the (raw comm, start time, utime + stime, rss in pages)
+    from the contents of a /proc/[pid]/stat file.
+    """
+    # comm may include spaces and parens, so find the last paren
+    end = data.rfind(b')')
+    fields = data[end + 2:].split(None, 22)
+    return data[data.find(b'(') + 1:end], int(fields[19]), int(fields[11]) + int(fields[12]), int(fields[21])
+
+def _stat_reader():
+    # returns function to read the stat file of a pid, bypassing the
+    # file object overhead of j3lib.fs when reading the filesystem directly
+    if type(fs.get_source()) is not fs.FileSource:
+        return lambda pid: fs.read_bytes('/proc/' + pid + '/stat')
+    prefix = fs.path('/proc') + '/'
+    def read(pid):
+        fd = os.open(prefix + pid + '/stat', os.O_RDONLY)
+        try:
+            return os.read(fd, 1024)
+        finally:
+            os.close(fd)
+    return read
+
+class ProcessTable(object):
+    """
+    Map of pid (as a string) to the Process entry of each process,
+    updated incrementally by scan().
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.entries = {}
+        # pids still to read in the current pass
+        self.pending = []
+        # last allocated pid as of the last listing of /proc
+        self.last_pid = None
+        # map of 'cpu' and 'rss' to the top entries by each, as of the last scan
+        self.ranked = {}
+
+    def _get_last_pid(self):
+        # returns the last allocated pid (or None if unknown)
+        try:
+            return read_last_pid()
+        except (IOError, OSError, IndexError, ValueError):
+            return None
+
+    def _list(self):
+        # starts a new pass over all listed pids, evicting unlisted ones
+        self.last_pid = self._get_last_pid()
+        listed = [name for name in fs.listdir('/proc') if name.isdigit()]
+        entries = self.entries
+        self.entries = dict((pid, entries[pid]) for pid in listed if pid in entries)
+        self.pending = listed
+
+    def _list_new(self):
+        # returns the listed pids neither read nor pending in the current pass
+        # (if any process may have started since the last listing)
+        last_pid = self._get_last_pid()
+        if last_pid is not None and last_pid == self.last_pid:
+            return []
+        self.last_pid = last_pid
+        known = set(self.pending)
+        known.update(self.entries)
+        return [name for name in fs.listdir('/proc') if name.isdigit() and name not in known]
+
+    def scan(self, limit, hot_count):
+        """
+        Reads the counters of the hot_count top processes by cpu and by rss
+        (as ranked by the last scan), and of any processes started since the
+        last scan, plus up to limit other processes (or all of them on the
+        first scan), and ranks the hot_count top processes again.
+        Returns the number of processes read.
+        """
+        with self._lock:
+            first = not self.entries
+            new_pass = not self.pending
+            if new_pass:
+                self._list()
+                started = []
+            else:
+                started = self._list_new()
+            if first:
+                limit = len(self.pending)
+            batch = self.pending[-limit:] if limit else []
+            del self.pending[len(self.pending) - len(batch):]
+            batch.extend(started)
+            # the top processes are read on every scan
+            hot = set(
+                entry.pid for ranked in self.ranked.values() for entry in ranked
+                if entry.pid in self.entries
+            )
+            if hot:
+                batch = list(hot) + [pid for pid in batch if pid not in hot]
+
+            read = _stat_reader()
+            entries = self.entries
+            updated = []
+            # (on the sampler clock, replaced when replaying recorded data)
+            now = SAMPLER.clock()
+            for pid in batch:
+                try:
+                    comm, start, ticks, rss = parse_stat(read(pid))
+                except (IOError, OSError, IndexError, ValueError):
+                    entries.pop(pid, None) # exited
+                    continue
+                entry = entries.get(pid)
+                if entry is None or entry.start != start:
+                    # new process (or a new process reusing the pid)
+                    entry = entries[pid] = Process(pid, start, comm.decode('utf-8', 'replace'))
+                elif now > entry.time:
+                    entry.cpu = 100 * (ticks - entry.ticks) / CLK_TCK * 1e9 / (now - entry.time)
+                entry.ticks = ticks
+                entry.time = now
+                entry.rss = rss * PAGE_SIZE
+                updated.append(entry)
+
+            # rank with bounded heaps instead of sorting all entries; and
+            # since only the entries just read have changed, between passes
+            # just re-rank those with the last top entries (the new top
+            # entries of any process that has been re-used are replaced)
+            ranked = {}
+            for key in ('cpu', 'rss'):
+                if new_pass:
+                    candidates = entries.values()
+                else:
+                    candidates = set(self.ranked.get(key, ()))
+                    candidates.update(updated)
+                    candidates = [entry for entry in candidates if entries.get(entry.pid) is entry]
+                ranked[key] = nlargest(hot_count, candidates, key=attrgetter(key))
+            self.ranked = ranked
+            return len(batch)
+
+    def top(self, count, key='cpu'):
+        """
+        Returns a list of the Process entries of the count processes
+        with the largest value of key ('cpu' or 'rss'), largest first.
+        """
+        with self._lock:
+            ranked = self.ranked.get(key)
+            if ranked is not None and len(ranked) >= min(count, len(self.entries)):
+                return ranked[:count]
+            return nlargest(count, self.entries.values(), key=attrgetter(key))
+
+    def cmdline(self, entry):
+        """
+        Returns the command line of the process of the specified entry
+        (read once per process), or its name in brackets if it has none
+        (ie a kernel thread).
+        """
+        if entry.cmdline is None:
+            try:
+                data = fs.read_bytes('/proc/' + entry.pid + '/cmdline')
+            except (IOError, OSError):
+                data = b''
+            cmdline = data.replace(b'\0', b' ').strip().decode('utf-8', 'replace')
+            entry.cmdline = cmdline or '[{}]'.format(entry.name)
+        return entry.cmdline
+
+_lock = Lock()
+# map of fs generation to ProcessTable
+_tables = {}
+
+def get_process_table():
+    """
+    Returns the process-wide ProcessTable (for the current j3lib.fs source).
+    """
+    with _lock:
+        table = _tables.get(fs.generation())
+        if table is None:
+            _tables.clear()
+            table = _tables[fs.generation()] = ProcessTable()
+        return table
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Fast readers for the procfs files polled every tick.
+"""
+
+from array import array
+
+from j3lib import fs
+
+# per-cpu columns of /proc/stat, in order
+# (guest time is also counted in user, and guest_nice in nice)
+CPU_STATES = (
+    'user', 'nice', 'system', 'idle', 'iowait',
+    'irq', 'softirq', 'steal', 'guest', 'guest_nice',
+)
+STATE_COUNT = len(CPU_STATES)
+# columns before guest sum to the total time of a cpu
+BUSY_STATES = CPU_STATES.index('guest')
+
+class CpuTimes(object):
+    """
+    Per-CPU counters (in USER_HZ ticks) from one read of /proc/stat.
+    ids has one entry per online CPU; states is one flat array of
+    a row of STATE_COUNT counters per CPU (in CPU_STATES order),
+    with 0 for states the kernel doesn't report.
+    """
+    __slots__ = ('ids', 'states')
+
+    def __init__(self, count=0):
+        self.ids = array('i', [0]) * count
+        self.states = array('q', [0]) * (count * STATE_COUNT)
+
+    def __len__(self):
+        return len(self.ids)
+
+class ProcStatReader(object):
+    """
+    Reads the per-CPU lines of /proc/stat.
+
+    Keeps the file open and re-reads it from the start into a reused
+    buffer a chunk at a time, stopping once past the last 'cpu' line (so
+    no more than a chunk of the long 'intr' line is ever read).
+    Results are written into preallocated arrays; two sets of arrays are
+    used in turn, so the result of the previous read stays valid
+    (and unchanged) while the next read is in progress.
+    """
+
+    chunk_size = 4096
+
+    def __init__(self, path='/proc/stat'):
+        self.path = path
+        self._file = None
+        self._file_generation = None
+        self._buffer = bytearray(self.chunk_size)
+        self._times = [CpuTimes(), CpuTimes()]
+        self._current = 0
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+            self._file_generation = None
+
+    def _fill(self):
+        """
+        Reads from the start of the file until the buffer holds the whole
+        'cpu' section; returns the length of the section.
+        """
+        # reopen if file source (or root directory) changed
+        if self._file_generation != fs.generation():
+            self.close()
+            self._file = fs.open_raw(self.path)
+            self._file_generation = fs.generation()
+        f = self._file
+        f.seek(0)
+
+        buf = self._buffer
+        size = 0
+        while True:
+            if size + self.chunk_size > len(buf):
+                buf.extend(bytes(len(buf)))
+            n = f.readinto(memoryview(buf)[size:size + self.chunk_size])
+            size += n
+            # the cpu lines come first, so they're all in the buffer
+            # as soon as the last line started isn't a cpu line
+            line = buf.rfind(b'\n', 0, size) + 1
+            if n and (line + 3 > size or buf.startswith(b'cpu', line)):
+                continue
+            # back up to the start of the first non-cpu line
+            while line:
+                start = buf.rfind(b'\n', 0, line - 1) + 1
+                if buf.startswith(b'cpu', start):
+                    break
+                line = start
+            return line
+
+    def read(self):
+        """
+        Returns a CpuTimes with the current counters of each CPU.
+        """
+        buf = self._buffer
+        size = self._fill()
+        # skip aggregate 'cpu ' line
+        start = buf.find(b'\n', 0, size) + 1
+        end = buf.find(b'\n', start, size)
+        width = len(buf[start:end].split()) # label plus columns per cpu
+
+        # convert the columns of all cpus in one pass
+        cols = buf[start:size].split()
+        count = len(cols) // width if width else 0
+        labels = cols[::width]
+        del cols[::width]
+        values = list(map(int, cols))
+        width -= 1
+
+        self._current ^= 1
+        times = self._times[self._current]
+        if len(times) != count:
+            times = self._times[self._current] = CpuTimes(count)
+        if count:
+            times.ids[:] = array('i', [int(label[3:]) for label in labels])
+            if width != STATE_COUNT:
+                # older kernels have fewer columns (newer may have more)
+                pad = [0] * max(0, STATE_COUNT - width)
+                values = [
+                    value
+                    for i in range(0, len(values), width)
+                    for value in (values[i:i + width] + pad)[:STATE_COUNT]
+                ]
+            times.states[:] = array('q', values)
+        return times
+
+# shared reader for /proc/stat (opened on first read)
+PROC_STAT = ProcStatReader()
+
+MEMINFO_KEYS = (
+    'MemTotal', 'MemFree', 'MemAvailable', 'Buffers', 'Cached',
+    'SwapTotal', 'SwapFree',
+)
+
+def read_meminfo(path='/proc/meminfo', keys=MEMINFO_KEYS):
+    """
+    Returns a dict of the specified /proc/meminfo keys to their values
+    (in kB), from one read of the file. Keys missing from the file
+    (ie MemAvailable before linux 3.14) are missing from the dict.
+    """
+    data = fs.read_bytes(path)
+
+    wanted = set(keys)
+    info = {}
+    for line in data.split(b'\n'):
+        key, _, value = line.partition(b':')
+        key = key.decode('ascii')
+        if key in wanted:
+            info[key] = int(value.split()[0])
+            if len(info) == len(wanted):
+                break
+    return info
+
+def read_net_dev(path='/proc/net/dev'):
+    """
+    Returns a tuple of the interface names listed in /proc/net/dev,
+    and a dict of each interface name to its list of (unconverted)
+    counter columns: the first 8 for received, the last 8 for transmitted
+    (bytes, packets, errs, drop, fifo, frame/colls, compressed, multicast/carrier).
+    Convert just the columns you use for just the interfaces you show.
+    """
+    data = fs.read_bytes(path)
+
+    names = []
+    columns = {}
+    # skip two header lines
+    for line in data.split(b'\n')[2:]:
+        name, _, cols = line.partition(b':')
+        if cols:
+            name = name.strip().decode('utf-8')
+            names.append(name)
+            columns[name] = cols.split()
+    return tuple(names), columns
+
+def read_diskstats(path='/proc/diskstats'):
+    """
+    Returns a tuple of the block device names listed in /proc/diskstats,
+    and a dict of each device name to its list of (unconverted) counter
+    columns, in the same order as /sys/block/<device>/stat: reads completed,
+    reads merged, sectors read, ms reading, writes completed, writes merged,
+    sectors written, ms writing, I/Os in progress, ms doing I/O (io_ticks),
+    and weighted ms doing I/O (followed by discard and flush columns
+    on newer kernels).
+    """
+    data = fs.read_bytes(path)
+
+    names = []
+    columns = {}
+    for line in data.split(b'\n'):
+        cols = line.split()
+        if len(cols) > 3:
+            name = cols[2].decode('utf-8')
+            names.append(name)
+            columns[name] = cols[3:]
+    return tuple(names), columns
+
+def read_last_pid(path='/proc/loadavg'):
+    """
+    Returns the most recently allocated pid (the last field of
+    /proc/loadavg), which changes whenever a process or thread is created.
+    """
+    return int(fs.read_bytes(path).split()[-1])
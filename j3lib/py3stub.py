@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Stand-in for the `py3` helper py3status gives each module instance,
+for running modules outside of py3status (ie directly or in benchmarks).
+"""
+
+from string import Formatter
+
+class _Params(dict):
+    def __missing__(self, key):
+        return ''
+
+class Py3Stub(object):
+    """
+    Implements the subset of py3status's Py3 helper used by the j3 modules.
+    Pass an update callback to be notified when a module asks to be refreshed.
+    """
+
+    def __init__(self, update=None):
+        self._formatter = Formatter()
+        self._update = update
+
+    def safe_format(self, format_string, param_dict=None):
+        """
+        Formats the string with the specified params,
+        replacing unknown placeholders with ''.
+        """
+        try:
+            return self._formatter.vformat(format_string, (), _Params(param_dict or {}))
+        except (ValueError, TypeError, IndexError, AttributeError):
+            return format_string
+
+    def composite_join(self, separator, items):
+        """
+        Joins the non-empty items with the separator.
+        """
+        return separator.join([item for item in items if item])
+
+    def update(self):
+        if self._update:
+            self._update()
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Shared rate engine for the counter-based modules (j3_netio, j3_diskio).
+"""
+
+from __future__ import division  # python2 compatibility
+from array import array
+from itertools import repeat
+from operator import mul, sub
+
+import time
+
+# seconds until the next check after taking a baseline sample
+# (of new devices, or after a suspend), so rates show up quickly
+BASELINE_INTERVAL = 0.25
+
+# seconds by which the boot clock (which counts time suspended)
+# must get ahead of the monotonic clock to count as a suspend
+SUSPEND_THRESHOLD = 0.5
+
+_NONE = frozenset()
+
+def _boottime_ns():
+    """
+    Returns the CLOCK_BOOTTIME time in ns, or None if not available.
+    """
+    try:
+        return time.clock_gettime_ns(time.CLOCK_BOOTTIME)
+    except (AttributeError, OSError):
+        return None
+
+def _monotonic_ns():
+    try:
+        return time.monotonic_ns()
+    except AttributeError:
+        return None
+
+def _unwrap(then, now):
+    """
+    Returns the change in a counter that went down: the change across
+    a 32-bit wrap, if the counter was close enough to wrapping,
+    otherwise the count since the counter was reset to 0.
+    """
+    wrapped = (1 << 32) - then + now
+    if then < (1 << 32) and wrapped < (1 << 31):
+        return wrapped
+    return now
+
+class RateEngine(object):
+    """
+    Calculates per-second rates of a fixed set of counters (fields)
+    for a changing set of devices, from successive snapshots
+    timestamped in ns (see j3lib.sampler).
+
+    The counters of all devices are kept in one flat array (a row of
+    fields per device, in the order of the device names), and the rates
+    of all counters are calculated in one pass over the arrays, so
+    a snapshot costs no per-device dicts, whatever the number of devices.
+
+    Devices seen for the first time have no rate until the next snapshot
+    (fresh holds the indexes of such devices); neither do any devices
+    after the system has been suspended (as their counters may have been
+    reset). Counters that go down are treated as wrapped or reset.
+    """
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.width = len(self.fields)
+        self.names = ()
+        self.index = {}
+        self.counters = array('Q')
+        self.times = array('q')
+        self.rates = array('d')
+        # indexes of devices without a rate yet
+        self.fresh = _NONE
+        self._clocks = None
+
+    def field(self, name):
+        """
+        Returns a slice of the rates array for the specified field
+        (ie rates[engine.field('rx')] for the rx rate of every device).
+        """
+        return slice(self.fields.index(name), None, self.width)
+
+    def interval(self, timeout):
+        """
+        Returns the seconds until the next check, given the usual timeout:
+        shorter while waiting for the rates of fresh devices.
+        """
+        if self.fresh:
+            return min(timeout, BASELINE_INTERVAL)
+        return timeout
+
+    def _suspended(self):
+        # compare the time elapsed on the boot clock (which counts time
+        # suspended) with the time elapsed on the monotonic clock
+        clocks = _boottime_ns(), _monotonic_ns()
+        last, self._clocks = self._clocks, clocks
+        if last is None or None in clocks:
+            return False
+        gap = (clocks[0] - last[0]) - (clocks[1] - last[1])
+        return gap > SUSPEND_THRESHOLD * 1e9
+
+    def update(self, names, values, times):
+        """
+        Records a new snapshot, given the names of the devices,
+        their counters (a flat sequence of a row of fields per device),
+        and the time of the snapshot in ns (or a sequence of the time of
+        each device's snapshot). Returns the flat array of the per-second
+        rate of each counter since the last snapshot (0 for fresh devices).
+        """
+        width = self.width
+        names = tuple(names)
+        counters = array('Q', values)
+        uniform = not isinstance(times, (list, tuple, array))
+        if uniform:
+            times = array('q', [times]) * len(names)
+        else:
+            times = array('q', times)
+
+        if self._suspended():
+            # start over, as if all devices are new
+            self.names = ()
+            self.index = {}
+
+        # line up the last counters of each device with the new ones
+        # (new devices start with their current counters)
+        if names != self.names:
+            last = array('Q', counters)
+            last_times = array('q', times)
+            last_rates = array('d', [0]) * len(counters)
+            fresh = set()
+            for i, name in enumerate(names):
+                j = self.index.get(name)
+                if j is None or j in self.fresh:
+                    fresh.add(i)
+                if j is not None:
+                    row = slice(i * width, (i + 1) * width)
+                    last_row = slice(j * width, (j + 1) * width)
+                    last[row] = self.counters[last_row]
+                    last_rates[row] = self.rates[last_row]
+                    last_times[i] = self.times[j]
+            self.names = names
+            self.index = dict((name, i) for i, name in enumerate(names))
+        else:
+            last = self.counters
+            last_times = self.times
+            last_rates = self.rates
+            fresh = self.fresh
+
+        deltas = list(map(sub, counters, last))
+        if deltas and min(deltas) < 0:
+            for k, delta in enumerate(deltas):
+                if delta < 0:
+                    deltas[k] = _unwrap(last[k], counters[k])
+
+        if uniform and not fresh and (not last_times or min(last_times) == max(last_times)):
+            # all devices sampled at the same times, so scale all at once
+            elapsed = times[0] - last_times[0] if times else 0
+            if elapsed > 0:
+                rates = array('d', map(mul, deltas, repeat(1e9 / elapsed)))
+            else:
+                rates = last_rates # same snapshot as last time
+        else:
+            # scale each row of deltas by its own elapsed time
+            rates = array('d', last_rates)
+            fresh = set(fresh)
+            for i, (now, then) in enumerate(zip(times, last_times)):
+                elapsed = now - then
+                if elapsed > 0:
+                    scale = 1e9 / elapsed
+                    row = slice(i * width, (i + 1) * width)
+                    rates[row] = array('d', [delta * scale for delta in deltas[row]])
+                    fresh.discard(i)
+            fresh = frozenset(fresh) if fresh else _NONE
+
+        self.counters = counters
+        self.times = times
+        self.rates = rates
+        self.fresh = fresh
+        return rates
+
+class UnitFormatter(object):
+    """
+    Formats byte counts (or rates) with binary units, via a table of
+    divisors and unit labels built once for each format.
+    """
+
+    def __init__(self, fmt, labels):
+        self.fmt = fmt
+        self.labels = tuple(labels)
+        self.table = [(1 << (10 * i), label) for i, label in enumerate(labels)]
+
+    def format(self, value):
+        """
+        Formats the specified value with the largest unit
+        (up to the last in the table) of which it has at least one.
+        """
+        value = int(value)
+        index = (abs(value).bit_length() - 1) // 10 if value else 0
+        divisor, label = self.table[min(index, len(self.table) - 1)]
+        if divisor == 1:
+            return self.fmt.format(value=value, units=label)
+        return self.fmt.format(value=value / divisor, units=label)
@@ -0,0 +1,524 @@
+# -*- coding: utf-8 -*-
+"""
+Record and replay the raw kernel files read by the j3 modules.
+
+Recording captures the contents of every file read through j3lib.fs
+(/proc/stat, /proc/meminfo, /proc/diskstats, /proc/net/dev, sysfs
+statistics and power_supply attributes, directory listings, etc), each
+with a nanosecond timestamp, in a compact append-only binary log.
+Replaying feeds a log back through the modules as fast as possible,
+with the modules' sampler clock following the recorded timestamps,
+so you can profile or regression-test the modules against real traces.
+
+To record while running under py3status, set the J3STATUS_RECORD
+environment variable to the path of the log. Or record by running the
+modules directly, and replay, from the command line:
+
+    python -m j3lib.replay record trace.log --duration 60
+    python -m j3lib.replay play trace.log --print
+    python -m j3lib.replay play trace.log --profile j3_cpu
+    python -m j3lib.replay dump trace.log
+
+Log format: the 8-byte magic 'J3TRACE2', followed by records,
+each a header (kind byte, int64 timestamp in ns, uint32 path id,
+uint32 data length, little-endian) followed by the data. A PATH record
+defines the path for an id the first time the id is used (or redefines
+it, once the recorder has used MAX_PATHS ids and starts over from 0).
+Logs in the older 'J3TRACE1' format (with a uint16 path id) can still
+be read.
+
+Recording never breaks a module: if writing the log fails, recording
+just stops (see Recorder.error).
+"""
+
+from __future__ import print_function
+from threading import Lock
+from time import time
+
+import errno
+import os
+import struct
+import sys
+
+from j3lib import fs
+from j3lib.sampler import SAMPLER, monotonic_ns
+
+MAGIC = b'J3TRACE2'
+HEADER = struct.Struct('<BqII')
+
+# map of the magic of each readable log format to its record header
+HEADERS = {
+    b'J3TRACE1': struct.Struct('<BqHI'),
+    MAGIC: HEADER,
+}
+
+# max number of path ids assigned before starting over (so the map of
+# paths doesn't grow without limit with the /proc/<pid> files of every
+# process ever seen)
+MAX_PATHS = 1 << 16
+
+# record kinds
+PATH = 0
+READ = 1
+ERROR = 2
+LIST = 3
+EXISTS = 4
+
+# map of record kind to the operation it records
+OPERATIONS = {
+    READ: 'read',
+    ERROR: 'read',
+    LIST: 'list',
+    EXISTS: 'exists',
+}
+
+class ReplayExhausted(Exception):
+    """
+    Raised when a module reads past the end of the recorded data.
+    """
+
+class Recorder(object):
+    """
+    Appends timestamped records to a log file (replacing an existing log
+    in an older format). If writing a record fails, stops recording and
+    keeps the exception in error, rather than raising it to the module
+    reading the file; likewise, records nothing if the file exists but
+    isn't a log (rather than overwriting it).
+    """
+
+    def __init__(self, path):
+        self._lock = Lock()
+        self._paths = {}
+        self._open_files = []
+        self.error = None
+        self._file = None
+        magic = b''
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                magic = f.read(len(MAGIC))
+        if magic == MAGIC:
+            self._file = open(path, 'ab')
+        elif not magic or magic in HEADERS:
+            self._file = open(path, 'wb')
+            self._file.write(MAGIC)
+        else:
+            self.error = ValueError('not a j3 trace: {}'.format(path))
+
+    def record(self, kind, name, data, timestamp=None):
+        if timestamp is None:
+            timestamp = monotonic_ns()
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                path_id = self._paths.get(name)
+                if path_id is None:
+                    if len(self._paths) >= MAX_PATHS:
+                        self._paths.clear()
+                    path_id = self._paths[name] = len(self._paths)
+                    encoded = name.encode('utf-8')
+                    self._file.write(HEADER.pack(PATH, timestamp, path_id, len(encoded)))
+                    self._file.write(encoded)
+                self._file.write(HEADER.pack(kind, timestamp, path_id, len(data)))
+                self._file.write(data)
+                self._file.flush()
+            except (IOError, OSError, ValueError, struct.error) as e:
+                # stop recording (ie disk full), but keep the module running
+                self.error = e
+                self._close()
+
+    def _close(self):
+        try:
+            self._file.close()
+        except (IOError, OSError):
+            pass
+        self._file = None
+
+    def close(self):
+        for f in list(self._open_files):
+            f.flush()
+        with self._lock:
+            if self._file is not None:
+                self._close()
+
+class _RecordingFile(object):
+    """
+    Wraps a file held open and re-read from the start (ie by
+    ProcStatReader), recording the bytes read since each seek to 0.
+    """
+
+    def __init__(self, f, name, recorder):
+        self._file = f
+        self._name = name
+        self._recorder = recorder
+        self._pending = bytearray()
+        self._timestamp = None
+        recorder._open_files.append(self)
+
+    def flush(self):
+        if self._timestamp is not None:
+            self._recorder.record(READ, self._name, bytes(self._pending), self._timestamp)
+            del self._pending[:]
+            self._timestamp = None
+
+    def seek(self, offset, whence=0):
+        if offset == 0 and whence == 0:
+            self.flush()
+        return self._file.seek(offset, whence)
+
+    def readinto(self, buffer):
+        if self._timestamp is None:
+            self._timestamp = monotonic_ns()
+        n = self._file.readinto(buffer)
+        if n:
+            self._pending.extend(memoryview(buffer)[:n])
+        return n
+
+    def close(self):
+        self.flush()
+        if self in self._recorder._open_files:
+            self._recorder._open_files.remove(self)
+        self._file.close()
+
+class RecordingSource(object):
+    """
+    File source that records everything read through another source.
+    """
+
+    def __init__(self, source, recorder):
+        self.source = source
+        self.recorder = recorder
+        self.root = getattr(source, 'root', '')
+
+    def path(self, name):
+        return self.source.path(name)
+
+    def open_raw(self, name):
+        return _RecordingFile(self.source.open_raw(name), name, self.recorder)
+
+    def read_bytes(self, name):
+        try:
+            data = self.source.read_bytes(name)
+        except (IOError, OSError) as e:
+            self.recorder.record(ERROR, name, str(e.errno or errno.EIO).encode('ascii'))
+            raise
+        self.recorder.record(READ, name, data)
+        return data
+
+    def listdir(self, name):
+        names = self.source.listdir(name)
+        self.recorder.record(LIST, name, '\n'.join(names).encode('utf-8'))
+        return names
+
+    def exists(self, name):
+        exists = self.source.exists(name)
+        self.recorder.record(EXISTS, name, b'1' if exists else b'0')
+        return exists
+
+def read_log(path):
+    """
+    Returns a dict of (operation, path) to a list of the
+    (timestamp in ns, kind, data) records for it, in log order.
+    """
+    records = {}
+    paths = {}
+    with open(path, 'rb') as f:
+        header_format = HEADERS.get(f.read(len(MAGIC)))
+        if header_format is None:
+            raise ValueError('not a j3 trace: {}'.format(path))
+        while True:
+            header = f.read(header_format.size)
+            if len(header) < header_format.size:
+                break # ignore truncated record at end of log
+            kind, timestamp, path_id, length = header_format.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                break
+            if kind == PATH:
+                paths[path_id] = data.decode('utf-8')
+            else:
+                key = (OPERATIONS[kind], paths[path_id])
+                records.setdefault(key, []).append((timestamp, kind, data))
+    return records
+
+class _ReplayFile(object):
+    def __init__(self, source, name):
+        self._source = source
+        self._name = name
+        self._data = b''
+        self._position = 0
+
+    def seek(self, offset, whence=0):
+        if offset == 0 and whence == 0:
+            self._data = self._source._next('read', self._name)
+        self._position = offset
+        return offset
+
+    def readinto(self, buffer):
+        chunk = self._data[self._position:self._position + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def close(self):
+        pass
+
+class ReplaySource(object):
+    """
+    File source that serves recorded data, each read of a file returning
+    the next recorded contents of that file. Files recorded only once
+    (like static sysfs attributes) are served the same contents each time;
+    reading past the end of any other file raises ReplayExhausted.
+    """
+
+    def __init__(self, records, name='replay'):
+        self.records = records
+        self.root = name
+        self.now = min([r[0][0] for r in records.values()] or [0])
+        self._cursors = {}
+
+    def _next(self, operation, name):
+        key = (operation, name)
+        versions = self.records.get(key)
+        if not versions:
+            raise OSError(errno.ENOENT, 'not recorded', name)
+        index = self._cursors.get(key, 0)
+        if index >= len(versions):
+            if len(versions) > 1:
+                raise ReplayExhausted(name)
+            index = 0
+        self._cursors[key] = index + 1
+
+        timestamp, kind, data = versions[index]
+        if timestamp > self.now:
+            self.now = timestamp
+        if kind == ERROR:
+            raise OSError(int(data), os.strerror(int(data)), name)
+        return data
+
+    def path(self, name):
+        return name
+
+    def open_raw(self, name):
+        return _ReplayFile(self, name)
+
+    def read_bytes(self, name):
+        return self._next('read', name)
+
+    def listdir(self, name):
+        data = self._next('list', name).decode('utf-8')
+        return data.split('\n') if data else []
+
+    def exists(self, name):
+        return self._next('exists', name) == b'1'
+
+_recorder = None
+
+def start_recording(path):
+    """
+    Starts recording all files read through j3lib.fs to the specified log.
+    """
+    global _recorder
+    stop_recording()
+    _recorder = Recorder(path)
+    fs.set_source(RecordingSource(fs.get_source(), _recorder))
+
+def stop_recording():
+    global _recorder
+    if _recorder:
+        source = fs.get_source()
+        fs.set_source(getattr(source, 'source', source))
+        _recorder.close()
+        _recorder = None
+
+# entry point, module, method
+ENTRIES = [
+    ('j3_cpu', 'j3_cpu', 'j3_cpu'),
+    ('j3_ram', 'j3_ram', 'j3_ram'),
+    ('j3_swap', 'j3_ram', 'j3_swap'),
+    ('j3_netio', 'j3_netio', 'j3_netio'),
+    ('j3_diskio', 'j3_diskio', 'j3_diskio'),
+    ('j3_battery', 'j3_battery', 'j3_battery'),
+    ('j3_pressure', 'j3_pressure', 'j3_pressure'),
+    ('j3_top', 'j3_top', 'j3_top'),
+]
+
+CONFIG = {
+    'color_good': '#00FF00',
+    'color_degraded': '#FFFF00',
+    'color_bad': '#FF0000',
+}
+
+def _create(entry, params):
+    from j3lib.py3stub import Py3Stub
+    label, module_name, method_name = entry
+    module = __import__(module_name)
+    instance = module.Py3status()
+    instance.py3 = Py3Stub()
+    for key, value in params.get(module_name, {}).items():
+        setattr(instance, key, value)
+    return getattr(instance, method_name)
+
+def replay(records, entry, params=None, on_result=None):
+    """
+    Calls the specified entry point with the recorded data until the data
+    runs out; returns the number of calls. Raises OSError if the entry point
+    reads a file that wasn't recorded. Passes the result of each call
+    to on_result (if specified).
+    """
+    source = ReplaySource(records)
+    clock = SAMPLER.clock
+    original = fs.get_source()
+    fs.set_source(source)
+    SAMPLER.clock = lambda: source.now
+    calls = 0
+    try:
+        # collect new data on every call
+        params = dict(params or {})
+        params[entry[1]] = dict(params.get(entry[1], {}), cache_timeout=0)
+        method = _create(entry, params)
+        # stop when out of data, or (for modules reading only files
+        # that never changed) after as many calls as the longest file
+        for _ in range(max(len(v) for v in records.values())):
+            result = method([], CONFIG)
+            calls += 1
+            if on_result:
+                on_result(source.now, result)
+    except ReplayExhausted:
+        pass
+    finally:
+        SAMPLER.clock = clock
+        fs.set_source(original)
+    return calls
+
+def record(path, entries, params=None, interval=1, duration=None):
+    """
+    Calls the specified entry points every interval seconds
+    (for duration seconds, or until interrupted), recording what they read.
+    """
+    from time import sleep
+    methods = [_create(entry, params or {}) for entry in entries]
+    start_recording(path)
+    start = time()
+    try:
+        while duration is None or time() - start < duration:
+            for method in methods:
+                method([], CONFIG)
+            sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_recording()
+
+def _parse_params(values):
+    from ast import literal_eval
+    params = {}
+    for value in values or []:
+        key, _, raw = value.partition('=')
+        module, _, name = key.partition('.')
+        try:
+            raw = literal_eval(raw)
+        except (ValueError, SyntaxError):
+            pass # use as string
+        params.setdefault(module, {})[name] = raw
+    return params
+
+def check():
+    """
+    Checks that a log of more path ids than fit in the older format
+    reads back intact, and that a failed write just stops recording.
+    """
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp(prefix='j3trace-')
+    try:
+        path = os.path.join(directory, 'trace.log')
+        recorder = Recorder(path)
+        count = MAX_PATHS + 5000
+        for pid in range(count):
+            recorder.record(READ, '/proc/{}/stat'.format(pid), str(pid).encode('ascii'), pid)
+        # paths seen before the ids started over keep their own records
+        recorder.record(READ, '/proc/0/stat', b'again', count)
+        recorder.close()
+        assert recorder.error is None, recorder.error
+        records = read_log(path)
+        assert len(records) == count, len(records)
+        assert [r[2] for r in records[('read', '/proc/0/stat')]] == [b'0', b'again']
+        assert records[('read', '/proc/{}/stat'.format(count - 1))][0][2] == str(count - 1).encode('ascii')
+
+        recorder = Recorder(path)
+        recorder._file.close() # as if the disk went away
+        recorder.record(READ, '/proc/stat', b'cpu')
+        assert recorder.error is not None
+        recorder.record(READ, '/proc/stat', b'cpu') # still doesn't raise
+        recorder.close()
+    finally:
+        shutil.rmtree(directory)
+    print('ok ({} paths)'.format(count))
+
+def main(argv):
+    import argparse
+    import cProfile
+    import pstats
+
+    parser = argparse.ArgumentParser(description='Record or replay j3 module traces.')
+    parser.add_argument('command', choices=['record', 'play', 'dump', 'check'])
+    parser.add_argument('log', nargs='?')
+    parser.add_argument('entries', nargs='*', help='entry points (default: all)')
+    parser.add_argument('--param', action='append', metavar='MODULE.NAME=VALUE',
+        help="set a module parameter (ie j3_netio.interfaces='*')")
+    parser.add_argument('--interval', type=float, default=1, help='seconds between recorded calls')
+    parser.add_argument('--duration', type=float, help='seconds to record')
+    parser.add_argument('--print', action='store_true', help='print the result of each call')
+    parser.add_argument('--profile', action='store_true', help='profile the replayed calls')
+    # allow entries after options
+    parse = getattr(parser, 'parse_intermixed_args', parser.parse_args)
+    args = parse(argv)
+
+    if args.command == 'check':
+        check()
+        return
+    if not args.log:
+        parser.error('the log argument is required')
+
+    entries = [e for e in ENTRIES if not args.entries or e[0] in args.entries]
+    params = _parse_params(args.param)
+
+    if args.command == 'record':
+        record(args.log, entries, params, args.interval, args.duration)
+        return
+
+    records = read_log(args.log)
+
+    if args.command == 'dump':
+        for (operation, name), versions in sorted(records.items()):
+            print('{:>7} {:>6} {:>9} {}'.format(
+                operation, len(versions), sum(len(v[2]) for v in versions), name))
+        return
+
+    for entry in entries:
+        on_result = None
+        if args.print:
+            on_result = lambda now, result: print('{:.3f} {}'.format(now / 1e9, result))
+        profile = cProfile.Profile() if args.profile else None
+        start = time()
+        if profile:
+            profile.enable()
+        try:
+            calls = replay(records, entry, params, on_result)
+        except (IOError, OSError) as e:
+            print('{:<12} skipped: {}'.format(entry[0], e))
+            continue
+        finally:
+            if profile:
+                profile.disable()
+        elapsed = time() - start
+        print('{:<12} {:>6} calls {:>10.1f} us/call'.format(
+            entry[0], calls, elapsed / (calls or 1) * 1e6))
+        if profile:
+            pstats.Stats(profile).sort_stats('cumulative').print_stats(15)
+
+if __name__ == "__main__":
+    # make the j3_* modules importable
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    main(sys.argv[1:])
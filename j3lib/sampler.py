@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Process-wide sampler that collects at most one snapshot per tick.
+
+Each j3 module asks the shared SAMPLER for the data it needs by key
+(usually the path of the kernel file it reads), passing a collect function
+to call when there's no fresh snapshot for that key. Module instances
+polling on the same schedule get the same snapshot, so each kernel file
+is read at most once per interval no matter how many instances use it.
+
+Snapshots are shared between callers, so don't modify them. Callers of
+the same key wait for each other while one collects, but not for
+callers of other keys (so a slow collector only holds up its own key).
+Snapshots are timestamped with a monotonic clock, in nanoseconds,
+so rates calculated between them aren't thrown off by changes to the
+system time (and don't count time spent suspended).
+"""
+
+from threading import Lock
+
+try:
+    from time import monotonic_ns
+except ImportError:
+    try:
+        from time import monotonic
+    except ImportError:
+        from time import time as monotonic # python2
+    def monotonic_ns():
+        return int(monotonic() * 1e9)
+
+class Sampler(object):
+    def __init__(self, clock=monotonic_ns):
+        # function returning current time in nanoseconds
+        # (replaced when replaying recorded data, see j3lib.replay)
+        self.clock = clock
+        # guards the maps (not held while collecting)
+        self._lock = Lock()
+        # map of key to lock held while collecting for that key
+        self._key_locks = {}
+        self._snapshots = {}
+
+    def sample(self, key, collect, max_age):
+        """
+        Returns a (timestamp in ns, data) tuple for the specified key,
+        calling collect() to get new data only if the last snapshot
+        for the key is at least max_age seconds old.
+
+        Callers usually pass half their own refresh interval as max_age,
+        so instances refreshing together share one snapshot,
+        while each instance still sees new data on each of its refreshes.
+        """
+        with self._lock:
+            key_lock = self._key_locks.get(key)
+            if key_lock is None:
+                key_lock = self._key_locks[key] = Lock()
+        with key_lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is None or self.clock() - snapshot[0] >= max_age * 1e9:
+                data = collect()
+                # timestamp data as of when collection finished
+                snapshot = (self.clock(), data)
+                with self._lock:
+                    self._snapshots[key] = snapshot
+            return snapshot
+
+    def clear(self):
+        with self._lock:
+            # (keeping the key locks, in case one is held)
+            self._snapshots.clear()
+
+SAMPLER = Sampler()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Timer scheduler for running modules in one process (see j3status.py).
+
+Each item is kept in a heap by its next deadline (on the monotonic clock),
+so waking up just takes the earliest deadline. Deadlines at least half a
+tick away are rounded up to the next whole tick of the wall clock (never
+earlier than the module's cached_until), and items due within a few ms of
+each other are run together, so modules refreshing every 1 and 5 seconds
+all wake the process once per tick, at the top of the second (like
+i3status), rather than each on its own schedule.
+
+wake() may be called from any thread (ie a module's background thread
+calling py3.update()) to run an item right away.
+"""
+
+from __future__ import division  # python2 compatibility
+from heapq import heappop, heappush
+from threading import Condition
+from time import time
+
+import math
+
+from j3lib.sampler import monotonic_ns
+
+def monotonic():
+    # seconds on the monotonic clock
+    return monotonic_ns() / 1e9
+
+class Scheduler(object):
+    """
+    Heap of items by deadline; wait() blocks until the next items are due.
+    """
+
+    def __init__(self, tick=1, slack=0.01):
+        self.tick = tick
+        self.slack = slack
+        self._condition = Condition()
+        # heap of (deadline, sequence number, item)
+        self._heap = []
+        # map of item to its current deadline (older heap entries are stale)
+        self._deadlines = {}
+        # items woken while not scheduled (ie running), to run again right away
+        self._woken = set()
+        self._sequence = 0
+
+    def align(self, delay, now=None):
+        """
+        Returns the specified delay (in seconds from now) extended to end
+        on the next whole tick of the wall clock, if at least half a tick;
+        never shorter than the delay. A delay ending just after a tick
+        (within the slack, as when a module called at the top of the second
+        asks to be called again a second later) is left as is, to be run
+        with the items of that tick rather than a whole tick late.
+        """
+        if now is None:
+            now = time()
+        if delay < self.tick / 2:
+            return max(0, delay)
+        aligned = math.ceil((now + delay - self.slack) / self.tick) * self.tick
+        return max(delay, aligned - now)
+
+    def schedule(self, item, delay):
+        """
+        Schedules the item to run after the specified delay (in seconds),
+        replacing any earlier schedule of the item.
+        """
+        with self._condition:
+            if item in self._woken:
+                self._woken.discard(item)
+                delay = 0
+            self._push(item, monotonic() + self.align(delay))
+
+    def wake(self, item):
+        """
+        Schedules the item to run right away (from any thread).
+        """
+        with self._condition:
+            deadline = self._deadlines.get(item)
+            if deadline is None:
+                self._woken.add(item)
+            elif deadline > monotonic():
+                self._push(item, 0)
+            self._condition.notify()
+
+    def wake_all(self):
+        with self._condition:
+            for item in list(self._deadlines):
+                self._push(item, 0)
+            self._condition.notify()
+
+    def _push(self, item, deadline):
+        self._sequence += 1
+        self._deadlines[item] = deadline
+        heappush(self._heap, (deadline, self._sequence, item))
+
+    def wait(self, timeout=None):
+        """
+        Blocks until items are due (or the timeout elapses); returns the
+        list of due items (earliest deadline first), unscheduling
+        them until scheduled again.
+        """
+        end = None if timeout is None else monotonic() + timeout
+        with self._condition:
+            while True:
+                now = monotonic()
+                heap = self._heap
+                # drop stale entries of rescheduled items
+                while heap and self._deadlines.get(heap[0][2]) != heap[0][0]:
+                    heappop(heap)
+                if heap and heap[0][0] <= now + self.slack:
+                    break
+                if end is not None and now >= end:
+                    return []
+                wait = None
+                if heap:
+                    wait = heap[0][0] - now
+                if end is not None:
+                    wait = end - now if wait is None else min(wait, end - now)
+                self._condition.wait(wait)
+
+            due = []
+            while heap and heap[0][0] <= now + self.slack:
+                deadline, _, item = heappop(heap)
+                if self._deadlines.get(item) == deadline:
+                    del self._deadlines[item]
+                    due.append(item)
+            return due
+
+if __name__ == "__main__":
+    """
+    Check the alignment of delays by calling this module directly.
+    """
+    import random
+    scheduler = Scheduler()
+    for _ in range(100000):
+        now = 1700000000 + random.uniform(0, 10)
+        delay = random.uniform(0, 10)
+        aligned = scheduler.align(delay, now)
+        assert aligned >= delay, (delay, now, aligned)
+        end = now + aligned
+        if delay >= 0.5 and end - round(end) > scheduler.slack:
+            raise AssertionError('not aligned to a tick: {} {}'.format(delay, now))
+        assert aligned < delay + 1, (delay, now, aligned)
+    assert abs(scheduler.align(1.003, 1700000000.0) - 1.003) < 1e-6
+    assert abs(scheduler.align(1.0, 1700000000.36) - 1.64) < 1e-6
+    assert abs(scheduler.align(5.3, 1700000000.0) - 6) < 1e-6
+    print('ok')
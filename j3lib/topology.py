@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+CPU topology (socket, core, and NUMA node of each logical CPU) from sysfs.
+"""
+
+from operator import itemgetter
+from threading import Lock
+
+import os
+import re
+
+from j3lib import fs
+
+CPU_ROOT = '/sys/devices/system/cpu'
+NODE_ROOT = '/sys/devices/system/node'
+
+def parse_cpulist(text):
+    """
+    Returns a list of the cpu ids in a cpulist string (ie '0-3,8-11').
+    """
+    ids = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        ids.extend(range(int(first), int(last or first) + 1))
+    return ids
+
+def _read_int(path, default):
+    try:
+        return int(fs.read_bytes(path))
+    except (IOError, OSError, ValueError):
+        return default
+
+class Topology(object):
+    """
+    Maps each logical CPU id to its socket, core, and NUMA node.
+    """
+
+    def __init__(self, cpu_root=CPU_ROOT, node_root=NODE_ROOT):
+        self.cpu_root = cpu_root
+        self.node_root = node_root
+        self.sockets = {}
+        self.cores = {}
+        self.nodes = {}
+        self.load()
+
+    def load(self):
+        sockets = {}
+        cores = {}
+        nodes = {}
+
+        try:
+            names = fs.listdir(self.cpu_root)
+        except OSError:
+            names = []
+        for name in names:
+            match = re.match(r'cpu(\d+)$', name)
+            if not match:
+                continue
+            cpu = int(match.group(1))
+            topology = os.path.join(self.cpu_root, name, 'topology')
+            socket = _read_int(os.path.join(topology, 'physical_package_id'), 0)
+            sockets[cpu] = socket
+            # core ids are only unique within a socket
+            cores[cpu] = (socket, _read_int(os.path.join(topology, 'core_id'), cpu))
+
+        try:
+            names = fs.listdir(self.node_root)
+        except OSError:
+            names = []
+        for name in names:
+            match = re.match(r'node(\d+)$', name)
+            if not match:
+                continue
+            try:
+                cpulist = fs.read_text(os.path.join(self.node_root, name, 'cpulist'))
+                for cpu in parse_cpulist(cpulist):
+                    nodes[cpu] = int(match.group(1))
+            except (IOError, OSError):
+                pass
+
+        self.sockets = sockets
+        self.cores = cores
+        self.nodes = nodes
+
+    def key(self, cpu, by):
+        """
+        Returns the key of the group ('socket', 'node', or 'core')
+        to which the specified cpu belongs.
+        """
+        if by == 'socket':
+            return self.sockets.get(cpu, 0)
+        if by == 'node':
+            return self.nodes.get(cpu, 0)
+        if by == 'core':
+            return self.cores.get(cpu, (0, cpu))
+        raise ValueError('unknown cpu grouping: {}'.format(by))
+
+    def groups(self, ids, by, buckets=1):
+        """
+        Returns a list of the positions in ids belonging to each group,
+        grouping the cpus by 'socket', 'node', 'core', or into the
+        specified number of 'bucket' groups of adjacent cpus.
+        """
+        if by == 'bucket':
+            count = len(ids)
+            buckets = max(1, min(buckets, count))
+            return [
+                list(range(count * b // buckets, count * (b + 1) // buckets))
+                for b in range(buckets)
+            ]
+
+        groups = {}
+        for position, cpu in enumerate(ids):
+            groups.setdefault(self.key(cpu, by), []).append(position)
+        return [groups[key] for key in sorted(groups)]
+
+def group_getters(groups):
+    """
+    Returns a list of functions (one per group) that each extract
+    a tuple of the values for one group's members from a sequence.
+    """
+    getters = []
+    for positions in groups:
+        if len(positions) == 1:
+            position = positions[0]
+            getters.append(lambda values, p=position: (values[p],))
+        else:
+            getters.append(itemgetter(*positions))
+    return getters
+
+_lock = Lock()
+# map of fs root to Topology
+_topologies = {}
+
+def get_topology():
+    """
+    Returns the process-wide Topology, reading it from sysfs on first use.
+    """
+    with _lock:
+        topology = _topologies.get(fs.get_root())
+        if topology is None:
+            topology = _topologies[fs.get_root()] = Topology()
+        return topology
+
+def reload_topology():
+    """
+    Re-reads the process-wide Topology (ie after a cpu is hotplugged).
+    """
+    topology = get_topology()
+    with _lock:
+        topology.load()
+    return topology
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Kernel uevents (ie power supply changes), delivered to subscribers
+from one background thread for the whole process.
+
+Events come from a netlink socket subscribed to kernel uevents;
+if that's unavailable (not linux, or not allowed), get_listener()
+returns None, and modules should fall back to polling. For tests,
+install a FakeUeventSource with set_source(), and emit() events into it.
+"""
+
+from threading import Lock, Thread
+
+import socket
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+NETLINK_KOBJECT_UEVENT = 15
+# multicast group of events sent by the kernel (udev re-broadcasts on group 2)
+KERNEL_GROUP = 1
+
+def parse_event(data):
+    """
+    Returns a dict of the key=value pairs in a raw kernel uevent message
+    (a 'action@devpath' header followed by null-terminated pairs).
+    """
+    event = {}
+    for field in data.split(b'\0')[1:]:
+        key, sep, value = field.partition(b'=')
+        if sep:
+            event[key.decode('ascii', 'replace')] = value.decode('utf-8', 'replace')
+    return event
+
+class NetlinkUeventSource(object):
+    """
+    Receives kernel uevents from a netlink socket.
+    """
+
+    buffer_size = 16384
+
+    def __init__(self):
+        self.socket = socket.socket(
+            socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        self.socket.bind((0, KERNEL_GROUP))
+
+    def receive(self):
+        """
+        Blocks until the next event; returns it as a dict.
+        """
+        return parse_event(self.socket.recv(self.buffer_size))
+
+    def close(self):
+        self.socket.close()
+
+class FakeUeventSource(object):
+    """
+    Source of events emitted by tests.
+    """
+
+    def __init__(self):
+        self.queue = Queue()
+
+    def emit(self, subsystem='power_supply', action='change', **properties):
+        event = dict(properties, SUBSYSTEM=subsystem, ACTION=action)
+        self.queue.put(event)
+
+    def receive(self):
+        return self.queue.get()
+
+    def close(self):
+        self.queue.put(None)
+
+class UeventListener(object):
+    """
+    Calls the subscribed callbacks with each event for their subsystem,
+    from a daemon thread that blocks on the source between events.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._lock = Lock()
+        self._subscriptions = []
+        self._closed = False
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def subscribe(self, subsystem, callback):
+        with self._lock:
+            self._subscriptions.append((subsystem, callback))
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s[1] != callback]
+
+    def _run(self):
+        while True:
+            try:
+                event = self.source.receive()
+            except (IOError, OSError):
+                return # socket closed
+            if event is None or self._closed:
+                return
+            with self._lock:
+                subscriptions = list(self._subscriptions)
+            for subsystem, callback in subscriptions:
+                if event.get('SUBSYSTEM') == subsystem:
+                    try:
+                        callback(event)
+                    except Exception:
+                        pass # don't let one subscriber stop the others
+
+    def close(self):
+        self._closed = True
+        self.source.close()
+
+_lock = Lock()
+_listener = None
+_unavailable = False
+
+def get_listener():
+    """
+    Returns the process-wide UeventListener,
+    or None if kernel uevents aren't available.
+    """
+    global _listener, _unavailable
+    with _lock:
+        if _listener is None and not _unavailable:
+            try:
+                _listener = UeventListener(NetlinkUeventSource())
+            except (AttributeError, IOError, OSError):
+                # no AF_NETLINK (not linux) or not permitted
+                _unavailable = True
+        return _listener
+
+def set_source(source):
+    """
+    Replaces the process-wide listener with one reading from the specified
+    source (ie a FakeUeventSource), or with None to use the kernel again.
+    """
+    global _listener, _unavailable
+    with _lock:
+        if _listener is not None:
+            _listener.close()
+        _listener = UeventListener(source) if source is not None else None
+        _unavailable = False
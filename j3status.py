@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+"""
+Run j3 modules without py3status, printing the i3bar protocol.
+
+Usage:
+    python j3status.py [-c CONFIG] [module ...]
+
+Loads the Py3status class of each module directly (from the j3_*.py files
+alongside this script), gives each instance a py3 stand-in (see
+j3lib.py3stub), and calls each of its entry points whenever the
+cached_until it last returned has passed, as scheduled by j3lib.scheduler.
+Modules may also ask to be refreshed right away (via py3.update()), and
+all modules are refreshed on SIGUSR1 (ie `killall -USR1 j3status`).
+
+Configure modules either as command-line arguments (with their default
+parameters, ie `j3_cpu j3_ram`), or in an ini-style config file (by default
+~/.config/j3status/config), with one section per module instance,
+in display order:
+
+    [general]
+    interval = 1
+    color_good = '#00FF00'
+
+    [j3_netio wan]
+    interfaces = 'eth0'
+    format = '{total} {interface}'
+
+    [j3_cpu]
+
+A section name is the module name, optionally followed by an instance name
+(for configuring multiple instances of the same module). Each parameter
+value is a python literal (ie 5, True, or '{total}'), or else a string.
+The general section sets the colors passed to modules (color_good,
+color_degraded, and color_bad), and the interval (in seconds) of the tick
+to which refreshes are aligned.
+
+Use as the status_command of a bar in your i3 config:
+
+    bar {
+        status_command python /path/to/j3status.py
+    }
+"""
+
+from __future__ import print_function
+from os.path import expanduser
+from threading import Thread
+from time import time
+
+import argparse
+import ast
+import json
+import os
+import signal
+import sys
+import traceback
+
+try:
+    from configparser import RawConfigParser
+except ImportError: # python2
+    from ConfigParser import RawConfigParser
+
+# make the shared j3lib package (and the modules) importable
+_here = os.path.dirname(os.path.abspath(__file__))
+if _here not in sys.path:
+    sys.path.insert(0, _here)
+
+from j3lib.py3stub import Py3Stub
+from j3lib.scheduler import Scheduler
+
+CONFIG_FILE = '~/.config/j3status/config'
+
+GENERAL = {
+    'color_good': '#00FF00',
+    'color_degraded': '#FFFF00',
+    'color_bad': '#FF0000',
+    'interval': 1,
+}
+
+# methods of a Py3status class that aren't entry points
+SPECIAL_METHODS = ('kill', 'on_click', 'post_config_hook')
+
+# seconds until retrying an entry point that raised an exception
+ERROR_TIMEOUT = 10
+
+def parse_value(value):
+    """
+    Returns the python literal in the specified string, or the string itself.
+    """
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value
+
+def read_config(path):
+    """
+    Returns the (general settings, list of (module, instance name, params))
+    from the specified ini-style config file.
+    """
+    parser = RawConfigParser()
+    # keep parameter names as written (ie rate_KB)
+    parser.optionxform = str
+    with open(path) as f:
+        if hasattr(parser, 'read_file'):
+            parser.read_file(f)
+        else: # python2
+            parser.readfp(f)
+
+    general = dict(GENERAL)
+    modules = []
+    for section in parser.sections():
+        params = dict((key, parse_value(value)) for key, value in parser.items(section))
+        if section == 'general':
+            general.update(params)
+            continue
+        name, _, instance = section.partition(' ')
+        modules.append((name, instance.strip(), params))
+    return general, modules
+
+class Entry(object):
+    """
+    One entry point of a module instance (named after its method, ie
+    j3_swap of j3_ram), and its last output block.
+    """
+    __slots__ = ('name', 'instance', 'method', 'block')
+
+    def __init__(self, name, instance, method):
+        self.name = name
+        self.instance = instance
+        self.method = method
+        self.block = None
+
+def load_entries(modules, update):
+    """
+    Returns a list of the Entry of each entry point of each of the specified
+    (module, instance name, params), in display order; update is called with
+    the entries of an instance whenever the instance asks to be refreshed.
+    """
+    entries = []
+    for name, instance_name, params in modules:
+        module = __import__(name)
+        instance = module.Py3status()
+        for key, value in params.items():
+            setattr(instance, key, value)
+
+        methods = sorted(
+            method for method in dir(instance)
+            if not method.startswith('_') and method not in SPECIAL_METHODS
+            and callable(getattr(instance, method))
+        )
+        instance_entries = [
+            Entry(method, instance_name, getattr(instance, method))
+            for method in methods
+        ]
+        instance.py3 = Py3Stub(lambda instance_entries=instance_entries: update(instance_entries))
+        entries.extend(instance_entries)
+    return entries
+
+class Runner(object):
+    """
+    Calls each entry when due, and prints the blocks of all entries
+    as one line of the i3bar protocol whenever any of them change.
+    """
+
+    def __init__(self, entries, general, output=None):
+        self.entries = entries
+        self.general = general
+        self.scheduler = Scheduler(general.get('interval', 1))
+        if output is None:
+            output = getattr(sys.stdout, 'buffer', sys.stdout)
+        self.output = output
+        self.last_line = None
+
+    def run_entry(self, entry):
+        """
+        Calls the entry; returns the seconds until it should be called again.
+        """
+        try:
+            response = entry.method([], self.general)
+        except Exception as e:
+            traceback.print_exc()
+            entry.block = {
+                'full_text': '{}: {}'.format(entry.name, e),
+                'color': self.general['color_bad'],
+            }
+            return ERROR_TIMEOUT
+
+        block = {'full_text': response.get('full_text', '')}
+        if response.get('color'):
+            block['color'] = response['color']
+        entry.block = block
+
+        cached_until = response.get('cached_until')
+        if cached_until is None:
+            # refresh modules without a cached_until every tick
+            return self.scheduler.tick
+        return cached_until - time()
+
+    def write(self, data):
+        self.output.write(data.encode('utf-8'))
+        self.output.flush()
+
+    def print_blocks(self):
+        blocks = []
+        for entry in self.entries:
+            if entry.block and entry.block['full_text']:
+                block = dict(entry.block, name=entry.name)
+                if entry.instance:
+                    block['instance'] = entry.instance
+                blocks.append(block)
+        line = json.dumps(blocks, ensure_ascii=False)
+        if line != self.last_line:
+            # each line but the first is preceded by a comma
+            self.write(line if self.last_line is None else ',' + line)
+            self.write('\n')
+            self.last_line = line
+
+    def run(self, iterations=None):
+        """
+        Runs every entry, and then each entry again when due, forever
+        (or for the specified number of wake-ups).
+        """
+        self.write(json.dumps({'version': 1}) + '\n[\n')
+        for entry in self.entries:
+            self.scheduler.schedule(entry, 0)
+        while iterations is None or iterations > 0:
+            due = self.scheduler.wait()
+            for entry in due:
+                self.scheduler.schedule(entry, self.run_entry(entry))
+            self.print_blocks()
+            if iterations is not None:
+                iterations -= 1
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('-c', '--config', help='path to config file (default: {})'.format(CONFIG_FILE))
+    parser.add_argument('modules', nargs='*', help='modules to run, instead of those in the config file')
+    args = parser.parse_args(argv)
+
+    general = dict(GENERAL)
+    modules = [(name, '', {}) for name in args.modules]
+    if not modules:
+        path = expanduser(args.config or CONFIG_FILE)
+        try:
+            general, modules = read_config(path)
+        except (IOError, OSError) as e:
+            parser.error('cannot read config file {}: {}'.format(path, e))
+    if not modules:
+        parser.error('no modules configured')
+
+    runner = None
+    def update(entries):
+        for entry in entries:
+            runner.scheduler.wake(entry)
+    runner = Runner(load_entries(modules, update), general)
+
+    def refresh(signum, frame):
+        # the handler may interrupt the scheduler, so wake it from another thread
+        thread = Thread(target=runner.scheduler.wake_all)
+        thread.daemon = True
+        thread.start()
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, refresh)
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main(sys.argv[1:])